@@ -2,23 +2,36 @@
 import os
 import sys
 import shutil
-import zipfile
 from datetime import datetime, date
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify, Response, stream_with_context
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_security import Security, SQLAlchemyUserDatastore, login_required as security_login_required, roles_required
 from flask_mailman import Mail
 from flask_toastr import Toastr
 from flask_talisman import Talisman
-from models import db, User, Role, WebAuthn, Cliente, Corso, Insegnante, Pagamento, Settings
-from utils.stampa_pdf import genera_ricevuta_pdf
-import tempfile
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, joinedload, undefer
+from models import db, User, Role, WebAuthn, Cliente, Corso, Insegnante, Pagamento, Settings, NumerazioneRicevute, MessaggioEmail
+from models.ricerca_clienti import filtro_ricerca, priorita_ricerca, corrisponde_esattamente
+from utils.stampa_pdf import genera_ricevuta_pdf, genera_ricevute_pdf, etag_ricevuta, invalida_ricevuta
+from utils.esportazione_ricevute import ids_ricevute, pagamenti_a_blocchi, stream_zip, stream_pdf_unico
+from utils.unione_pdf import pypdf_disponibile
+from utils.report import genera_report_data
+from utils.filtri_pagamenti import FiltroPagamenti, ordinamento_pagamenti
+from utils.paginazione import PaginazioneKeyset, Chiave
+from utils.profilazione_sql import init_profilazione_sql
+from utils.profilo_sqlite import init_profilo_sqlite
+from utils.cache_ricevute import init_cache_ricevute
+from utils.metriche_dashboard import init_metriche_dashboard
+from utils.tentativi_accesso import init_tentativi_accesso
+from utils.coda_email import init_coda_email, accoda_email, sveglia_invio
+from utils.invio_ricevute import accoda_ricevute
+from utils.backup_database import BackupOnline
+from utils.archivio_backup import init_backup_pianificati
 from cryptography.fernet import Fernet
 import base64
 import secrets
-from collections import defaultdict
-import time
 
 # Configurazione percorsi per PyInstaller
 if getattr(sys, 'frozen', False):
@@ -79,30 +92,10 @@ def decrypt_password(encrypted_password):
     except:
         return None
 
-# Sistema di protezione brute force
-login_attempts = defaultdict(list)
+# Sistema di protezione brute force (archivio tentativi: utils/tentativi_accesso.py)
 MAX_LOGIN_ATTEMPTS = int(os.environ.get('MAX_LOGIN_ATTEMPTS', 5))
 LOCKOUT_DURATION = int(os.environ.get('LOGIN_LOCKOUT_DURATION', 900))  # 15 minuti
 
-def is_ip_locked(ip_address):
-    """Verifica se IP è bloccato per troppi tentativi"""
-    now = time.time()
-    attempts = login_attempts[ip_address]
-    
-    # Rimuovi tentativi vecchi
-    attempts = [attempt for attempt in attempts if now - attempt < LOCKOUT_DURATION]
-    login_attempts[ip_address] = attempts
-    
-    return len(attempts) >= MAX_LOGIN_ATTEMPTS
-
-def record_failed_login(ip_address):
-    """Registra tentativo di login fallito"""
-    login_attempts[ip_address].append(time.time())
-
-def reset_login_attempts(ip_address):
-    """Reset tentativi dopo login riuscito"""
-    login_attempts[ip_address] = []
-
 # Carica variabili d'ambiente
 load_env_variables()
 
@@ -173,8 +166,8 @@ app.config['MAIL_SUPPRESS_SEND'] = True
 app.config['SECURITY_TEMPLATE_DIRECTORY'] = template_folder
 app.config['SECURITY_TWO_FACTOR_VERIFY_CODE_TEMPLATE'] = 'security/two_factor_verify_code.html'
 
-# Configurazione database SQLite
-database_path = os.path.join(base_path, 'data', 'database.db')
+# Configurazione database SQLite (DATABASE_PATH permette di usare un database diverso, es. per i benchmark)
+database_path = os.path.abspath(os.environ.get('DATABASE_PATH') or os.path.join(base_path, 'data', 'database.db'))
 os.makedirs(os.path.dirname(database_path), exist_ok=True)
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -182,6 +175,21 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Inizializza database
 db.init_app(app)
 
+# PRAGMA SQLite applicati a ogni connessione (WAL, busy_timeout, ...: vedi utils/profilo_sqlite.py)
+profilo_sqlite = init_profilo_sqlite(app, db)
+
+# Profilazione query SQL per richiesta (opzionale, SQL_PROFILING=True)
+profilatore_sql = init_profilazione_sql(app, db, base_path)
+
+# Cache su disco dei PDF delle ricevute (PDF_CACHE_MAX_MB=0 per disattivarla)
+cache_ricevute = init_cache_ricevute(app, base_path)
+
+# Metriche della dashboard in cache per processo (DASHBOARD_CACHE_SECONDS)
+metriche_dashboard = init_metriche_dashboard(app, db)
+
+# Tentativi di accesso falliti, condivisi tra i worker (LOGIN_ATTEMPTS_BACKEND)
+tentativi_accesso = init_tentativi_accesso(app, db, MAX_LOGIN_ATTEMPTS, LOCKOUT_DURATION)
+
 # Setup Flask-Security-Too (standard)
 user_datastore = SQLAlchemyUserDatastore(db, User, Role)
 security = Security(app, user_datastore)
@@ -190,28 +198,16 @@ security = Security(app, user_datastore)
 from flask_security.signals import user_authenticated, login_instructions_sent
 from flask import request, abort, flash
 
-def is_ip_locked(ip):
-    """Verifica se un IP è bloccato per troppi tentativi"""
-    if ip not in login_attempts:
-        return False
-    
-    now = datetime.now()
-    # Rimuovi tentativi troppo vecchi
-    login_attempts[ip] = [attempt for attempt in login_attempts[ip] 
-                         if (now - attempt).total_seconds() < LOCKOUT_DURATION]
-    
-    return len(login_attempts[ip]) >= MAX_LOGIN_ATTEMPTS
-
-def record_failed_login(ip):
-    """Registra un tentativo di login fallito"""
-    login_attempts[ip].append(datetime.now())
+def _ip_client():
+    """IP del client (dietro proxy quello in X-Forwarded-For)"""
+    return request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
 
 @app.before_request
 def check_brute_force():
     """Controlla brute force prima di ogni richiesta alle rotte di login"""
     if request.endpoint == 'security.login':
-        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-        if is_ip_locked(client_ip):
+        client_ip = _ip_client()
+        if tentativi_accesso.bloccato(client_ip):
             print(f"🚫 Tentativo di accesso bloccato per IP: {client_ip}")
             flash(f'Troppi tentativi di accesso. Riprova tra {LOCKOUT_DURATION//60} minuti.', 'error')
             return render_template('errors/429.html', lockout_minutes=LOCKOUT_DURATION//60), 429
@@ -219,9 +215,7 @@ def check_brute_force():
 @user_authenticated.connect_via(app)
 def on_user_authenticated(sender, user, **extra):
     """Pulisce tentativi falliti dopo login riuscito"""
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-    if client_ip in login_attempts:
-        del login_attempts[client_ip]
+    tentativi_accesso.azzera(_ip_client())
 
 # Gestione errori per brute force protection
 @app.errorhandler(429)
@@ -237,14 +231,14 @@ def track_login_attempts(response):
         request.method == 'POST' and 
         response.status_code == 200):  # 200 = rimane sulla pagina di login = fallito
         
-        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+        client_ip = _ip_client()
         
         # Registra tentativo fallito
-        record_failed_login(client_ip)
+        tentativi_accesso.registra_fallimento(client_ip)
         print(f"🔒 Login fallito registrato per IP: {client_ip}")
         
         # Controlla se deve essere bloccato
-        if is_ip_locked(client_ip):
+        if tentativi_accesso.bloccato(client_ip):
             print(f"🚫 IP {client_ip} bloccato dopo troppi tentativi")
             # Modifica la risposta per mostrare il blocco
             flash(f'Troppi tentativi di accesso. IP bloccato per {LOCKOUT_DURATION//60} minuti.', 'error')
@@ -266,7 +260,7 @@ app.config['TOASTR_POSITION_CLASS'] = 'toast-top-right'
 def inject_settings():
     from datetime import datetime
     try:
-        settings = Settings.get_settings()
+        settings = Settings.get_settings_cached()
         return dict(
             global_settings=settings,
             email_configured=settings.mail_configured if settings else False,
@@ -307,8 +301,15 @@ def euro_filter(value):
 pdf_folder = os.path.join(base_path, 'pdf_ricevute')
 os.makedirs(pdf_folder, exist_ok=True)
 
+# Versione delle impostazioni applicata alla configurazione email di questo processo
+mail_config_versione = None
+
 def update_mail_config(settings):
-    """Aggiorna la configurazione Flask-Mail dinamicamente"""
+    """Aggiorna la configurazione Flask-Mail dinamicamente (solo se le impostazioni sono cambiate)"""
+    global mail_config_versione
+    if settings.versione is not None and settings.versione == mail_config_versione:
+        return
+    
     if settings.mail_configured:
         app.config['MAIL_SERVER'] = settings.mail_server
         app.config['MAIL_PORT'] = settings.mail_port
@@ -343,12 +344,20 @@ def update_mail_config(settings):
         app.config['SECURITY_REGISTERABLE'] = False # Disabilita registrazione
         
         print("⚠ Email non configurata - funzionalità email disabilitate")
+    
+    mail_config_versione = settings.versione
+
+# Coda delle email in uscita, inviate in background (EMAIL_OUTBOX_WORKER=False per disattivare il thread)
+coda_email = init_coda_email(app, update_mail_config)
+
+# Backup incrementali automatici del database e delle ricevute (BACKUP_SCHEDULE_MINUTES=0 per disattivarli)
+backup_pianificati = init_backup_pianificati(app, database_path, [pdf_folder], base_path)
 
 def init_mail_config():
     """Inizializza la configurazione email all'avvio"""
     try:
         with app.app_context():
-            settings = Settings.get_settings()
+            settings = Settings.get_settings_cached()
             update_mail_config(settings)
     except Exception as e:
         print(f"⚠ Errore inizializzazione email: {str(e)}")
@@ -426,40 +435,29 @@ def admin_security():
     """Pagina amministrazione sicurezza - visualizza IP bloccati"""
     from flask_security import current_user
     
-    # Prepara dati sugli IP bloccati
-    blocked_ips = []
-    now = datetime.now()
-    
-    for ip, attempts in login_attempts.items():
-        # Rimuovi tentativi scaduti
-        valid_attempts = [attempt for attempt in attempts 
-                         if (now - attempt).total_seconds() < LOCKOUT_DURATION]
-        login_attempts[ip] = valid_attempts
-        
-        if len(valid_attempts) >= MAX_LOGIN_ATTEMPTS:
-            last_attempt = max(valid_attempts)
-            remaining_time = LOCKOUT_DURATION - (now - last_attempt).total_seconds()
-            
-            blocked_ips.append({
-                'ip': ip,
-                'attempts': len(valid_attempts),
-                'last_attempt': last_attempt,
-                'remaining_minutes': max(0, int(remaining_time / 60)),
-                'remaining_seconds': max(0, int(remaining_time % 60))
-            })
+    # IP bloccati (i tentativi scaduti vengono ignorati)
+    blocked_ips = tentativi_accesso.bloccati()
     
     return render_template('admin/security.html', 
                          blocked_ips=blocked_ips,
                          max_attempts=MAX_LOGIN_ATTEMPTS,
                          lockout_minutes=LOCKOUT_DURATION//60)
 
+@app.route('/admin/sql-stats')
+@login_required
+@roles_required('admin')
+def admin_statistiche_sql():
+    """Statistiche SQL delle ultime richieste (richiede SQL_PROFILING=True)"""
+    if profilatore_sql is None:
+        return jsonify({'abilitata': False, 'messaggio': 'Profilazione SQL disattivata: impostare SQL_PROFILING=True'})
+    return jsonify(profilatore_sql.riepilogo())
+
 @app.route('/admin/security/unblock/<ip>')
 @login_required
 @roles_required('admin')
 def unblock_ip(ip):
     """Sblocca un IP specifico"""
-    if ip in login_attempts:
-        del login_attempts[ip]
+    if tentativi_accesso.azzera(ip):
         flash(f'IP {ip} sbloccato con successo', 'success')
     else:
         flash(f'IP {ip} non era bloccato', 'info')
@@ -471,8 +469,7 @@ def unblock_ip(ip):
 @roles_required('admin')
 def clear_all_blocked_ips():
     """Sblocca tutti gli IP"""
-    count = len(login_attempts)
-    login_attempts.clear()
+    count = tentativi_accesso.azzera_tutti()
     flash(f'{count} IP sbloccati con successo', 'success')
     return redirect(url_for('admin_security'))
 
@@ -564,26 +561,77 @@ def elimina_utente(id):
 @app.route('/')
 @login_required  
 def dashboard():
-    # Statistiche dashboard
-    total_clienti = Cliente.query.filter_by(attivo=True).count()
-    total_corsi = Corso.query.count()
-    total_insegnanti = Insegnante.query.count()
-    
-    # Pagamenti del mese corrente
-    mese_corrente = date.today().month
-    anno_corrente = date.today().year
-    pagamenti_mese = Pagamento.query.filter_by(mese=mese_corrente, anno=anno_corrente).all()
-    incasso_mese = sum(p.importo for p in pagamenti_mese if p.pagato)
-    debiti_mese = sum(p.importo for p in pagamenti_mese if not p.pagato)
+    # Statistiche e andamento incassi da un'unica query aggregata (in cache)
+    metriche = metriche_dashboard.leggi()
+    andamento = metriche['andamento']
+    massimo_andamento = max(mese['incassato'] for mese in andamento)
     
     return render_template('dashboard.html', 
-                         total_clienti=total_clienti,
-                         total_corsi=total_corsi, 
-                         total_insegnanti=total_insegnanti,
-                         incasso_mese=incasso_mese,
-                         debiti_mese=debiti_mese,
-                         mese_corrente=mese_corrente,
-                         anno_corrente=anno_corrente)
+                         massimo_andamento=massimo_andamento,
+                         mesi_nomi=MESI_NOMI,
+                         **metriche)
+
+# API RICERCA (select con ricerca remota)
+# Risultati per pagina delle select: default e massimo accettato
+RISULTATI_SELEZIONE = 20
+MAX_RISULTATI_SELEZIONE = 50
+
+def _esistono(query):
+    """True se la query ha almeno un risultato (per i messaggi delle select vuote)"""
+    return db.session.query(query.exists()).scalar()
+
+def _parametri_selezione():
+    """Testo cercato, pagina e numero di risultati (limitato) della richiesta"""
+    termine = request.args.get('q', '').strip()[:100]
+    pagina = max(request.args.get('page', 1, type=int), 1)
+    limite = min(max(request.args.get('limit', RISULTATI_SELEZIONE, type=int), 1), MAX_RISULTATI_SELEZIONE)
+    return termine, pagina, limite
+
+def _risposta_selezione(query, pagina, limite, elemento):
+    """
+    JSON compatto nel formato delle select ({results, pagination.more}) con ETag:
+    se il browser ha già gli stessi risultati riceve un 304 senza corpo.
+    """
+    righe = query.limit(limite + 1).offset((pagina - 1) * limite).all()
+    response = jsonify({
+        'results': [elemento(riga) for riga in righe[:limite]],
+        'pagination': {'more': len(righe) > limite}
+    })
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/clienti/search')
+@login_required
+def api_cerca_clienti():
+    """Clienti attivi per le select: ricerca full-text, corrispondenze esatte per prime"""
+    termine, pagina, limite = _parametri_selezione()
+    query = db.session.query(Cliente.id, Cliente.nome, Cliente.cognome, Cliente.codice_fiscale) \
+        .filter(Cliente.attivo == True)
+    ordine = [Cliente.cognome, Cliente.nome, Cliente.id]
+    if termine:
+        query = query.filter(filtro_ricerca(termine))
+        ordine.insert(0, priorita_ricerca(termine))
+    return _risposta_selezione(query.order_by(*ordine), pagina, limite, lambda cliente: {
+        'id': cliente.id,
+        'text': f"{cliente.nome} {cliente.cognome}",
+        'dettaglio': cliente.codice_fiscale
+    })
+
+@app.route('/api/corsi/search')
+@login_required
+def api_cerca_corsi():
+    """Corsi per le select: ogni parola cercata in nome, giorno o orario"""
+    termine, pagina, limite = _parametri_selezione()
+    orario = db.func.strftime('%H:%M', Corso.orario)
+    query = db.session.query(Corso.id, Corso.nome, Corso.giorno, orario.label('orario'))
+    for parola in termine.split()[:8]:
+        query = query.filter(Corso.nome.contains(parola) | Corso.giorno.contains(parola) | orario.contains(parola))
+    return _risposta_selezione(query.order_by(Corso.nome, Corso.id), pagina, limite, lambda corso: {
+        'id': corso.id,
+        'text': corso.nome,
+        'dettaglio': f"{corso.giorno} {corso.orario}"
+    })
 
 # CLIENTI ROUTES
 @app.route('/clienti')
@@ -609,38 +657,38 @@ def clienti():
     if sort_by not in valid_sort_fields:
         sort_by = 'cognome'
     
-    query = Cliente.query
+    # Corsi di tutti i clienti della pagina con una sola query aggiuntiva
+    query = Cliente.query.options(selectinload(Cliente.corsi))
     
+    # Ricerca full-text (indice clienti_fts) su nome, cognome, email, codice fiscale e telefono
     if search:
-        query = query.filter(
-            (Cliente.nome.contains(search)) | 
-            (Cliente.cognome.contains(search)) |
-            (Cliente.email.contains(search)) |
-            (Cliente.codice_fiscale.contains(search)) |
-            (Cliente.telefono.contains(search))
-        )
+        query = query.filter(filtro_ricerca(search))
     
     if stato == 'attivi':
         query = query.filter_by(attivo=True)
     elif stato == 'inattivi':
         query = query.filter_by(attivo=False)
     
-    # Ordinamento dinamico
-    sort_column = getattr(Cliente, sort_by)
-    if sort_order == 'desc':
-        query = query.order_by(sort_column.desc())
-    else:
-        query = query.order_by(sort_column.asc())
-    
-    # Ordinamento secondario per consistenza
+    # Ordinamento dinamico, con cognome come ordinamento secondario per consistenza
+    # e id finale per un ordine univoco (necessario alla paginazione keyset)
+    discendente = sort_order == 'desc'
+    chiavi = [Chiave(getattr(Cliente, sort_by), discendente)]
+    if search:
+        # Prima i clienti con codice fiscale o telefono identici al testo cercato
+        chiavi.insert(0, Chiave(priorita_ricerca(search),
+                                valore=lambda cliente: corrisponde_esattamente(cliente, search)))
     if sort_by != 'cognome':
-        query = query.order_by(sort_column.desc() if sort_order == 'desc' else sort_column.asc(), Cliente.cognome)
-    
-    # Paginazione
-    clienti = query.paginate(
+        chiavi.append(Chiave(Cliente.cognome))
+    chiavi.append(Chiave(Cliente.id, discendente))
+    
+    # Paginazione: keyset con cursore, per numero di pagina altrimenti.
+    # Il conteggio si fa solo senza cursore, poi viaggia nel cursore stesso
+    clienti = PaginazioneKeyset(
+        query,
+        chiavi,
         page=page,
         per_page=per_page,
-        error_out=False
+        cursore=request.args.get('cursore')
     )
     
     return render_template('clienti.html', 
@@ -693,13 +741,14 @@ def nuovo_cliente():
         flash('Cliente creato con successo!', 'success')
         return redirect(url_for('clienti'))
     
-    corsi = Corso.query.all()
-    return render_template('cliente_form.html', cliente=None, corsi=corsi)
+    return render_template('cliente_form.html', cliente=None, ci_sono_corsi=_esistono(Corso.query))
 
 @app.route('/clienti/<int:id>')
 @login_required
 def dettagli_cliente(id):
-    cliente = Cliente.query.get_or_404(id)
+    cliente = Cliente.query.options(
+        selectinload(Cliente.pagamenti).joinedload(Pagamento.corso)
+    ).get_or_404(id)
     return render_template('cliente_view.html', cliente=cliente)
 
 @app.route('/clienti/<int:id>/modifica', methods=['GET', 'POST'])
@@ -743,8 +792,7 @@ def modifica_cliente(id):
         flash('Cliente modificato con successo!', 'success')
         return redirect(url_for('clienti'))
     
-    corsi = Corso.query.all()
-    return render_template('cliente_form.html', cliente=cliente, corsi=corsi)
+    return render_template('cliente_form.html', cliente=cliente, ci_sono_corsi=_esistono(Corso.query))
 
 @app.route('/clienti/<int:id>/elimina', methods=['POST'])
 @login_required
@@ -798,7 +846,11 @@ def calcola_codice_fiscale():
 @app.route('/corsi')
 @login_required
 def corsi():
-    corsi = Corso.query.all()
+    # La lista mostra insegnante e nomi degli iscritti di ogni corso
+    corsi = Corso.query.options(
+        joinedload(Corso.insegnante),
+        selectinload(Corso.clienti)
+    ).all()
     return render_template('corsi.html', corsi=corsi)
 
 @app.route('/corsi/nuovo', methods=['GET', 'POST'])
@@ -826,7 +878,12 @@ def nuovo_corso():
 @app.route('/corsi/<int:id>')
 @login_required
 def dettagli_corso(id):
-    corso = Corso.query.get_or_404(id)
+    # Degli iscritti serve solo il numero: conteggio in SQL invece della relazione
+    corso = Corso.query.options(
+        joinedload(Corso.insegnante),
+        selectinload(Corso.pagamenti).joinedload(Pagamento.cliente),
+        undefer(Corso.conteggio_iscritti)
+    ).get_or_404(id)
     return render_template('corso_view.html', corso=corso)
 
 @app.route('/corsi/<int:id>/modifica', methods=['GET', 'POST'])
@@ -864,7 +921,7 @@ def elimina_corso(id):
 @app.route('/insegnanti')
 @login_required
 def insegnanti():
-    insegnanti = Insegnante.query.all()
+    insegnanti = Insegnante.query.options(selectinload(Insegnante.corsi)).all()
     return render_template('insegnanti.html', insegnanti=insegnanti)
 
 @app.route('/insegnanti/nuovo', methods=['GET', 'POST'])
@@ -894,7 +951,9 @@ def nuovo_insegnante():
 @app.route('/insegnanti/<int:id>')
 @login_required
 def dettagli_insegnante(id):
-    insegnante = Insegnante.query.get_or_404(id)
+    insegnante = Insegnante.query.options(
+        selectinload(Insegnante.corsi).undefer(Corso.conteggio_iscritti)
+    ).get_or_404(id)
     return render_template('insegnante_view.html', insegnante=insegnante)
 
 @app.route('/insegnanti/<int:id>/modifica', methods=['GET', 'POST'])
@@ -934,34 +993,10 @@ def elimina_insegnante(id):
 @app.route('/pagamenti')
 @login_required
 def pagamenti():
-    # Parametri di filtro esistenti
-    mese = request.args.get('mese', type=int)
-    anno = request.args.get('anno', type=int)
-    giorno = request.args.get('giorno', type=int)  # Nuovo filtro per giorno
-    data_specifica = request.args.get('data_specifica')  # HTML5 date input formato YYYY-MM-DD
-
-    # Nuovo parametro: tipo di filtro data (periodo o data_pagamento)
-    tipo_filtro_data = request.args.get('tipo_filtro_data', 'periodo')  # 'periodo' o 'data_pagamento'
-    if tipo_filtro_data not in ['periodo', 'data_pagamento']:
-        tipo_filtro_data = 'periodo'
-
-    # Se viene fornita data_specifica, sovrascrive giorno/mese/anno
-    if data_specifica:
-        try:
-            from datetime import datetime
-            data_obj = datetime.strptime(data_specifica, '%Y-%m-%d')
-            giorno = data_obj.day
-            mese = data_obj.month
-            anno = data_obj.year
-        except (ValueError, TypeError):
-            data_specifica = None
-    cliente_id = request.args.get('cliente_id', type=int)
-    corso_id = request.args.get('corso_id', type=int)
-    metodo_pagamento = request.args.get('metodo_pagamento', '')
-
-    # Nuovi parametri per ricerca, ordinamento e paginazione
-    search = request.args.get('search', '')
-    stato = request.args.get('stato', 'tutti')  # tutti, pagati, non_pagati
+    # Filtri (periodo, data pagamento, cliente, corso, metodo, ricerca, stato)
+    filtro = FiltroPagamenti.da_richiesta(request.args)
+
+    # Parametri per ordinamento e paginazione
     sort_by = request.args.get('sort_by', 'data_creazione')
     sort_order = request.args.get('sort_order', 'desc')
     page = request.args.get('page', 1, type=int)
@@ -978,216 +1013,56 @@ def pagamenti():
     if sort_by not in valid_sort_fields:
         sort_by = 'data_creazione'
     
-    # Query base con join per ricerca
-    query = Pagamento.query.join(Cliente).join(Corso)
-
-    # Filtri temporali basati su tipo_filtro_data
-    if tipo_filtro_data == 'periodo':
-        # Filtra per periodo di competenza (mese/anno del pagamento)
-        if mese:
-            query = query.filter(Pagamento.mese == mese)
-        if anno:
-            query = query.filter(Pagamento.anno == anno)
-        if giorno and mese and anno:
-            # Per il filtro periodo con giorno specifico, non ha molto senso
-            # ma manteniamo compatibilità: filtra per data_pagamento
-            from datetime import date
-            try:
-                data_specifica_obj = date(anno, mese, giorno)
-                query = query.filter(db.func.date(Pagamento.data_pagamento) == data_specifica_obj)
-            except (ValueError, TypeError):
-                pass
-    elif tipo_filtro_data == 'data_pagamento':
-        # Filtra per data effettiva di pagamento
-        from datetime import date
-        if giorno and mese and anno:
-            # Filtro per giorno specifico
-            try:
-                data_specifica_obj = date(anno, mese, giorno)
-                query = query.filter(db.func.date(Pagamento.data_pagamento) == data_specifica_obj)
-            except (ValueError, TypeError):
-                pass
-        elif mese and anno:
-            # Filtro per mese/anno di pagamento
-            query = query.filter(
-                db.extract('month', Pagamento.data_pagamento) == mese,
-                db.extract('year', Pagamento.data_pagamento) == anno
-            )
-        elif anno:
-            # Filtro solo per anno di pagamento
-            query = query.filter(db.extract('year', Pagamento.data_pagamento) == anno)
-
-    if cliente_id:
-        query = query.filter(Pagamento.cliente_id == cliente_id)
-    if corso_id:
-        query = query.filter(Pagamento.corso_id == corso_id)
-    if metodo_pagamento:
-        query = query.filter(Pagamento.metodo_pagamento == metodo_pagamento)
-
-    # Ricerca live
-    if search:
-        query = query.filter(
-            (Cliente.nome.contains(search)) | 
-            (Cliente.cognome.contains(search)) |
-            (Corso.nome.contains(search)) |
-            (Pagamento.metodo_pagamento.contains(search)) |
-            (Pagamento.note.contains(search))
-        )
+    # Query filtrata con join su cliente e corso (caricati insieme ai pagamenti)
+    query = filtro.query()
     
-    # Filtro stato pagamento
-    if stato == 'pagati':
-        query = query.filter(Pagamento.pagato == True)
-    elif stato == 'non_pagati':
-        query = query.filter(Pagamento.pagato == False)
-    
-    # Ordinamento dinamico
-    if sort_by == 'periodo':
-        sort_column = Pagamento.anno.desc() if sort_order == 'desc' else Pagamento.anno.asc()
-        query = query.order_by(sort_column, Pagamento.mese.desc() if sort_order == 'desc' else Pagamento.mese.asc())
-    elif sort_by == 'cliente':
-        sort_column = Cliente.cognome.desc() if sort_order == 'desc' else Cliente.cognome.asc()
-        query = query.order_by(sort_column, Cliente.nome)
-    elif sort_by == 'corso':
-        sort_column = Corso.nome.desc() if sort_order == 'desc' else Corso.nome.asc()
-        query = query.order_by(sort_column)
-    elif sort_by == 'numero_ricevuta':
-        sort_column = Pagamento.numero_ricevuta.desc() if sort_order == 'desc' else Pagamento.numero_ricevuta.asc()
-        query = query.order_by(sort_column)
-    elif sort_by == 'importo':
-        sort_column = Pagamento.importo.desc() if sort_order == 'desc' else Pagamento.importo.asc()
-        query = query.order_by(sort_column)
-    elif sort_by == 'stato':
-        sort_column = Pagamento.pagato.desc() if sort_order == 'desc' else Pagamento.pagato.asc()
-        query = query.order_by(sort_column)
-    elif sort_by == 'data_pagamento':
-        sort_column = Pagamento.data_pagamento.desc() if sort_order == 'desc' else Pagamento.data_pagamento.asc()
-        query = query.order_by(sort_column)
-    else:  # data_creazione (default)
-        sort_column = Pagamento.data_creazione.desc() if sort_order == 'desc' else Pagamento.data_creazione.asc()
-        query = query.order_by(sort_column)
-    
-    # PRIMA della paginazione, calcola i totali su TUTTI i record filtrati
-    # Questi totali devono riflettere TUTTI i pagamenti che soddisfano i filtri,
-    # non solo quelli della pagina corrente
-
-    # Clona la query base per calcolare i totali (senza ordinamento che non serve per le somme)
-    query_for_totals = Pagamento.query.join(Cliente).join(Corso)
-
-    # Applica gli stessi filtri temporali della query principale
-    if tipo_filtro_data == 'periodo':
-        # Filtra per periodo di competenza
-        if mese:
-            query_for_totals = query_for_totals.filter(Pagamento.mese == mese)
-        if anno:
-            query_for_totals = query_for_totals.filter(Pagamento.anno == anno)
-        if giorno and mese and anno:
-            from datetime import date
-            try:
-                data_specifica_calc = date(anno, mese, giorno)
-                query_for_totals = query_for_totals.filter(db.func.date(Pagamento.data_pagamento) == data_specifica_calc)
-            except (ValueError, TypeError):
-                pass
-    elif tipo_filtro_data == 'data_pagamento':
-        # Filtra per data effettiva di pagamento
-        from datetime import date
-        if giorno and mese and anno:
-            try:
-                data_specifica_calc = date(anno, mese, giorno)
-                query_for_totals = query_for_totals.filter(db.func.date(Pagamento.data_pagamento) == data_specifica_calc)
-            except (ValueError, TypeError):
-                pass
-        elif mese and anno:
-            query_for_totals = query_for_totals.filter(
-                db.extract('month', Pagamento.data_pagamento) == mese,
-                db.extract('year', Pagamento.data_pagamento) == anno
-            )
-        elif anno:
-            query_for_totals = query_for_totals.filter(db.extract('year', Pagamento.data_pagamento) == anno)
-
-    if cliente_id:
-        query_for_totals = query_for_totals.filter(Pagamento.cliente_id == cliente_id)
-    if corso_id:
-        query_for_totals = query_for_totals.filter(Pagamento.corso_id == corso_id)
-    if metodo_pagamento:
-        query_for_totals = query_for_totals.filter(Pagamento.metodo_pagamento == metodo_pagamento)
-    if search:
-        query_for_totals = query_for_totals.filter(
-            (Cliente.nome.contains(search)) |
-            (Cliente.cognome.contains(search)) |
-            (Corso.nome.contains(search)) |
-            (Pagamento.metodo_pagamento.contains(search)) |
-            (Pagamento.note.contains(search))
-        )
-    if stato == 'pagati':
-        query_for_totals = query_for_totals.filter(Pagamento.pagato == True)
-    elif stato == 'non_pagati':
-        query_for_totals = query_for_totals.filter(Pagamento.pagato == False)
-
-    # Calcola i totali
-    # Totale incassato (pagamenti pagati) - se già filtrati per stato, usa query diretta
-    if stato == 'pagati':
-        totale_incassato = query_for_totals.with_entities(db.func.sum(Pagamento.importo)).scalar() or 0
-        totale_da_incassare = 0
-    elif stato == 'non_pagati':
-        totale_incassato = 0
-        totale_da_incassare = query_for_totals.with_entities(db.func.sum(Pagamento.importo)).scalar() or 0
-    else:
-        # Se nessun filtro stato, calcola separatamente
-        query_pagati = query_for_totals.filter(Pagamento.pagato == True)
-        query_non_pagati = query_for_totals.filter(Pagamento.pagato == False)
-        totale_incassato = query_pagati.with_entities(db.func.sum(Pagamento.importo)).scalar() or 0
-        totale_da_incassare = query_non_pagati.with_entities(db.func.sum(Pagamento.importo)).scalar() or 0
-
-    # Totale complessivo
-    totale_complessivo = query_for_totals.with_entities(db.func.sum(Pagamento.importo)).scalar() or 0
+    # Totali su TUTTI i record filtrati (non solo la pagina corrente) e incassato
+    # del giorno, calcolati con un'unica query di aggregazione condizionale
+    totali = filtro.totali()
 
-    # Paginazione
-    pagamenti_paginated = query.paginate(
+    # Paginazione keyset sulla colonna di ordinamento + id (con cursore),
+    # oppure per numero di pagina; il totale arriva già dalla query dei totali
+    pagamenti_paginated = PaginazioneKeyset(
+        query,
+        ordinamento_pagamenti(sort_by, sort_order),
         page=page,
         per_page=per_page,
-        error_out=False
+        cursore=request.args.get('cursore'),
+        totale=totali['numero_pagamenti']
     )
 
-    # Calcola il totale incassato per il giorno (solo pagamenti effettuati)
-    totale_giornaliero = 0
-    if giorno and mese and anno:
-        from datetime import date
-        try:
-            data_specifica = date(anno, mese, giorno)
-            pagamenti_giorno = Pagamento.query.filter(
-                db.func.date(Pagamento.data_pagamento) == data_specifica,
-                Pagamento.pagato == True
-            ).all()
-            totale_giornaliero = sum(p.importo for p in pagamenti_giorno)
-        except (ValueError, TypeError):
-            totale_giornaliero = 0
+    data_specifica = filtro.intervallo_giorno[0].date() if filtro.intervallo_giorno else filtro.data_specifica
+    
+    # Select cliente e corso con ricerca remota: serve solo l'elemento filtrato
+    cliente_selezionato = db.session.get(Cliente, filtro.cliente_id) if filtro.cliente_id else None
+    corso_selezionato = db.session.get(Corso, filtro.corso_id) if filtro.corso_id else None
     
-    # Dati per select
-    clienti = Cliente.query.filter_by(attivo=True).order_by(Cliente.cognome, Cliente.nome).all()
-    corsi = Corso.query.order_by(Corso.nome).all()
+    # Ultima email di ricevuta dei pagamenti della pagina (una query)
+    email_ricevute = MessaggioEmail.ultimo_per_pagamento([p.id for p in pagamenti_paginated.items])
     
     return render_template('pagamenti.html',
                          pagamenti=pagamenti_paginated.items,
                          pagamenti_paginated=pagamenti_paginated,
-                         clienti=clienti,
-                         corsi=corsi,
-                         mese_filtro=mese,
-                         anno_filtro=anno,
-                         giorno_filtro=giorno,
+                         email_ricevute=email_ricevute,
+                         cliente_selezionato=cliente_selezionato,
+                         corso_selezionato=corso_selezionato,
+                         mese_filtro=filtro.mese,
+                         anno_filtro=filtro.anno,
+                         giorno_filtro=filtro.giorno,
                          data_specifica=data_specifica,
-                         totale_giornaliero=totale_giornaliero,
-                         cliente_filtro=cliente_id,
-                         corso_filtro=corso_id,
-                         metodo_pagamento_filtro=metodo_pagamento,
-                         search=search,
-                         stato=stato,
-                         tipo_filtro_data=tipo_filtro_data,
+                         totale_giornaliero=totali['totale_giornaliero'],
+                         cliente_filtro=filtro.cliente_id,
+                         corso_filtro=filtro.corso_id,
+                         metodo_pagamento_filtro=filtro.metodo_pagamento,
+                         search=filtro.search,
+                         stato=filtro.stato,
+                         tipo_filtro_data=filtro.tipo_filtro_data,
                          sort_by=sort_by,
                          sort_order=sort_order,
                          per_page=per_page,
-                         totale_incassato=totale_incassato,
-                         totale_da_incassare=totale_da_incassare,
-                         totale_complessivo=totale_complessivo)
+                         totale_incassato=totali['totale_incassato'],
+                         totale_da_incassare=totali['totale_da_incassare'],
+                         totale_complessivo=totali['totale_complessivo'])
 
 @app.route('/pagamenti/nuovo', methods=['GET', 'POST'])
 @login_required
@@ -1203,17 +1078,23 @@ def nuovo_pagamento():
             note=request.form.get('note', '')
         )
         db.session.add(pagamento)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Esiste già un pagamento per questo cliente, corso e periodo', 'error')
+            return redirect(url_for('nuovo_pagamento', corso_id=pagamento.corso_id))
         flash('Pagamento creato con successo!', 'success')
         return redirect(url_for('pagamenti'))
     
-    clienti = Cliente.query.filter_by(attivo=True).all()
-    corsi = Corso.query.all()
     corso_preselezionato = request.args.get('corso_id', type=int)
     mese_corrente = datetime.now().month
     anno_corrente = datetime.now().year
-    return render_template('pagamento_form.html', pagamento=None, clienti=clienti, corsi=corsi, 
-                         corso_preselezionato=corso_preselezionato, mese_corrente=mese_corrente, anno_corrente=anno_corrente)
+    return render_template('pagamento_form.html', pagamento=None,
+                         ci_sono_clienti=_esistono(Cliente.query.filter_by(attivo=True)),
+                         ci_sono_corsi=_esistono(Corso.query),
+                         corso_preselezionato=db.session.get(Corso, corso_preselezionato) if corso_preselezionato else None,
+                         mese_corrente=mese_corrente, anno_corrente=anno_corrente)
 
 @app.route('/pagamenti/<int:id>/modifica', methods=['GET', 'POST'])
 @login_required
@@ -1236,13 +1117,17 @@ def modifica_pagamento(id):
             pagamento.pagato = False
             pagamento.data_pagamento = None
         
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Esiste già un pagamento per questo cliente, corso e periodo', 'error')
+            return redirect(url_for('modifica_pagamento', id=id))
+        invalida_ricevuta(id)
         flash('Pagamento modificato con successo!', 'success')
         return redirect(url_for('pagamenti'))
     
-    clienti = Cliente.query.filter_by(attivo=True).all()
-    corsi = Corso.query.all()
-    return render_template('pagamento_form.html', pagamento=pagamento, clienti=clienti, corsi=corsi)
+    return render_template('pagamento_form.html', pagamento=pagamento, ci_sono_clienti=True, ci_sono_corsi=True)
 
 @app.route('/pagamenti/<int:id>/marca-pagato', methods=['POST'])
 @login_required
@@ -1250,6 +1135,7 @@ def marca_pagato(id):
     pagamento = Pagamento.query.get_or_404(id)
     pagamento.marca_pagato()
     db.session.commit()
+    invalida_ricevuta(id)
     flash('Pagamento marcato come pagato!', 'success')
     return redirect(url_for('pagamenti'))
 
@@ -1259,6 +1145,7 @@ def elimina_pagamento(id):
     pagamento = Pagamento.query.get_or_404(id)
     db.session.delete(pagamento)
     db.session.commit()
+    invalida_ricevuta(id)
     flash('Pagamento eliminato con successo!', 'success')
     return redirect(url_for('pagamenti'))
 
@@ -1270,11 +1157,20 @@ def genera_ricevuta(id):
     
     pagamento = Pagamento.query.get_or_404(id)
     
+    # Le ricevute dei pagamenti incassati hanno un ETag: se il browser ha già
+    # questa versione non serve generare né inviare il PDF
+    etag = etag_ricevuta(pagamento)
+    if etag and etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
     try:
         pdf_content, filename = genera_ricevuta_pdf(pagamento)
         
         # Crea response con il PDF in memoria
-        return Response(
+        response = Response(
             pdf_content,
             mimetype='application/pdf',
             headers={
@@ -1282,23 +1178,104 @@ def genera_ricevuta(id):
                 'Content-Type': 'application/pdf'
             }
         )
+        if etag:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         flash(f'Errore nella generazione della ricevuta: {str(e)}', 'error')
         return redirect(url_for('pagamenti'))
 
+@app.route('/pagamenti/ricevute')
+@login_required
+def esporta_ricevute():
+    """Ricevute dei pagamenti incassati filtrati come nella lista: ZIP o PDF unico"""
+    filtro = FiltroPagamenti.da_richiesta(request.args)
+    formato = request.args.get('formato', 'zip')
+    if formato not in ['zip', 'pdf']:
+        formato = 'zip'
+    
+    # Ritorno alla lista con gli stessi filtri
+    parametri_lista = {k: v for k, v in request.args.items() if k != 'formato'}
+    
+    if formato == 'pdf' and not pypdf_disponibile():
+        flash('Libreria pypdf non installata. Installare con: pip install pypdf', 'error')
+        return redirect(url_for('pagamenti', **parametri_lista))
+    
+    ids = ids_ricevute(filtro)
+    if not ids:
+        flash('Nessuna ricevuta da esportare: nessun pagamento incassato corrisponde ai filtri', 'info')
+        return redirect(url_for('pagamenti', **parametri_lista))
+    
+    nome_file = 'ricevute'
+    if filtro.anno:
+        nome_file += f'_{filtro.anno}'
+        if filtro.mese:
+            nome_file += f'_{filtro.mese:02d}'
+    nome_file += f"_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    
+    # Ricevute generate in parallelo e scritte nella risposta man mano
+    risultati = genera_ricevute_pdf(pagamenti_a_blocchi(ids))
+    if formato == 'zip':
+        corpo, mimetype, nome_file = stream_zip(risultati), 'application/zip', f'{nome_file}.zip'
+    else:
+        corpo, mimetype, nome_file = stream_pdf_unico(risultati), 'application/pdf', f'{nome_file}.pdf'
+    
+    return Response(
+        stream_with_context(corpo),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{nome_file}"'}
+    )
+
+@app.route('/pagamenti/invia-ricevute', methods=['POST'])
+@login_required
+def invia_ricevute_email():
+    """Accoda per email le ricevute dei pagamenti incassati filtrati: un messaggio per cliente"""
+    filtro = FiltroPagamenti.da_richiesta(request.args)
+    settings = Settings.get_settings_cached()
+    
+    if not settings.mail_configured:
+        flash('Configurazione email non completata. Configurare il server SMTP nelle impostazioni.', 'error')
+        return redirect(url_for('pagamenti', **request.args))
+    
+    try:
+        lotto, messaggi, ricevute, gia_in_coda, gia_inviate, senza_email = accoda_ricevute(
+            filtro, settings, reinvia=request.form.get('reinvia') == '1'
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Invio massivo ricevute fallito: {str(e)}")
+        flash(f'Errore durante l\'invio delle ricevute: {str(e)}', 'error')
+        return redirect(url_for('pagamenti', **request.args))
+    
+    avvisi = []
+    if gia_in_coda:
+        avvisi.append(f'{gia_in_coda} già in coda')
+    if gia_inviate:
+        avvisi.append(f'{gia_inviate} già inviate, usare "Reinvia tutte" per inviarle di nuovo')
+    if senza_email:
+        avvisi.append(f'{senza_email} di clienti senza email')
+    dettaglio = f" (escluse: {', '.join(avvisi)})" if avvisi else ''
+    
+    if not messaggi:
+        flash(f'Nessuna ricevuta da inviare{dettaglio}', 'info')
+        return redirect(url_for('pagamenti', **request.args))
+    
+    sveglia_invio()
+    print(f"📧 INVIO MASSIVO {lotto}: {ricevute} ricevute in {messaggi} email")
+    flash(f'{ricevute} ricevute in coda per l\'invio a {messaggi} clienti{dettaglio}', 'success')
+    return redirect(url_for('email_in_uscita', lotto=lotto))
+
 @app.route('/pagamenti/<int:id>/invia-email', methods=['POST'])
 @login_required
 def invia_ricevuta_email(id):
-    """Invia ricevuta PDF via email al cliente"""
-    from flask_mailman import EmailMessage
-    import tempfile
-    import os
-    
+    """Mette in coda l'email con la ricevuta PDF per il cliente"""
     try:
         pagamento = Pagamento.query.get_or_404(id)
         
         # Log per debugging - traccia gli invii email
-        print(f"📧 INVIO EMAIL: Pagamento ID {id} -> Cliente: {pagamento.cliente.nome_completo} ({pagamento.cliente.email})")
+        print(f"📧 EMAIL IN CODA: Pagamento ID {id} -> Cliente: {pagamento.cliente.nome_completo} ({pagamento.cliente.email})")
         
         # Verifica che il pagamento sia pagato
         if not pagamento.pagato:
@@ -1309,19 +1286,17 @@ def invia_ricevuta_email(id):
             return jsonify({'success': False, 'message': 'Il cliente non ha un indirizzo email configurato'})
         
         # Ottieni impostazioni aziendali
-        settings = Settings.get_settings()
+        settings = Settings.get_settings_cached()
         
         # Verifica configurazione email
         if not settings.mail_configured:
             return jsonify({'success': False, 'message': 'Configurazione email non completata. Contattare l\'amministratore.'})
         
-        # Aggiorna configurazione email
-        update_mail_config(settings)
-        
-        # Genera PDF della ricevuta in memoria
-        pdf_content, filename = genera_ricevuta_pdf(pagamento)
+        # Evita doppi invii (es. doppio clic) finché il precedente è in coda
+        if MessaggioEmail.pagamenti_in_attesa([id]):
+            return jsonify({'success': True, 'message': f'Ricevuta già in coda per l\'invio a {pagamento.cliente.email}'})
         
-        # Prepara il contenuto dell'email
+        # Prepara il contenuto dell'email (il PDF viene allegato al momento dell'invio)
         subject = f"Ricevuta Pagamento #{pagamento.numero_ricevuta:05d} - {settings.denominazione_sociale}"
         
         body = f"""Gentile {pagamento.cliente.nome_completo},
@@ -1344,31 +1319,25 @@ Grazie per aver scelto {settings.denominazione_sociale}!
 {f'Email: {settings.email}' if settings.email else ''}
 """
 
-        # Crea email
-        msg = EmailMessage(
-            subject=subject,
-            body=body,
-            from_email=settings.mail_default_sender,
-            to=[pagamento.cliente.email]
-        )
-        
-        # Allega il PDF (già in memoria)
-        msg.attach(
-            filename, 
-            pdf_content, 
-            'application/pdf'
+        accoda_email(
+            MessaggioEmail.TIPO_RICEVUTA,
+            pagamento.cliente.email,
+            subject,
+            body,
+            pagamento_id=pagamento.id
         )
+        db.session.commit()
+        sveglia_invio()
         
-        # Invia email
         if not settings.mail_suppress_send:
-            msg.send()
-            message = f'Ricevuta inviata con successo a {pagamento.cliente.email}'
+            message = f'Ricevuta in coda per l\'invio a {pagamento.cliente.email}'
         else:
-            message = f'Ricevuta preparata ma non inviata (modalità test attiva). Destinatario: {pagamento.cliente.email}'
+            message = f'Ricevuta in coda ma non verrà inviata (modalità test attiva). Destinatario: {pagamento.cliente.email}'
         
         return jsonify({'success': True, 'message': message})
         
     except Exception as e:
+        db.session.rollback()
         error_message = f'Errore durante l\'invio dell\'email: {str(e)}'
         print(f"❌ Invio email ricevuta fallito: {error_message}")
         return jsonify({'success': False, 'message': error_message})
@@ -1390,8 +1359,30 @@ def genera_ricevute_bulk():
         errori = []
         clienti_senza_corsi = []
         
+        # Clienti selezionati con i loro corsi in una sola query (nell'ordine di selezione)
+        clienti_ids = list(dict.fromkeys(int(cliente_id) for cliente_id in clienti_ids))
+        clienti_per_id = {
+            cliente.id: cliente
+            for cliente in Cliente.query.options(selectinload(Cliente.corsi)).filter(Cliente.id.in_(clienti_ids))
+        }
+        if len(clienti_per_id) != len(clienti_ids):
+            abort(404)
+        
+        # Coppie cliente/corso che hanno già un pagamento per il periodo
+        pagamenti_esistenti = set(
+            db.session.query(Pagamento.cliente_id, Pagamento.corso_id).filter(
+                Pagamento.mese == mese,
+                Pagamento.anno == anno,
+                Pagamento.cliente_id.in_(clienti_ids)
+            ).all()
+        )
+        
+        adesso = datetime.now()
+        nota = f'Generato automaticamente il {adesso.strftime("%d/%m/%Y")}'
+        nuovi_pagamenti = []
+        
         for cliente_id in clienti_ids:
-            cliente = Cliente.query.get_or_404(cliente_id)
+            cliente = clienti_per_id[cliente_id]
             
             # Controlla se il cliente ha corsi
             if not cliente.corsi:
@@ -1400,33 +1391,31 @@ def genera_ricevute_bulk():
                 
             # Per ogni corso del cliente
             for corso in cliente.corsi:
-                # Verifica se esiste già un pagamento per questo mese/anno/cliente/corso
-                pagamento_esistente = Pagamento.query.filter_by(
-                    cliente_id=cliente_id,
-                    corso_id=corso.id,
-                    mese=mese,
-                    anno=anno
-                ).first()
-                
-                if pagamento_esistente:
+                if (cliente_id, corso.id) in pagamenti_esistenti:
                     errori.append(f"{cliente.nome_completo} - {corso.nome}: pagamento già esistente")
                     continue
                 
-                # Crea nuovo pagamento
-                pagamento = Pagamento(
-                    mese=mese,
-                    anno=anno,
-                    importo=corso.costo_mensile,
-                    cliente_id=cliente_id,
-                    corso_id=corso.id,
-                    pagato=True,  # Lo marco già come pagato
-                    data_pagamento=datetime.now(),
-                    metodo_pagamento='Contanti',
-                    note=f'Generato automaticamente il {datetime.now().strftime("%d/%m/%Y")}'
-                )
-                
-                db.session.add(pagamento)
-                ricevute_create += 1
+                nuovi_pagamenti.append({
+                    'mese': mese,
+                    'anno': anno,
+                    'importo': corso.costo_mensile,
+                    'cliente_id': cliente_id,
+                    'corso_id': corso.id,
+                    'pagato': True,  # Lo marco già come pagato
+                    'data_pagamento': adesso,
+                    'data_creazione': adesso,
+                    'metodo_pagamento': 'Contanti',
+                    'note': nota
+                })
+        
+        # Inserimento unico (executemany) di tutti i nuovi pagamenti, con un blocco
+        # di numeri di ricevuta consecutivi riservato in un solo UPDATE
+        if nuovi_pagamenti:
+            numeri = NumerazioneRicevute.riserva_blocco(adesso.year, len(nuovi_pagamenti))
+            for pagamento, numero in zip(nuovi_pagamenti, numeri):
+                pagamento['numero_ricevuta'] = numero
+            db.session.execute(db.insert(Pagamento), nuovi_pagamenti)
+            ricevute_create = len(nuovi_pagamenti)
         
         db.session.commit()
         
@@ -1464,29 +1453,26 @@ def genera_ricevute_bulk():
 @app.route('/backup')
 @login_required
 def backup_database():
+    """Backup online del database (API di backup SQLite) e delle ricevute PDF, scaricato come ZIP in streaming"""
     try:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_name = f'backup_danza_{timestamp}.zip'
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_file:
-            with zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Aggiungi database
-                zipf.write(database_path, 'database.db')
-                
-                # Aggiungi ricevute PDF se esistenti
-                if os.path.exists(pdf_folder):
-                    for root, dirs, files in os.walk(pdf_folder):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arc_path = os.path.relpath(file_path, base_path)
-                            zipf.write(file_path, arc_path)
-            
-            flash('Backup database creato con successo!', 'info')
-            return send_file(temp_file.name, as_attachment=True, download_name=backup_name)
-    
+        backup = BackupOnline(database_path, cartelle_extra=[pdf_folder], base_path=base_path).prepara()
     except Exception as e:
         flash(f'Errore nel backup: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
+    
+    response = Response(
+        stream_with_context(backup.stream()),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{backup_name}"',
+            'X-Backup-SHA256': backup.manifest['sha256']
+        }
+    )
+    # I file temporanei vanno rimossi anche se lo streaming non parte mai (HEAD, client disconnesso)
+    response.call_on_close(backup.pulisci)
+    return response
 
 # SETTINGS ROUTES
 @app.route('/settings', methods=['GET', 'POST'])
@@ -1579,8 +1565,14 @@ def settings():
                 else:
                     flash('Formato file non supportato. Usa JPG, PNG o GIF.', 'error')
         
+        # Invalida la cache delle impostazioni in tutti i worker
+        settings.incrementa_versione()
         db.session.commit()
         
+        # Le ricevute in cache riportano i vecchi dati aziendali
+        if cache_ricevute is not None:
+            cache_ricevute.svuota()
+        
         # Aggiorna configurazione Flask-Mail dinamicamente
         try:
             update_mail_config(settings)
@@ -1601,7 +1593,7 @@ def test_email():
     
     try:
         # Ottieni configurazioni attuali
-        settings = Settings.get_settings()
+        settings = Settings.get_settings_cached()
         
         if not settings.mail_configured:
             return jsonify({'success': False, 'message': 'Configurazione email incompleta'})
@@ -1657,7 +1649,7 @@ Dance2Manage System''',
 @login_required
 def debug_email_config():
     """Route di debug per verificare configurazione email"""
-    settings = Settings.get_settings()
+    settings = Settings.get_settings_cached()
     
     config_info = {
         'Database Settings': {
@@ -1691,106 +1683,6 @@ def help_page():
     return render_template('help.html')
 
 # REPORTS ROUTES
-def genera_report_data(mese_filtro, anno_filtro, data_specifica=None, tipo_report='mensile'):
-    """Genera i dati per i report (usata sia per HTML che Excel)"""
-    # Ottieni tutti i corsi con pagamenti per il periodo
-    corsi = Corso.query.all()
-    report_corsi = []
-    incasso_totale = 0
-    compensi_totali = 0
-    numero_pagamenti_totale = 0
-    
-    for corso in corsi:
-        # Filtra pagamenti in base al tipo di report
-        if tipo_report == 'giornaliero' and data_specifica:
-            # Converti data_specifica in oggetto datetime per il confronto
-            try:
-                data_target = datetime.strptime(data_specifica, '%Y-%m-%d').date()
-                # Filtra per data specifica
-                pagamenti = Pagamento.query.filter(
-                    Pagamento.corso_id == corso.id,
-                    Pagamento.pagato == True,
-                    db.func.date(Pagamento.data_pagamento) == data_target
-                ).all()
-            except (ValueError, TypeError):
-                pagamenti = []
-        else:
-            # Pagamenti del corso per il periodo mensile
-            pagamenti = Pagamento.query.filter_by(
-                corso_id=corso.id,
-                mese=mese_filtro,
-                anno=anno_filtro,
-                pagato=True
-            ).all()
-        
-        if pagamenti:  # Solo corsi con pagamenti
-            incasso_corso = sum(p.importo for p in pagamenti)
-            percentuale_insegnante = corso.insegnante.percentuale_guadagno
-            compenso_insegnante = incasso_corso * (percentuale_insegnante / 100)
-            utile_corso = incasso_corso - compenso_insegnante
-            
-            # Trova le date delle ricevute per questo corso nel periodo
-            date_ricevute = []
-            for pag in pagamenti:
-                if pag.data_pagamento:
-                    date_ricevute.append(pag.data_pagamento.strftime('%d/%m/%Y'))
-            
-            # Crea oggetto con attributi per compatibilità template
-            class ReportCorso:
-                def __init__(self, corso, insegnante, date_ricevute, inc_corso, perc_ins, comp_ins, ut_corso, pagamenti_list):
-                    self.corso = corso
-                    self.insegnante = insegnante
-                    self.date_ricevute = date_ricevute  # Lista delle date delle ricevute
-                    self.incasso_corso = inc_corso
-                    self.percentuale_insegnante = perc_ins  # Manteniamo per compatibilità con report insegnanti
-                    self.compenso_insegnante = comp_ins
-                    self.utile_corso = ut_corso
-                    self.pagamenti = pagamenti_list  # Lista dei pagamenti per ulteriori dettagli
-            
-            report_corsi.append(ReportCorso(
-                corso, corso.insegnante, date_ricevute,
-                incasso_corso, percentuale_insegnante, compenso_insegnante, utile_corso, pagamenti
-            ))
-            
-            incasso_totale += incasso_corso
-            compensi_totali += compenso_insegnante
-            numero_pagamenti_totale += len(pagamenti)
-    
-    # Report per insegnanti
-    insegnanti = Insegnante.query.all()
-    report_insegnanti = []
-    
-    for insegnante in insegnanti:
-        corsi_insegnante = [r for r in report_corsi if r.insegnante.id == insegnante.id]
-        if corsi_insegnante:
-            compenso_totale = sum(r.compenso_insegnante for r in corsi_insegnante)
-            incasso_totale_insegnante = sum(r.incasso_corso for r in corsi_insegnante)
-            percentuale_media = sum(r.percentuale_insegnante for r in corsi_insegnante) / len(corsi_insegnante)
-            corsi_nomi = [r.corso.nome for r in corsi_insegnante]
-            
-            # Crea oggetto per template
-            class ReportInsegnante:
-                def __init__(self, insegnante, comp_tot, inc_tot, perc_media, corsi_nomi):
-                    self.insegnante = insegnante
-                    self.compenso_totale = comp_tot
-                    self.incasso_totale = inc_tot
-                    self.percentuale_media = perc_media
-                    self.corsi_nomi = corsi_nomi
-            
-            report_insegnanti.append(ReportInsegnante(
-                insegnante, compenso_totale, incasso_totale_insegnante, percentuale_media, corsi_nomi
-            ))
-    
-    # Riepilogo generale
-    riepilogo = {
-        'incasso_totale': incasso_totale,
-        'compensi_totali': compensi_totali,
-        'utile_netto': incasso_totale - compensi_totali,
-        'numero_pagamenti': numero_pagamenti_totale
-    }
-    
-    return report_corsi, report_insegnanti, riepilogo
-
 @app.route('/reports')
 @login_required
 def reports():
@@ -1814,9 +1706,15 @@ def reports():
     report_corsi, report_insegnanti, riepilogo = genera_report_data(mese_filtro, anno_filtro, data_specifica, tipo_report)
     
     # Settings per la stampa
-    settings = Settings.get_settings()
+    settings = Settings.get_settings_cached()
+    
+    # Ultimo report inviato a ciascun insegnante per il periodo
+    email_report = MessaggioEmail.ultimo_per_insegnante(
+        [r.insegnante.id for r in report_insegnanti], mese_filtro, anno_filtro
+    )
     
     return render_template('reports.html',
+                         email_report=email_report,
                          report_corsi=report_corsi,
                          report_insegnanti=report_insegnanti,
                          riepilogo=riepilogo,
@@ -1880,7 +1778,7 @@ def esporta_report_excel():
                         'Orario': report.corso.orario.strftime('%H:%M'),
                         'Insegnante': report.insegnante.nome_completo,
                         'Iscritti': report.corso.numero_iscritti,
-                        'Pagamenti': len(report.pagamenti),
+                        'Pagamenti': report.numero_pagamenti,
                         'Incasso': report.incasso_corso,
                         'Percentuale Insegnante': report.percentuale_insegnante,
                         'Compenso': report.compenso_insegnante,
@@ -1907,7 +1805,7 @@ def esporta_report_excel():
                 insegnanti_df.to_excel(writer, sheet_name='Compensi Insegnanti', index=False)
 
             # Sheet 5: Elenco Allievi per Corso
-            corsi_con_iscritti = Corso.query.all()
+            corsi_con_iscritti = Corso.query.options(selectinload(Corso.clienti)).all()
             allievi_data = []
             for corso in corsi_con_iscritti:
                 for cliente in corso.clienti:
@@ -2018,13 +1916,134 @@ def genera_pdf_compensi_insegnante(insegnante_id):
         flash(f'Errore durante generazione PDF: {str(e)}', 'error')
         return redirect(url_for('reports'))
 
+# CODA EMAIL
+@app.route('/email')
+@login_required
+def email_in_uscita():
+    """Stato delle email in uscita, filtrabile per stato, pagamento, insegnante e invio massivo"""
+    stato = request.args.get('stato', '')
+    pagamento_id = request.args.get('pagamento_id', type=int)
+    insegnante_id = request.args.get('insegnante_id', type=int)
+    lotto = request.args.get('lotto', '')
+    page = request.args.get('page', 1, type=int)
+    
+    criteri = []
+    if pagamento_id:
+        criteri.append(MessaggioEmail.filtro_pagamento(pagamento_id))
+    if insegnante_id:
+        criteri.append(MessaggioEmail.insegnante_id == insegnante_id)
+    if lotto:
+        criteri.append(MessaggioEmail.lotto == lotto)
+    
+    query = MessaggioEmail.query.filter(*criteri)
+    if stato:
+        query = query.filter(MessaggioEmail.stato == stato)
+    
+    messaggi = PaginazioneKeyset(
+        query,
+        [Chiave(MessaggioEmail.id, True)],
+        page=page,
+        per_page=50,
+        cursore=request.args.get('cursore')
+    )
+    
+    # Conteggi per stato (con gli stessi filtri, escluso lo stato)
+    conteggi = MessaggioEmail.conteggi_per_stato(*criteri)
+    
+    pagamento = db.session.get(Pagamento, pagamento_id) if pagamento_id else None
+    insegnante = db.session.get(Insegnante, insegnante_id) if insegnante_id else None
+    
+    return render_template('email_coda.html',
+                         messaggi=messaggi.items,
+                         messaggi_paginated=messaggi,
+                         conteggi=conteggi,
+                         stato=stato,
+                         pagamento=pagamento,
+                         insegnante=insegnante,
+                         pagamento_id=pagamento_id,
+                         insegnante_id=insegnante_id,
+                         lotto=lotto)
+
+@app.route('/email/lotti/<lotto>')
+@login_required
+def avanzamento_invio(lotto):
+    """Avanzamento di un invio massivo (JSON, per l'aggiornamento della pagina)"""
+    conteggi = MessaggioEmail.conteggi_per_stato(MessaggioEmail.lotto == lotto)
+    totale = sum(conteggi.values())
+    completati = sum(conteggi.get(stato, 0) for stato in
+                     (MessaggioEmail.INVIATO, MessaggioEmail.NON_INVIATO, MessaggioEmail.FALLITO))
+    return jsonify({
+        'totale': totale,
+        'completati': completati,
+        'conteggi': conteggi,
+        'terminato': completati == totale
+    })
+
+@app.route('/email/<int:id>/riprova', methods=['POST'])
+@login_required
+def riprova_email(id):
+    """Rimette in coda un'email fallita"""
+    messaggio = MessaggioEmail.query.get_or_404(id)
+    if messaggio.in_attesa:
+        flash('L\'email è già in coda', 'info')
+    else:
+        messaggio.rimetti_in_coda()
+        db.session.commit()
+        sveglia_invio()
+        flash(f'Email a {messaggio.destinatario} rimessa in coda', 'success')
+    return redirect(request.referrer or url_for('email_in_uscita'))
+
 # EMAIL REPORTS ROUTES
+MESI_NOMI = ['', 'Gennaio', 'Febbraio', 'Marzo', 'Aprile', 'Maggio', 'Giugno',
+             'Luglio', 'Agosto', 'Settembre', 'Ottobre', 'Novembre', 'Dicembre']
+
+def accoda_report_insegnante(insegnante, report_insegnante, report_corsi, mese_filtro, anno_filtro, settings):
+    """
+    Mette in coda il report compensi di un insegnante (il logo viene allegato all'invio).
+    Restituisce False se un report dello stesso periodo è già in attesa di invio.
+    """
+    if MessaggioEmail.in_attesa_per(insegnante_id=insegnante.id, mese=mese_filtro, anno=anno_filtro,
+                                    tipo=MessaggioEmail.TIPO_REPORT_INSEGNANTE):
+        return False
+    
+    # Corsi dell'insegnante
+    corsi_dettaglio = [r for r in report_corsi if r.insegnante.id == insegnante.id]
+    
+    # Dati per template
+    template_data = {
+        'insegnante': insegnante,
+        'report': report_insegnante,
+        'corsi_dettaglio': corsi_dettaglio,
+        'mese_nome': MESI_NOMI[mese_filtro],
+        'mese_filtro': mese_filtro,
+        'anno': anno_filtro,
+        'settings': settings,
+        'data_generazione': datetime.now().strftime('%d/%m/%Y alle %H:%M')
+    }
+    
+    # Render templates
+    html_content = render_template('emails/teacher_report.html', **template_data)
+    text_content = render_template('emails/teacher_report.txt', **template_data)
+    
+    # Soggetto email
+    subject = f"Report Compensi {MESI_NOMI[mese_filtro]} {anno_filtro} - {insegnante.nome_completo}"
+    
+    accoda_email(
+        MessaggioEmail.TIPO_REPORT_INSEGNANTE,
+        insegnante.email,
+        subject,
+        text_content,
+        html_content,
+        insegnante_id=insegnante.id,
+        mese=mese_filtro,
+        anno=anno_filtro
+    )
+    return True
+
 @app.route('/reports/email_teacher/<int:insegnante_id>')
 @login_required
 def email_teacher_report(insegnante_id):
-    """Invia report via email a singolo insegnante"""
-    from flask_mailman import EmailMultiAlternatives
-    
+    """Mette in coda il report via email per un singolo insegnante"""
     # Parametri filtro
     mese_filtro = request.args.get('mese', date.today().month, type=int)
     anno_filtro = request.args.get('anno', date.today().year, type=int)
@@ -2034,7 +2053,7 @@ def email_teacher_report(insegnante_id):
     
     if not insegnante.email:
         flash(f'Insegnante {insegnante.nome_completo} non ha un indirizzo email configurato', 'error')
-        return redirect(url_for('reports'))
+        return redirect(url_for('reports', mese=mese_filtro, anno=anno_filtro))
     
     # Genera dati
     report_corsi, report_insegnanti, riepilogo = genera_report_data(mese_filtro, anno_filtro)
@@ -2043,87 +2062,35 @@ def email_teacher_report(insegnante_id):
     report_insegnante = next((r for r in report_insegnanti if r.insegnante.id == insegnante_id), None)
     if not report_insegnante:
         flash('Nessun dato per questo insegnante nel periodo selezionato', 'warning')
-        return redirect(url_for('reports'))
-    
-    # Corsi dell'insegnante
-    corsi_dettaglio = [r for r in report_corsi if r.insegnante.id == insegnante_id]
+        return redirect(url_for('reports', mese=mese_filtro, anno=anno_filtro))
     
     try:
         # Ottieni impostazioni per mittente
-        settings = Settings.get_settings()
+        settings = Settings.get_settings_cached()
         
         # Verifica configurazione email
         if not settings.mail_configured:
             flash('Configurazione email non completata. Vai in Impostazioni per configurare SMTP.', 'error')
-            return redirect(url_for('reports'))
-        
-        # Nomi mesi per template
-        mesi = ['', 'Gennaio', 'Febbraio', 'Marzo', 'Aprile', 'Maggio', 'Giugno',
-                'Luglio', 'Agosto', 'Settembre', 'Ottobre', 'Novembre', 'Dicembre']
-        
-        # Dati per template
-        template_data = {
-            'insegnante': insegnante,
-            'report': report_insegnante,
-            'corsi_dettaglio': corsi_dettaglio,
-            'mese_nome': mesi[mese_filtro],
-            'mese_filtro': mese_filtro,
-            'anno': anno_filtro,
-            'settings': settings,
-            'data_generazione': datetime.now().strftime('%d/%m/%Y alle %H:%M')
-        }
-        
-        # Render templates
-        html_content = render_template('emails/teacher_report.html', **template_data)
-        text_content = render_template('emails/teacher_report.txt', **template_data)
-        
-        # Soggetto email
-        subject = f"Report Compensi {mesi[mese_filtro]} {anno_filtro} - {insegnante.nome_completo}"
-        
-        # Crea email
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_content,
-            from_email=settings.mail_default_sender,
-            to=[insegnante.email]
-        )
-        email.attach_alternative(html_content, "text/html")
-        
-        # Allega logo se presente
-        if settings.logo_filename:
-            import mimetypes
-            logo_path = os.path.join(static_folder, 'uploads', settings.logo_filename)
-            if os.path.exists(logo_path):
-                with open(logo_path, 'rb') as f:
-                    logo_data = f.read()
-                    content_type, _ = mimetypes.guess_type(logo_path)
-                    if not content_type:
-                        content_type = 'image/png'
-                    
-                    from email.mime.image import MIMEImage
-                    # Crea allegato inline per cid:logo
-                    logo_attachment = MIMEImage(logo_data)
-                    logo_attachment.add_header('Content-ID', '<logo>')
-                    logo_attachment.add_header('Content-Disposition', 'inline', filename=settings.logo_filename)
-                    email.attach(logo_attachment)
+            return redirect(url_for('reports', mese=mese_filtro, anno=anno_filtro))
         
-        # Invia email
-        email.send()
-        
-        flash(f'Report inviato con successo all\'insegnante {insegnante.nome_completo} ({insegnante.email})', 'success')
+        if accoda_report_insegnante(insegnante, report_insegnante, report_corsi, mese_filtro, anno_filtro, settings):
+            db.session.commit()
+            sveglia_invio()
+            flash(f'Report in coda per l\'invio all\'insegnante {insegnante.nome_completo} ({insegnante.email})', 'success')
+        else:
+            flash(f'Il report di {insegnante.nome_completo} per questo periodo è già in coda', 'info')
         
     except Exception as e:
+        db.session.rollback()
         flash(f'Errore durante invio email: {str(e)}', 'error')
         print(f"Email error: {str(e)}")  # Debug
     
-    return redirect(url_for('reports'))
+    return redirect(url_for('reports', mese=mese_filtro, anno=anno_filtro))
 
 @app.route('/reports/email_all_teachers')
 @login_required
 def email_all_teachers_reports():
-    """Invia report via email a tutti gli insegnanti che hanno un compenso"""
-    from flask_mailman import EmailMultiAlternatives
-    
+    """Mette in coda il report via email per tutti gli insegnanti che hanno un compenso"""
     # Parametri filtro
     mese_filtro = request.args.get('mese', date.today().month, type=int)
     anno_filtro = request.args.get('anno', date.today().year, type=int)
@@ -2133,23 +2100,20 @@ def email_all_teachers_reports():
     
     if not report_insegnanti:
         flash('Nessun dato disponibile per il periodo selezionato', 'warning')
-        return redirect(url_for('reports'))
+        return redirect(url_for('reports', mese=mese_filtro, anno=anno_filtro))
     
     try:
         # Ottieni impostazioni per mittente
-        settings = Settings.get_settings()
+        settings = Settings.get_settings_cached()
         
         # Verifica configurazione email
         if not settings.mail_configured:
             flash('Configurazione email non completata. Vai in Impostazioni per configurare SMTP.', 'error')
-            return redirect(url_for('reports'))
+            return redirect(url_for('reports', mese=mese_filtro, anno=anno_filtro))
         
-        # Nomi mesi per template
-        mesi = ['', 'Gennaio', 'Febbraio', 'Marzo', 'Aprile', 'Maggio', 'Giugno',
-                'Luglio', 'Agosto', 'Settembre', 'Ottobre', 'Novembre', 'Dicembre']
-        
-        emails_sent = 0
+        emails_queued = 0
         emails_skipped = 0
+        emails_pending = 0
         
         for report_insegnante in report_insegnanti:
             insegnante = report_insegnante.insegnante
@@ -2159,70 +2123,30 @@ def email_all_teachers_reports():
                 emails_skipped += 1
                 continue
             
-            # Corsi dell'insegnante
-            corsi_dettaglio = [r for r in report_corsi if r.insegnante.id == insegnante.id]
-            
-            # Dati per template
-            template_data = {
-                'insegnante': insegnante,
-                'report': report_insegnante,
-                'corsi_dettaglio': corsi_dettaglio,
-                'mese_nome': mesi[mese_filtro],
-                'mese_filtro': mese_filtro,
-                'anno': anno_filtro,
-                'settings': settings,
-                'data_generazione': datetime.now().strftime('%d/%m/%Y alle %H:%M')
-            }
-            
-            # Render templates
-            html_content = render_template('emails/teacher_report.html', **template_data)
-            text_content = render_template('emails/teacher_report.txt', **template_data)
-            
-            # Soggetto email
-            subject = f"Report Compensi {mesi[mese_filtro]} {anno_filtro} - {insegnante.nome_completo}"
-            
-            # Crea e invia email
-            email = EmailMultiAlternatives(
-                subject=subject,
-                body=text_content,
-                from_email=settings.mail_default_sender,
-                to=[insegnante.email]
-            )
-            email.attach_alternative(html_content, "text/html")
-            
-            # Allega logo se presente
-            if settings.logo_filename:
-                import mimetypes
-                logo_path = os.path.join(static_folder, 'uploads', settings.logo_filename)
-                if os.path.exists(logo_path):
-                    with open(logo_path, 'rb') as f:
-                        logo_data = f.read()
-                        content_type, _ = mimetypes.guess_type(logo_path)
-                        if not content_type:
-                            content_type = 'image/png'
-                        
-                        from email.mime.image import MIMEImage
-                        # Crea allegato inline per cid:logo
-                        logo_attachment = MIMEImage(logo_data)
-                        logo_attachment.add_header('Content-ID', '<logo>')
-                        logo_attachment.add_header('Content-Disposition', 'inline', filename=settings.logo_filename)
-                        email.attach(logo_attachment)
-            
-            email.send()
-            
-            emails_sent += 1
+            if accoda_report_insegnante(insegnante, report_insegnante, report_corsi, mese_filtro, anno_filtro, settings):
+                emails_queued += 1
+            else:
+                emails_pending += 1
+        
+        # Un solo commit per tutti i messaggi: l'invio avviene in background
+        db.session.commit()
+        sveglia_invio()
         
-        if emails_sent > 0:
-            flash(f'Report inviati con successo a {emails_sent} insegnanti', 'success')
+        if emails_queued > 0:
+            flash(f'Report in coda per l\'invio a {emails_queued} insegnanti', 'success')
+        
+        if emails_pending > 0:
+            flash(f'{emails_pending} report già in coda per questo periodo', 'info')
         
         if emails_skipped > 0:
             flash(f'{emails_skipped} insegnanti saltati (email mancante)', 'info')
             
     except Exception as e:
+        db.session.rollback()
         flash(f'Errore durante invio email: {str(e)}', 'error')
         print(f"Email error: {str(e)}")  # Debug
     
-    return redirect(url_for('reports'))
+    return redirect(url_for('reports', mese=mese_filtro, anno=anno_filtro))
 
 # Route rimossa - Flask-Security-Too gestisce tutto automaticamente
 
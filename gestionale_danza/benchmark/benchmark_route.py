@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Benchmark delle route più usate tramite il test client di Flask.
+Per ogni caso misura i tempi di risposta (min/mediana/media/p95/max) e il
+numero di query SQL, e scrive i risultati in JSON per confrontarli tra commit.
+
+Uso:
+    python benchmark/genera_dataset.py --db data/benchmark.db
+    python benchmark/benchmark_route.py --db data/benchmark.db --output risultati.json
+    python benchmark/benchmark_route.py --db data/benchmark.db --confronta risultati_precedenti.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import sqlite3
+import statistics
+import subprocess
+from urllib.parse import urlsplit
+from datetime import datetime
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_DEFAULT = os.path.join(BASE_PATH, 'data', 'benchmark.db')
+
+# Variazione della mediana oltre la quale il confronto segnala una regressione
+SOGLIA_REGRESSIONE = 0.20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark delle route principali')
+    parser.add_argument('--db', default=DB_DEFAULT, help='database generato con genera_dataset.py')
+    parser.add_argument('--ripetizioni', type=int, default=5, help='misure per ogni caso (dopo un giro di riscaldamento)')
+    parser.add_argument('--output', help='file JSON dei risultati (default: benchmark/risultati_<data>.json)')
+    parser.add_argument('--solo', help='esegue solo i casi il cui nome contiene questo testo')
+    parser.add_argument('--confronta', help='JSON di un benchmark precedente da confrontare')
+    return parser.parse_args()
+
+
+def prepara_app(percorso):
+    """Importa l'app sul database di benchmark e restituisce app, db e un client autenticato"""
+    os.environ['DATABASE_PATH'] = percorso
+    os.environ.setdefault('DISABLE_TALISMAN_FOR_TEST', 'True')
+    # Niente thread in background durante le misure (invio email, backup automatici)
+    os.environ['EMAIL_OUTBOX_WORKER'] = 'False'
+    os.environ['BACKUP_SCHEDULE_MINUTES'] = '0'
+    sys.path.append(BASE_PATH)
+
+    from app import app, init_db
+    from models import db, User, Role
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    init_db()
+
+    with app.app_context():
+        admin = User.query.join(User.roles).filter(Role.name == 'admin').first()
+        uniquifier = admin.fs_uniquifier
+
+    client = app.test_client()
+    with client.session_transaction() as sessione:
+        sessione['_user_id'] = uniquifier
+        sessione['_fresh'] = True
+    return app, db, client
+
+
+def parametri_dataset(app, db):
+    """Valori reali del dataset usati nei casi (periodo più recente, cliente, corso, ricevuta)"""
+    from models import Cliente, Corso, Pagamento
+
+    with app.app_context():
+        anno, mese = db.session.query(Pagamento.anno, Pagamento.mese) \
+            .order_by(Pagamento.anno.desc(), Pagamento.mese.desc()).first()
+        pagamento = Pagamento.query.filter(Pagamento.pagato == True, Pagamento.anno == anno) \
+            .order_by(Pagamento.data_pagamento.desc()).first()
+        cliente = db.session.get(Cliente, pagamento.cliente_id)
+        clienti_bulk = [c.id for c in Cliente.query.filter_by(attivo=True).order_by(Cliente.id).limit(200)]
+        conteggi = {
+            'clienti': Cliente.query.count(),
+            'corsi': Corso.query.count(),
+            'pagamenti': Pagamento.query.count()
+        }
+
+    return {
+        'anno': anno,
+        'mese': mese,
+        'data': pagamento.data_pagamento.strftime('%Y-%m-%d'),
+        'pagamento_id': pagamento.id,
+        'cliente_id': pagamento.cliente_id,
+        'corso_id': pagamento.corso_id,
+        'cognome': cliente.cognome[:4],
+        'clienti_bulk': clienti_bulk,
+        'conteggi': conteggi
+    }
+
+
+def casi_benchmark(p):
+    """Elenco dei casi: (nome, metodo, url, dati del form)"""
+    periodo = f"mese={p['mese']}&anno={p['anno']}"
+    casi = [
+        ('clienti', 'GET', '/clienti', None),
+        ('clienti_ricerca', 'GET', f"/clienti?search={p['cognome']}", None),
+        ('clienti_ordinati_email_pagina_50', 'GET', '/clienti?sort_by=email&page=50', None),
+        ('pagamenti', 'GET', '/pagamenti', None),
+        ('pagamenti_periodo', 'GET', f"/pagamenti?{periodo}", None),
+        ('pagamenti_data_specifica', 'GET', f"/pagamenti?data_specifica={p['data']}", None),
+        ('pagamenti_data_pagamento_mese', 'GET', f"/pagamenti?tipo_filtro_data=data_pagamento&{periodo}", None),
+        ('pagamenti_data_pagamento_anno', 'GET', f"/pagamenti?tipo_filtro_data=data_pagamento&anno={p['anno']}", None),
+        ('pagamenti_cliente', 'GET', f"/pagamenti?cliente_id={p['cliente_id']}", None),
+        ('pagamenti_corso', 'GET', f"/pagamenti?corso_id={p['corso_id']}&{periodo}", None),
+        ('pagamenti_metodo', 'GET', '/pagamenti?metodo_pagamento=Bonifico', None),
+        ('pagamenti_non_pagati', 'GET', '/pagamenti?stato=non_pagati', None),
+        ('pagamenti_pagati', 'GET', '/pagamenti?stato=pagati', None),
+        ('pagamenti_ricerca', 'GET', f"/pagamenti?search={p['cognome']}", None),
+        ('pagamenti_ordinati_cliente', 'GET', '/pagamenti?sort_by=cliente&sort_order=asc', None),
+        ('pagamenti_pagina_100', 'GET', '/pagamenti?page=100', None),
+        ('reports_mensile', 'GET', f"/reports?{periodo}", None),
+        ('reports_giornaliero', 'GET', f"/reports?tipo_report=giornaliero&data_specifica={p['data']}", None),
+        ('reports_excel', 'GET', f"/reports/excel?{periodo}", None),
+        ('ricevuta_pdf', 'GET', f"/pagamenti/{p['pagamento_id']}/ricevuta", None),
+        ('dashboard', 'GET', '/', None),
+        ('corsi', 'GET', '/corsi', None),
+        ('insegnanti', 'GET', '/insegnanti', None),
+    ]
+    return casi
+
+
+def contatore_query(app, db):
+    """Conta le istruzioni SQL eseguite dall'engine"""
+    from sqlalchemy import event
+
+    conteggio = [0]
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _conta(*args):
+        conteggio[0] += 1
+
+    return conteggio
+
+
+def riepiloga(tempi):
+    ordinati = sorted(tempi)
+    return {
+        'min_ms': round(ordinati[0], 2),
+        'mediana_ms': round(statistics.median(ordinati), 2),
+        'media_ms': round(statistics.fmean(ordinati), 2),
+        'p95_ms': round(ordinati[max(0, int(len(ordinati) * 0.95 + 0.5) - 1)], 2),
+        'max_ms': round(ordinati[-1], 2)
+    }
+
+
+def misura(client, conteggio, metodo, url, dati, ripetizioni):
+    """
+    Un giro di riscaldamento, poi `ripetizioni` misure. Si ferma alla prima
+    risposta diversa da 200 (la pagina non è stata prodotta: tempo non valido).
+    """
+    tempi = []
+    stato = None
+    query = None
+    for giro in range(ripetizioni + 1):
+        conteggio[0] = 0
+        inizio = time.perf_counter()
+        risposta = client.open(url, method=metodo, data=dati)
+        risposta.get_data()
+        durata = (time.perf_counter() - inizio) * 1000
+        stato = risposta.status_code
+        if stato != 200:
+            return stato, query, tempi, risposta.headers.get('Location')
+        if giro > 0:
+            tempi.append(durata)
+            query = conteggio[0]
+    return stato, query, tempi, None
+
+
+def benchmark_generazione_bulk(app, db, client, conteggio, p):
+    """
+    Generazione massiva di ricevute per un mese futuro senza pagamenti.
+    Modifica i dati: i pagamenti creati vengono eliminati dopo la misura.
+    """
+    from models import Pagamento
+
+    with app.app_context():
+        id_massimo = db.session.query(db.func.max(Pagamento.id)).scalar() or 0
+
+    dati = {'clienti_ids': [str(i) for i in p['clienti_bulk']], 'mese': '12', 'anno': str(p['anno'] + 1)}
+    try:
+        conteggio[0] = 0
+        inizio = time.perf_counter()
+        risposta = client.post('/genera_ricevute_bulk', data=dati)
+        durata = (time.perf_counter() - inizio) * 1000
+        query = conteggio[0]
+    finally:
+        with app.app_context():
+            Pagamento.query.filter(Pagamento.id > id_massimo).delete(synchronize_session=False)
+            db.session.commit()
+
+    # Successo = redirect alla lista pagamenti (in caso di errore torna ai clienti)
+    destinazione = risposta.headers.get('Location')
+    if risposta.status_code == 302 and urlsplit(destinazione or '').path == '/pagamenti':
+        return 200, query, [durata], None
+    return risposta.status_code, query, [durata], destinazione
+
+
+def info_ambiente(percorso, p):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_PATH,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'piattaforma': platform.platform(),
+        'database': percorso,
+        'dataset': p['conteggi']
+    }
+
+
+def confronta(risultati, percorso_precedente):
+    """Stampa la variazione della mediana rispetto a un benchmark precedente"""
+    with open(percorso_precedente, encoding='utf-8') as f:
+        precedenti = {r['nome']: r for r in json.load(f)['risultati']}
+
+    print(f"\n📊 CONFRONTO CON {percorso_precedente}")
+    regressioni = 0
+    for risultato in risultati:
+        prima = precedenti.get(risultato['nome'])
+        if not prima or not prima.get('mediana_ms'):
+            continue
+        variazione = (risultato['mediana_ms'] - prima['mediana_ms']) / prima['mediana_ms']
+        simbolo = '🔴' if variazione > SOGLIA_REGRESSIONE else '🟢' if variazione < -SOGLIA_REGRESSIONE else '⚪'
+        regressioni += variazione > SOGLIA_REGRESSIONE
+        print(f"   {simbolo} {risultato['nome']:<40} {prima['mediana_ms']:>9.1f} → {risultato['mediana_ms']:>9.1f} ms "
+              f"({variazione:+.0%}), query {prima.get('query')} → {risultato['query']}")
+    return regressioni
+
+
+def main():
+    args = parse_args()
+    percorso = os.path.abspath(args.db)
+    if not os.path.exists(percorso):
+        print(f"❌ Database {percorso} non trovato: generarlo con benchmark/genera_dataset.py")
+        sys.exit(1)
+
+    app, db, client = prepara_app(percorso)
+    p = parametri_dataset(app, db)
+    conteggio = contatore_query(app, db)
+
+    print("⏱️  BENCHMARK ROUTE")
+    print("=" * 60)
+    print(f"💾 Database: {percorso} ({p['conteggi']['clienti']} clienti, {p['conteggi']['pagamenti']} pagamenti)")
+
+    casi = [(nome, metodo, url, dati, None) for nome, metodo, url, dati in casi_benchmark(p)]
+    casi.append(('genera_ricevute_bulk', 'POST', '/genera_ricevute_bulk', None, benchmark_generazione_bulk))
+
+    risultati = []
+    errori = []
+    for nome, metodo, url, dati, funzione in casi:
+        if args.solo and args.solo not in nome:
+            continue
+        if funzione:
+            stato, query, tempi, destinazione = funzione(app, db, client, conteggio, p)
+        else:
+            stato, query, tempi, destinazione = misura(client, conteggio, metodo, url, dati, args.ripetizioni)
+
+        if stato != 200:
+            # Redirect con messaggio di errore, pagina mancante, ...: escluso da risultati e confronto
+            dettaglio = f' → {destinazione}' if destinazione else ''
+            errori.append({'nome': nome, 'metodo': metodo, 'url': url, 'stato': stato, 'destinazione': destinazione})
+            print(f"   ❌ {nome:<38} risposta {stato}{dettaglio}")
+            continue
+
+        risultato = {'nome': nome, 'metodo': metodo, 'url': url, 'stato': stato,
+                     'ripetizioni': len(tempi), 'query': query, **riepiloga(tempi)}
+        risultati.append(risultato)
+        print(f"   {nome:<40} {risultato['mediana_ms']:>9.1f} ms  {query:>5} query")
+
+    output = args.output or os.path.join(BASE_PATH, 'benchmark', f"risultati_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'ambiente': info_ambiente(percorso, p), 'risultati': risultati, 'errori': errori},
+                  f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Risultati salvati in: {output}")
+
+    regressioni = confronta(risultati, args.confronta) if args.confronta else 0
+    if regressioni:
+        print(f"\n🔴 {regressioni} casi più lenti di oltre il {SOGLIA_REGRESSIONE:.0%}")
+    if errori:
+        print(f"\n❌ {len(errori)} casi senza risposta valida: {', '.join(errore['nome'] for errore in errori)}")
+    if regressioni or errori:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
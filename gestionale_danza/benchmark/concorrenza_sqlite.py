@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Benchmark di concorrenza SQLite: confronta i PRAGMA predefiniti di SQLite
+(journal in rollback, synchronous=FULL) con il profilo dell'app
+(utils/profilo_sqlite.py, configurabile con le variabili SQLITE_*).
+
+Su due copie del database indicato, più processi (come i worker dell'app)
+lavorano in parallelo per la durata richiesta:
+- scrittori: leggono un pagamento e ne invertono lo stato (come "marca pagato"),
+  con i trigger del riepilogo mensile;
+- lettori: totali per corso di un mese a caso e una pagina della lista pagamenti.
+
+Per ogni configurazione stampa transazioni al secondo, latenze ed errori
+"database is locked".
+
+Uso:
+    python benchmark/concorrenza_sqlite.py --db data/benchmark.db --scrittori 4 --lettori 4 --durata 10
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_DEFAULT = os.path.join(BASE_PATH, 'data', 'benchmark.db')
+sys.path.append(BASE_PATH)
+
+from utils.profilo_sqlite import profilo_da_ambiente, applica_profilo, leggi_pragma
+
+# Timeout del driver sqlite3 (default di Python, usato dall'app senza profilo)
+TIMEOUT_DRIVER = 5.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark di concorrenza SQLite prima/dopo il profilo PRAGMA')
+    parser.add_argument('--db', default=DB_DEFAULT, help='database di prova (default: data/benchmark.db)')
+    parser.add_argument('--scrittori', type=int, default=4, help='processi che scrivono')
+    parser.add_argument('--lettori', type=int, default=4, help='processi che leggono')
+    parser.add_argument('--durata', type=float, default=10, help='secondi per configurazione')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def _connetti(percorso, profilo):
+    connessione = sqlite3.connect(percorso, timeout=TIMEOUT_DRIVER)
+    if profilo:
+        applica_profilo(connessione, profilo)
+    return connessione
+
+
+def _bloccato(errore):
+    messaggio = str(errore).lower()
+    return 'locked' in messaggio or 'busy' in messaggio
+
+
+def lavoratore(ruolo, indice, percorso, profilo, durata, seed, partenza, risultati):
+    casuale = random.Random(seed * 1000 + indice)
+    connessione = _connetti(percorso, profilo)
+    cursor = connessione.cursor()
+    massimo_id = cursor.execute("SELECT MAX(id) FROM pagamenti").fetchone()[0]
+    periodi = cursor.execute("SELECT DISTINCT anno, mese FROM pagamenti").fetchall()
+
+    completate = 0
+    bloccate = 0
+    latenze = []
+    partenza.wait()
+    fine = time.monotonic() + durata
+    while time.monotonic() < fine:
+        inizio = time.perf_counter()
+        try:
+            if ruolo == 'scrittore':
+                pagamento_id = casuale.randint(1, massimo_id)
+                riga = cursor.execute("SELECT pagato FROM pagamenti WHERE id = ?", (pagamento_id,)).fetchone()
+                if riga is None:
+                    continue
+                cursor.execute("UPDATE pagamenti SET pagato = ? WHERE id = ?", (0 if riga[0] else 1, pagamento_id))
+                connessione.commit()
+            else:
+                anno, mese = casuale.choice(periodi)
+                cursor.execute("""SELECT corso_id, SUM(importo), COUNT(*) FROM pagamenti
+                                  WHERE anno = ? AND mese = ? AND pagato = 1 GROUP BY corso_id""", (anno, mese)).fetchall()
+                cursor.execute("""SELECT p.id, c.cognome, p.importo FROM pagamenti p JOIN clienti c ON c.id = p.cliente_id
+                                  WHERE p.anno = ? ORDER BY p.data_creazione DESC, p.id DESC LIMIT 25""", (anno,)).fetchall()
+            completate += 1
+            latenze.append(time.perf_counter() - inizio)
+        except sqlite3.OperationalError as e:
+            if not _bloccato(e):
+                raise
+            connessione.rollback()
+            bloccate += 1
+    connessione.close()
+    risultati.put((ruolo, completate, bloccate, latenze))
+
+
+def _percentile(valori, quota):
+    if not valori:
+        return 0.0
+    valori = sorted(valori)
+    return valori[min(int(len(valori) * quota), len(valori) - 1)]
+
+
+def esegui(nome, percorso, profilo, args):
+    contesto = multiprocessing.get_context('spawn')
+    partenza = contesto.Barrier(args.scrittori + args.lettori)
+    risultati = contesto.Queue()
+    processi = [
+        contesto.Process(target=lavoratore, args=(ruolo, i, percorso, profilo, args.durata, args.seed, partenza, risultati))
+        for i, ruolo in enumerate(['scrittore'] * args.scrittori + ['lettore'] * args.lettori)
+    ]
+    for processo in processi:
+        processo.start()
+    raccolti = [risultati.get() for _ in processi]
+    for processo in processi:
+        processo.join()
+
+    connessione = _connetti(percorso, profilo)
+    pragma = leggi_pragma(connessione, ['journal_mode', 'synchronous', 'busy_timeout'])
+    connessione.close()
+
+    riepilogo = {}
+    for ruolo in ('scrittore', 'lettore'):
+        righe = [r for r in raccolti if r[0] == ruolo]
+        latenze = [latenza for r in righe for latenza in r[3]]
+        riepilogo[ruolo] = {
+            'al_secondo': sum(r[1] for r in righe) / args.durata,
+            'bloccate': sum(r[2] for r in righe),
+            'p50_ms': _percentile(latenze, 0.5) * 1000,
+            'p95_ms': _percentile(latenze, 0.95) * 1000,
+        }
+
+    print(f"\n📊 {nome} (journal_mode={pragma['journal_mode']}, synchronous={pragma['synchronous']}, "
+          f"busy_timeout={pragma['busy_timeout']} ms)")
+    for ruolo, etichetta in (('scrittore', 'Scritture'), ('lettore', 'Letture')):
+        dati = riepilogo[ruolo]
+        print(f"   {etichetta:<10} {dati['al_secondo']:8.1f}/s   p50 {dati['p50_ms']:7.1f} ms   "
+              f"p95 {dati['p95_ms']:7.1f} ms   database is locked: {dati['bloccate']}")
+    return riepilogo
+
+
+def main():
+    args = parse_args()
+    sorgente = os.path.abspath(args.db)
+    if not os.path.exists(sorgente):
+        print(f"❌ Database {sorgente} non trovato: generarlo con benchmark/genera_dataset.py")
+        sys.exit(1)
+
+    profilo = profilo_da_ambiente()
+    if not profilo:
+        print("❌ SQLITE_TUNING=False: nessun profilo da confrontare")
+        sys.exit(1)
+
+    print("🔄 BENCHMARK CONCORRENZA SQLITE")
+    print("=" * 60)
+    print(f"   Database: {sorgente}")
+    print(f"   Processi: {args.scrittori} scrittori, {args.lettori} lettori, {args.durata:g} s per configurazione")
+    print(f"   Profilo: {', '.join(f'{nome}={valore}' for nome, valore in profilo)}")
+
+    cartella = tempfile.mkdtemp(prefix='concorrenza_sqlite_')
+    try:
+        # Copia consistente (anche se il sorgente è in WAL) e journal iniziale in rollback
+        copie = {}
+        for nome in ('predefinito', 'profilo'):
+            copie[nome] = os.path.join(cartella, f'{nome}.db')
+            with sqlite3.connect(sorgente) as origine, sqlite3.connect(copie[nome]) as copia:
+                origine.backup(copia)
+            connessione = sqlite3.connect(copie[nome])
+            connessione.execute('PRAGMA journal_mode = DELETE')
+            connessione.close()
+
+        prima = esegui('PRAGMA predefiniti di SQLite', copie['predefinito'], [], args)
+        dopo = esegui('Profilo dell\'app', copie['profilo'], profilo, args)
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    print("\n📈 Variazione")
+    for ruolo, etichetta in (('scrittore', 'Scritture'), ('lettore', 'Letture')):
+        base = prima[ruolo]['al_secondo']
+        variazione = (dopo[ruolo]['al_secondo'] / base - 1) * 100 if base else float('inf')
+        print(f"   {etichetta:<10} {variazione:+7.1f}% al secondo, "
+              f"database is locked {prima[ruolo]['bloccate']} → {dopo[ruolo]['bloccate']}")
+
+
+if __name__ == '__main__':
+    main()
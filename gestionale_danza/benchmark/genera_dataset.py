@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Genera un database SQLite di prova con dati sintetici realistici (Faker)
+per misurare le prestazioni su volumi grandi.
+
+Uso:
+    python benchmark/genera_dataset.py --db data/benchmark.db
+    python benchmark/genera_dataset.py --clienti 20000 --corsi 300 --insegnanti 50 --anni 5
+
+Il database indicato viene ricreato da zero: non usare il database di produzione.
+"""
+
+import os
+import sys
+import random
+import argparse
+from datetime import datetime, date, time, timedelta
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_DEFAULT = os.path.join(BASE_PATH, 'data', 'benchmark.db')
+
+# Pagamenti inseriti per ogni executemany
+BLOCCO_INSERIMENTO = 5000
+
+GIORNI = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato']
+DISCIPLINE = ['Danza Classica', 'Danza Moderna', 'Hip Hop', 'Contemporaneo', 'Jazz', 'Tip Tap',
+              'Latino Americano', 'Break Dance', 'Pilates', 'Propedeutica', 'Flamenco', 'Danza del Ventre']
+LIVELLI = ['Base', 'Intermedio', 'Avanzato', 'Bambini', 'Ragazzi', 'Adulti']
+METODI_PAGAMENTO = ['Contanti', 'Contanti', 'Contanti', 'Bonifico', 'Bancomat', 'Carta di credito']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Genera un database di prova con dati sintetici')
+    parser.add_argument('--db', default=DB_DEFAULT, help='percorso del database da creare (default: data/benchmark.db)')
+    parser.add_argument('--clienti', type=int, default=20000)
+    parser.add_argument('--corsi', type=int, default=300)
+    parser.add_argument('--insegnanti', type=int, default=50)
+    parser.add_argument('--anni', type=int, default=5, help='anni di pagamenti mensili fino al mese corrente')
+    parser.add_argument('--corsi-per-cliente', type=int, default=2, help='numero massimo di corsi per cliente')
+    parser.add_argument('--quota-pagati', type=float, default=0.9, help='frazione dei pagamenti già incassati')
+    parser.add_argument('--seed', type=int, default=42, help='seme per dati riproducibili')
+    parser.add_argument('--sovrascrivi', action='store_true', help='elimina il database se esiste già')
+    return parser.parse_args()
+
+
+def mesi_periodo(anni):
+    """Lista (anno, mese) degli ultimi `anni` anni, fino al mese corrente incluso"""
+    oggi = date.today()
+    mesi = []
+    anno, mese = oggi.year - anni, oggi.month
+    for _ in range(anni * 12):
+        mese += 1
+        if mese > 12:
+            anno, mese = anno + 1, 1
+        mesi.append((anno, mese))
+    return mesi
+
+
+def prepara_database(percorso, sovrascrivi):
+    """Imposta l'app sul database indicato e crea lo schema vuoto"""
+    if os.path.exists(percorso):
+        if not sovrascrivi:
+            print(f"❌ Il database {percorso} esiste già (usa --sovrascrivi per ricrearlo)")
+            sys.exit(1)
+        for suffisso in ('', '-wal', '-shm'):
+            if os.path.exists(percorso + suffisso):
+                os.remove(percorso + suffisso)
+
+    os.environ['DATABASE_PATH'] = percorso
+    os.environ.setdefault('DISABLE_TALISMAN_FOR_TEST', 'True')
+    # Niente thread in background (invio email, backup automatici)
+    os.environ['EMAIL_OUTBOX_WORKER'] = 'False'
+    os.environ['BACKUP_SCHEDULE_MINUTES'] = '0'
+    sys.path.append(BASE_PATH)
+
+    from app import app, init_db
+    init_db()
+    return app
+
+
+def genera_insegnanti(fake, quanti):
+    righe = []
+    for _ in range(quanti):
+        nome, cognome = fake.first_name(), fake.last_name()
+        righe.append({
+            'nome': nome,
+            'cognome': cognome,
+            'codice_fiscale': fake.ssn(),
+            'telefono': fake.phone_number(),
+            'email': f"{nome}.{cognome}@{fake.free_email_domain()}".lower().replace(' ', ''),
+            'via': fake.street_name(),
+            'civico': fake.building_number(),
+            'cap': fake.postcode(),
+            'citta': fake.city(),
+            'provincia': fake.state_abbr(),
+            'percentuale_guadagno': random.choice([25.0, 30.0, 35.0, 40.0, 50.0])
+        })
+    return righe
+
+
+def genera_corsi(quanti, insegnanti_ids):
+    righe = []
+    for i in range(quanti):
+        righe.append({
+            'nome': f"{random.choice(DISCIPLINE)} {random.choice(LIVELLI)} {i + 1}",
+            'giorno': random.choice(GIORNI),
+            'orario': time(random.randint(9, 21), random.choice([0, 30])),
+            'costo_mensile': random.choice([35, 40, 45, 50, 55, 60, 70]),
+            'max_iscritti': random.choice([15, 20, 25, 30]),
+            'insegnante_id': random.choice(insegnanti_ids),
+            'data_creazione': datetime.now()
+        })
+    return righe
+
+
+def genera_clienti(fake, quanti):
+    righe = []
+    for _ in range(quanti):
+        sesso = random.choice(['M', 'F'])
+        nome = fake.first_name_male() if sesso == 'M' else fake.first_name_female()
+        cognome = fake.last_name()
+        righe.append({
+            'nome': nome,
+            'cognome': cognome,
+            'codice_fiscale': fake.ssn(),
+            'telefono': fake.phone_number(),
+            'email': f"{nome}.{cognome}{random.randint(1, 999)}@{fake.free_email_domain()}".lower().replace(' ', ''),
+            'via': fake.street_name(),
+            'civico': fake.building_number(),
+            'cap': fake.postcode(),
+            'citta': fake.city(),
+            'provincia': fake.state_abbr(),
+            'data_nascita': fake.date_of_birth(minimum_age=4, maximum_age=60),
+            'comune_nascita': fake.city(),
+            'provincia_nascita': fake.state_abbr(),
+            'sesso': sesso,
+            'cf_calcolato_automaticamente': False,
+            'attivo': random.random() < 0.8
+        })
+    return righe
+
+
+def genera_pagamenti(iscrizioni, costi_corsi, mesi, quota_pagati):
+    """
+    Ogni iscrizione copre una finestra di mesi consecutivi dentro il periodo;
+    i pagamenti incassati hanno data nel mese di competenza.
+    Restituisce i pagamenti ordinati per data di pagamento (per numerare le ricevute).
+    """
+    pagamenti = []
+    for cliente_id, corso_id in iscrizioni:
+        durata = random.randint(6, min(36, len(mesi)))
+        inizio = random.randint(0, len(mesi) - durata)
+        for anno, mese in mesi[inizio:inizio + durata]:
+            pagato = random.random() < quota_pagati
+            data_pagamento = None
+            if pagato:
+                data_pagamento = datetime(anno, mese, random.randint(1, 28),
+                                          random.randint(9, 20), random.randint(0, 59))
+            pagamenti.append({
+                'mese': mese,
+                'anno': anno,
+                'importo': float(costi_corsi[corso_id]),
+                'pagato': pagato,
+                'data_pagamento': data_pagamento,
+                'data_creazione': datetime(anno, mese, 1) - timedelta(days=random.randint(0, 5)),
+                'metodo_pagamento': random.choice(METODI_PAGAMENTO),
+                'note': None,
+                'numero_ricevuta': None,
+                'cliente_id': cliente_id,
+                'corso_id': corso_id
+            })
+
+    # Numeri di ricevuta progressivi per anno, nell'ordine di incasso
+    pagamenti.sort(key=lambda p: (p['data_pagamento'] is None, p['data_pagamento'] or datetime.min))
+    ultimo_numero = {}
+    for pagamento in pagamenti:
+        if pagamento['data_pagamento']:
+            anno = pagamento['data_pagamento'].year
+            ultimo_numero[anno] = ultimo_numero.get(anno, 0) + 1
+            pagamento['numero_ricevuta'] = ultimo_numero[anno]
+    return pagamenti, ultimo_numero
+
+
+def main():
+    args = parse_args()
+
+    try:
+        from faker import Faker
+    except ImportError:
+        print("❌ Faker non installato: pip install Faker (è tra le dipendenze di sviluppo in requirements.txt)")
+        sys.exit(1)
+
+    percorso = os.path.abspath(args.db)
+    print("🔄 GENERAZIONE DATASET DI PROVA")
+    print("=" * 60)
+    print(f"💾 Database: {percorso}")
+
+    app = prepara_database(percorso, args.sovrascrivi)
+
+    from models import db, clienti_corsi, Cliente, Corso, Insegnante, Pagamento, NumerazioneRicevute
+
+    random.seed(args.seed)
+    fake = Faker('it_IT')
+    Faker.seed(args.seed)
+    inizio = datetime.now()
+
+    with app.app_context():
+        db.session.execute(db.insert(Insegnante), genera_insegnanti(fake, args.insegnanti))
+        insegnanti_ids = db.session.scalars(db.select(Insegnante.id)).all()
+        print(f"✅ Insegnanti: {len(insegnanti_ids)}")
+
+        db.session.execute(db.insert(Corso), genera_corsi(args.corsi, insegnanti_ids))
+        costi_corsi = dict(db.session.execute(db.select(Corso.id, Corso.costo_mensile)).all())
+        print(f"✅ Corsi: {len(costi_corsi)}")
+
+        db.session.execute(db.insert(Cliente), genera_clienti(fake, args.clienti))
+        clienti_ids = db.session.scalars(db.select(Cliente.id)).all()
+        print(f"✅ Clienti: {len(clienti_ids)}")
+
+        corsi_ids = list(costi_corsi)
+        iscrizioni = []
+        for cliente_id in clienti_ids:
+            quanti = random.randint(1, max(1, min(args.corsi_per_cliente, len(corsi_ids))))
+            for corso_id in random.sample(corsi_ids, quanti):
+                iscrizioni.append((cliente_id, corso_id))
+        db.session.execute(clienti_corsi.insert(),
+                           [{'cliente_id': cliente_id, 'corso_id': corso_id} for cliente_id, corso_id in iscrizioni])
+        print(f"✅ Iscrizioni: {len(iscrizioni)}")
+
+        pagamenti, ultimo_numero = genera_pagamenti(iscrizioni, costi_corsi, mesi_periodo(args.anni), args.quota_pagati)
+        for i in range(0, len(pagamenti), BLOCCO_INSERIMENTO):
+            db.session.execute(db.insert(Pagamento), pagamenti[i:i + BLOCCO_INSERIMENTO])
+        print(f"✅ Pagamenti: {len(pagamenti)} ({sum(1 for p in pagamenti if p['pagato'])} incassati)")
+
+        # Allinea la numerazione delle ricevute ai numeri assegnati
+        for anno, numero in sorted(ultimo_numero.items()):
+            db.session.add(NumerazioneRicevute(anno=anno, ultimo_numero=numero, numero_iniziale=1))
+
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+    durata = (datetime.now() - inizio).total_seconds()
+    print(f"\n🎉 Dataset generato in {durata:.1f} secondi")
+    print(f"💡 Benchmark: python benchmark/benchmark_route.py --db {percorso}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Stress test della numerazione ricevute: molti thread riservano numeri singoli
+e blocchi in parallelo su un database temporaneo. Una parte delle transazioni
+viene annullata di proposito.
+
+Verifica che:
+- i numeri confermati siano unici e consecutivi, senza buchi;
+- i numeri delle transazioni annullate tornino disponibili;
+- il sequencer non faccia commit delle modifiche in sospeso del chiamante.
+
+Uso:
+    python benchmark/stress_numerazione_ricevute.py --thread 16 --operazioni 50
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+from datetime import datetime
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Stress test della numerazione ricevute')
+    parser.add_argument('--thread', type=int, default=16)
+    parser.add_argument('--operazioni', type=int, default=50, help='transazioni per thread')
+    parser.add_argument('--blocco-massimo', type=int, default=20, help='dimensione massima dei blocchi riservati')
+    parser.add_argument('--quota-annullate', type=float, default=0.15, help='frazione di transazioni annullate')
+    parser.add_argument('--numero-iniziale', type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cartella = tempfile.mkdtemp(prefix='stress_numerazione_')
+    os.environ['DATABASE_PATH'] = os.path.join(cartella, 'stress.db')
+    os.environ.setdefault('DISABLE_TALISMAN_FOR_TEST', 'True')
+    # Niente thread in background (invio email, backup automatici)
+    os.environ['EMAIL_OUTBOX_WORKER'] = 'False'
+    os.environ['BACKUP_SCHEDULE_MINUTES'] = '0'
+    sys.path.append(BASE_PATH)
+
+    from sqlalchemy.exc import OperationalError
+    from app import app, init_db
+    from models import db, Insegnante, NumerazioneRicevute, Settings
+
+    init_db()
+    anno = datetime.now().year
+    with app.app_context():
+        settings = Settings.get_settings()
+        settings.numero_ricevuta_iniziale = args.numero_iniziale
+        db.session.commit()
+
+    confermati = []
+    annullati = []
+    ripetute = [0]
+    lock = threading.Lock()
+    partenza = threading.Barrier(args.thread)
+
+    def lavoratore(indice):
+        casuale = random.Random(indice)
+        partenza.wait()
+        with app.app_context():
+            for operazione in range(args.operazioni):
+                while True:
+                    try:
+                        # Modifica non correlata in sospeso: deve seguire la sorte della transazione
+                        db.session.add(Insegnante(nome='stress', cognome=f'{indice}-{operazione}'))
+                        quanti = 1 if casuale.random() < 0.5 else casuale.randint(2, args.blocco_massimo)
+                        if quanti == 1:
+                            numeri = [NumerazioneRicevute.get_prossimo_numero(anno)]
+                        else:
+                            numeri = list(NumerazioneRicevute.riserva_blocco(anno, quanti))
+
+                        if casuale.random() < args.quota_annullate:
+                            db.session.rollback()
+                            with lock:
+                                annullati.append(f'{indice}-{operazione}')
+                        else:
+                            db.session.commit()
+                            with lock:
+                                confermati.extend(numeri)
+                        break
+                    except OperationalError:
+                        # Database occupato oltre il timeout: si riprova l'intera transazione
+                        db.session.rollback()
+                        with lock:
+                            ripetute[0] += 1
+            db.session.remove()
+
+    print("🔄 STRESS TEST NUMERAZIONE RICEVUTE")
+    print("=" * 60)
+    print(f"   Thread: {args.thread}, transazioni per thread: {args.operazioni}")
+
+    inizio = datetime.now()
+    threads = [threading.Thread(target=lavoratore, args=(i,)) for i in range(args.thread)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    durata = (datetime.now() - inizio).total_seconds()
+
+    errori = []
+    attesi = list(range(args.numero_iniziale, args.numero_iniziale + len(confermati)))
+    if len(set(confermati)) != len(confermati):
+        errori.append(f"{len(confermati) - len(set(confermati))} numeri duplicati")
+    if sorted(confermati) != attesi:
+        mancanti = sorted(set(attesi) - set(confermati))
+        errori.append(f"numerazione con buchi, mancanti: {mancanti[:10]}")
+
+    with app.app_context():
+        ultimo = NumerazioneRicevute.get_ultimo_numero(anno)
+        insegnanti = Insegnante.query.filter_by(nome='stress').count()
+    if confermati and ultimo != max(confermati):
+        errori.append(f"ultimo numero nel DB {ultimo} diverso dal massimo confermato {max(confermati)}")
+    transazioni_confermate = args.thread * args.operazioni - len(annullati)
+    if insegnanti != transazioni_confermate:
+        errori.append(f"{insegnanti} modifiche salvate invece di {transazioni_confermate}: "
+                      f"il sequencer ha fatto commit di modifiche annullate")
+
+    print(f"   Numeri confermati: {len(confermati)} in {durata:.2f} s")
+    print(f"   Transazioni annullate: {len(annullati)}, ripetute per database occupato: {ripetute[0]}")
+    shutil.rmtree(cartella, ignore_errors=True)
+
+    if errori:
+        for errore in errori:
+            print(f"❌ {errore}")
+        sys.exit(1)
+    print("✅ Numeri unici e consecutivi, nessun commit delle modifiche annullate")
+
+
+if __name__ == '__main__':
+    main()
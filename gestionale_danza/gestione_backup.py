@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Gestione da riga di comando dell'archivio dei backup incrementali
+(utils/archivio_backup.py). Usa le stesse variabili BACKUP_* dell'app,
+lette anche dal file .env.
+
+Uso:
+    python gestione_backup.py elenco
+    python gestione_backup.py crea
+    python gestione_backup.py verifica <id>
+    python gestione_backup.py ripristina <id> [--ricevute]
+    python gestione_backup.py pulisci [--tutte]
+
+Tutti i comandi riguardano le istantanee del database dell'app
+(DATABASE_PATH). Il ripristino va eseguito ad applicazione ferma: ricostruisce il database
+dell'istantanea, ne controlla checksum e PRAGMA integrity_check e solo se
+integro lo sostituisce a quello attuale, che viene prima salvato a sua volta
+come istantanea. Le istantanee manuali e di sicurezza (prima del ripristino
+o del setup) non sono soggette alla conservazione: si eliminano solo con
+pulisci --tutte.
+"""
+
+import os
+import sys
+import argparse
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(base_path)
+
+from dotenv import load_dotenv
+from utils.archivio_backup import archivio_da_ambiente, ErroreBackup
+
+load_dotenv(os.path.join(base_path, '.env'))
+database_path = os.path.abspath(os.environ.get('DATABASE_PATH') or os.path.join(base_path, 'data', 'database.db'))
+pdf_folder = os.path.join(base_path, 'pdf_ricevute')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Backup incrementali del database Dance2Manage')
+    comandi = parser.add_subparsers(dest='comando', required=True)
+    comandi.add_parser('elenco', help='istantanee disponibili')
+    comandi.add_parser('crea', help='nuova istantanea del database e delle ricevute')
+    verifica = comandi.add_parser('verifica', help='ricostruisce un\'istantanea e ne controlla l\'integrità')
+    verifica.add_argument('id')
+    ripristina = comandi.add_parser('ripristina', help='sostituisce il database con un\'istantanea (app ferma)')
+    ripristina.add_argument('id')
+    ripristina.add_argument('--ricevute', action='store_true', help='ripristina anche le ricevute PDF')
+    pulisci = comandi.add_parser('pulisci', help='applica la politica di conservazione')
+    pulisci.add_argument('--tutte', action='store_true',
+                         help='anche alle istantanee manuali e di sicurezza (prima del ripristino o del setup)')
+    return parser.parse_args()
+
+
+def elenco(archivio):
+    istantanee = archivio.elenco(database_path)
+    if not istantanee:
+        print("ℹ️  Nessuna istantanea in archivio")
+        return
+    print(f"📦 Istantanee di {database_path} in {archivio.cartella}")
+    print("=" * 70)
+    for manifest in istantanee:
+        print(f"   {manifest['id']:<20} {manifest['database']['dimensione'] // 1024:>8} KB  "
+              f"{len(manifest['file']):>5} file  {manifest['byte_nuovi'] // 1024:>7} KB nuovi  {manifest['motivo']}")
+
+
+def main():
+    args = parse_args()
+    archivio = archivio_da_ambiente(base_path, database_path)
+
+    try:
+        if args.comando == 'elenco':
+            elenco(archivio)
+
+        elif args.comando == 'crea':
+            if not os.path.exists(database_path):
+                print(f"❌ Database {database_path} non trovato!")
+                sys.exit(1)
+            archivio.crea(database_path, [pdf_folder], base_path, motivo='manuale')
+            archivio.pulisci(database_path)
+
+        elif args.comando == 'verifica':
+            problemi = archivio.verifica(args.id)
+            if problemi:
+                print(f"❌ Istantanea {args.id} non valida:")
+                for problema in problemi[:20]:
+                    print(f"   {problema}")
+                sys.exit(1)
+            print(f"✅ Istantanea {args.id} integra")
+
+        elif args.comando == 'ripristina':
+            print(f"🔄 Ripristino dell'istantanea {args.id} in {database_path}")
+            sicurezza = archivio.ripristina(args.id, database_path, base_path, file=args.ricevute)
+            if sicurezza:
+                print(f"💾 Database precedente salvato nell'istantanea {sicurezza}")
+            print(f"✅ Database ripristinato dall'istantanea {args.id}")
+
+        elif args.comando == 'pulisci':
+            eliminate = archivio.pulisci(database_path, tutte=args.tutte)
+            print(f"✅ Istantanee eliminate: {len(eliminate)}")
+
+    except ErroreBackup as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Migration 004: Aggiunge gli indici secondari su pagamenti, clienti_corsi, corsi e clienti
+Data: 17/10/2026
+Descrizione: Crea gli indici dichiarati sui modelli (vedi models/indici.py), tra cui
+             l'indice univoco (cliente_id, corso_id, mese, anno) e gli indici coprenti
+             (anno, mese, pagato, importo) e (corso_id, anno, mese, pagato).
+             In modalità 'check' verifica con EXPLAIN QUERY PLAN che le query
+             critiche non eseguano scansioni complete.
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+# Aggiungi il percorso del progetto
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.indici import crea_indici, verifica_piani_query, indici_gestiti
+from utils.backup_database import copia_online
+
+def run_migration():
+    """Esegue la migrazione per creare gli indici"""
+
+    print("🔄 MIGRAZIONE 004: Indici secondari per pagamenti, iscrizioni, corsi e clienti")
+    print("=" * 70)
+
+    # Percorso database
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    # Backup del database (copia online: comprende i commit ancora nel file -wal)
+    backup_path = f"{database_path}.backup_migration_004_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    copia_online(database_path, backup_path)
+    print(f"💾 Backup creato: {backup_path}")
+
+    conn = None
+    try:
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+
+        creati, saltati = crea_indici(cursor)
+
+        for nome in creati:
+            print(f"✅ Creato indice: {nome}")
+
+        for nome, errore in saltati:
+            print(f"⚠️  Indice {nome} non creato: {errore}")
+            print("   Esistono pagamenti duplicati per cliente/corso/periodo: correggerli e rieseguire la migrazione")
+
+        conn.commit()
+
+        problemi = verifica_piani_query(cursor)
+        conn.close()
+
+        print(f"\n📊 RIEPILOGO MIGRAZIONE:")
+        print(f"   Indici creati: {len(creati)}")
+        print(f"   Indici saltati: {len(saltati)}")
+        print(f"   Query critiche con scansione completa: {len(problemi)}")
+
+        print(f"\n🎉 MIGRAZIONE 004 COMPLETATA!")
+        print(f"💾 Backup disponibile in: {backup_path}")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Errore durante la migrazione: {str(e)}")
+
+        # Ripristina backup in caso di errore (la connessione va chiusa prima)
+        if conn is not None:
+            conn.close()
+        if os.path.exists(backup_path):
+            copia_online(backup_path, database_path, un_solo_file=False)
+            print(f"🔄 Database ripristinato dal backup")
+
+        return False
+
+def check_migration_status():
+    """Controlla lo stato della migrazione e i piani delle query critiche"""
+
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+
+    print(f"📊 STATO MIGRAZIONE 004")
+    print("=" * 40)
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    esistenti = {row[0] for row in cursor.fetchall()}
+
+    print(f"Controllo indici:")
+    for indice in indici_gestiti():
+        status = "✅ Presente" if indice.name in esistenti else "❌ Mancante"
+        print(f"   {indice.name}: {status}")
+
+    problemi = verifica_piani_query(cursor)
+    conn.close()
+
+    print(f"\nControllo EXPLAIN QUERY PLAN:")
+    if not problemi:
+        print("   ✅ Tutte le query critiche usano un indice")
+    for descrizione, dettaglio in problemi:
+        print(f"   ❌ {descrizione}: {dettaglio}")
+
+    return not problemi
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        if not check_migration_status():
+            sys.exit(1)
+    else:
+        success = run_migration()
+        if not success:
+            print("\n❌ Migrazione fallita!")
+            sys.exit(1)
+        else:
+            print("\n✅ Migrazione completata con successo!")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Migration 005: Aggiunge la versione delle impostazioni
+Data: 17/10/2026
+Descrizione: Aggiunge la colonna settings.versione, incrementata a ogni salvataggio
+             delle impostazioni. Ogni worker confronta la versione nel DB con quella
+             della propria cache e ricarica le impostazioni solo quando cambia.
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+# Aggiungi il percorso del progetto
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.backup_database import copia_online
+
+def run_migration():
+    """Esegue la migrazione per aggiungere la colonna versione"""
+    
+    print("🔄 MIGRAZIONE 005: Versione impostazioni per la cache")
+    print("=" * 70)
+    
+    # Percorso database
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+    
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+    
+    # Backup del database (copia online: comprende i commit ancora nel file -wal)
+    backup_path = f"{database_path}.backup_migration_005_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    copia_online(database_path, backup_path)
+    print(f"💾 Backup creato: {backup_path}")
+    
+    conn = None
+    try:
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+        
+        # Controlla se la colonna esiste già
+        cursor.execute("PRAGMA table_info(settings)")
+        existing_columns = [row[1] for row in cursor.fetchall()]
+        
+        if 'versione' not in existing_columns:
+            cursor.execute("ALTER TABLE settings ADD COLUMN versione INTEGER NOT NULL DEFAULT 1")
+            print("✅ Aggiunta colonna: versione (INTEGER NOT NULL DEFAULT 1)")
+        else:
+            print("ℹ️  Colonna versione già esistente")
+        
+        conn.commit()
+        conn.close()
+        
+        print(f"\n🎉 MIGRAZIONE 005 COMPLETATA!")
+        print(f"💾 Backup disponibile in: {backup_path}")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Errore durante la migrazione: {str(e)}")
+        
+        # Ripristina backup in caso di errore (la connessione va chiusa prima)
+        if conn is not None:
+            conn.close()
+        if os.path.exists(backup_path):
+            copia_online(backup_path, database_path, un_solo_file=False)
+            print(f"🔄 Database ripristinato dal backup")
+        
+        return False
+
+def check_migration_status():
+    """Controlla lo stato della migrazione"""
+    
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+    
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return
+    
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+    
+    print(f"📊 STATO MIGRAZIONE 005")
+    print("=" * 40)
+    
+    cursor.execute("PRAGMA table_info(settings)")
+    found = any(col[1] == 'versione' for col in cursor.fetchall())
+    status = "✅ Presente" if found else "❌ Mancante"
+    print(f"   versione: {status}")
+    
+    if found:
+        cursor.execute("SELECT versione FROM settings ORDER BY id LIMIT 1")
+        row = cursor.fetchone()
+        print(f"\nVersione impostazioni corrente: {row[0] if row else 'nessun record'}")
+    
+    conn.close()
+
+if __name__ == '__main__':
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_migration_status()
+    else:
+        success = run_migration()
+        if not success:
+            print("\n❌ Migrazione fallita!")
+            sys.exit(1)
+        else:
+            print("\n✅ Migrazione completata con successo!")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Migration 006: Aggiunge la coda delle email in uscita
+Data: 17/10/2026
+Descrizione: Crea la tabella messaggi_email (outbox) con i suoi indici. Le route
+             accodano ricevute e report insegnanti in questa tabella e il worker in
+             background (utils/coda_email.py) li invia registrando tentativi ed esito.
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+# Aggiungi il percorso del progetto
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import sqlite
+from models import MessaggioEmail
+from models.indici import ddl_indice
+from utils.backup_database import copia_online
+
+def run_migration():
+    """Esegue la migrazione per creare la tabella messaggi_email"""
+
+    print("🔄 MIGRAZIONE 006: Coda email in uscita")
+    print("=" * 70)
+
+    # Percorso database
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    # Backup del database (copia online: comprende i commit ancora nel file -wal)
+    backup_path = f"{database_path}.backup_migration_006_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    copia_online(database_path, backup_path)
+    print(f"💾 Backup creato: {backup_path}")
+
+    conn = None
+    try:
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+
+        tabella = MessaggioEmail.__table__
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (tabella.name,))
+        if cursor.fetchone() is None:
+            cursor.execute(str(CreateTable(tabella).compile(dialect=sqlite.dialect())))
+            print(f"✅ Creata tabella: {tabella.name}")
+        else:
+            print(f"ℹ️  Tabella {tabella.name} già esistente")
+
+        for indice in sorted(tabella.indexes, key=lambda indice: indice.name):
+            cursor.execute(ddl_indice(indice))
+            print(f"✅ Indice: {indice.name}")
+
+        conn.commit()
+        conn.close()
+
+        print(f"\n🎉 MIGRAZIONE 006 COMPLETATA!")
+        print(f"💾 Backup disponibile in: {backup_path}")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Errore durante la migrazione: {str(e)}")
+
+        # Ripristina backup in caso di errore (la connessione va chiusa prima)
+        if conn is not None:
+            conn.close()
+        if os.path.exists(backup_path):
+            copia_online(backup_path, database_path, un_solo_file=False)
+            print(f"🔄 Database ripristinato dal backup")
+
+        return False
+
+def check_migration_status():
+    """Controlla lo stato della migrazione"""
+
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+
+    print(f"📊 STATO MIGRAZIONE 006")
+    print("=" * 40)
+
+    tabella = MessaggioEmail.__table__
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (tabella.name,))
+    found = cursor.fetchone() is not None
+    status = "✅ Presente" if found else "❌ Mancante"
+    print(f"   {tabella.name}: {status}")
+
+    if found:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        esistenti = {row[0] for row in cursor.fetchall()}
+        for indice in sorted(tabella.indexes, key=lambda indice: indice.name):
+            status = "✅ Presente" if indice.name in esistenti else "❌ Mancante"
+            print(f"   {indice.name}: {status}")
+
+        cursor.execute(f"SELECT stato, COUNT(*) FROM {tabella.name} GROUP BY stato")
+        righe = cursor.fetchall()
+        print(f"\nMessaggi per stato:")
+        for stato, totale in righe:
+            print(f"   {stato}: {totale}")
+        if not righe:
+            print("   nessun messaggio")
+
+    conn.close()
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_migration_status()
+    else:
+        success = run_migration()
+        if not success:
+            print("\n❌ Migrazione fallita!")
+            sys.exit(1)
+        else:
+            print("\n✅ Migrazione completata con successo!")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Migration 007: Invio massivo delle ricevute per email
+Data: 17/10/2026
+Descrizione: Aggiunge la colonna messaggi_email.lotto (invio massivo di cui fa parte
+             il messaggio, per seguirne l'avanzamento) e la tabella
+             messaggi_email_pagamenti con le ricevute allegate a ogni messaggio
+             (un'email per cliente con tutte le sue ricevute).
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+# Aggiungi il percorso del progetto
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import sqlite
+from models import MessaggioEmail, messaggi_email_pagamenti
+from models.indici import ddl_indice
+from utils.backup_database import copia_online
+
+def run_migration():
+    """Esegue la migrazione per l'invio massivo delle ricevute"""
+
+    print("🔄 MIGRAZIONE 007: Invio massivo ricevute per email")
+    print("=" * 70)
+
+    # Percorso database
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    # Backup del database (copia online: comprende i commit ancora nel file -wal)
+    backup_path = f"{database_path}.backup_migration_007_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    copia_online(database_path, backup_path)
+    print(f"💾 Backup creato: {backup_path}")
+
+    conn = None
+    try:
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tabelle = {row[0] for row in cursor.fetchall()}
+        if 'messaggi_email' not in tabelle:
+            print("❌ Tabella messaggi_email mancante: eseguire prima la migrazione 006")
+            conn.close()
+            return False
+
+        # Colonna lotto
+        cursor.execute("PRAGMA table_info(messaggi_email)")
+        existing_columns = [row[1] for row in cursor.fetchall()]
+        if 'lotto' not in existing_columns:
+            cursor.execute("ALTER TABLE messaggi_email ADD COLUMN lotto VARCHAR(32)")
+            print("✅ Aggiunta colonna: lotto (VARCHAR(32))")
+        else:
+            print("ℹ️  Colonna lotto già esistente")
+
+        # Ricevute allegate ai messaggi
+        if messaggi_email_pagamenti.name not in tabelle:
+            cursor.execute(str(CreateTable(messaggi_email_pagamenti).compile(dialect=sqlite.dialect())))
+            print(f"✅ Creata tabella: {messaggi_email_pagamenti.name}")
+        else:
+            print(f"ℹ️  Tabella {messaggi_email_pagamenti.name} già esistente")
+
+        indici = list(MessaggioEmail.__table__.indexes) + list(messaggi_email_pagamenti.indexes)
+        for indice in sorted(indici, key=lambda indice: indice.name):
+            cursor.execute(ddl_indice(indice))
+            print(f"✅ Indice: {indice.name}")
+
+        conn.commit()
+        conn.close()
+
+        print(f"\n🎉 MIGRAZIONE 007 COMPLETATA!")
+        print(f"💾 Backup disponibile in: {backup_path}")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Errore durante la migrazione: {str(e)}")
+
+        # Ripristina backup in caso di errore (la connessione va chiusa prima)
+        if conn is not None:
+            conn.close()
+        if os.path.exists(backup_path):
+            copia_online(backup_path, database_path, un_solo_file=False)
+            print(f"🔄 Database ripristinato dal backup")
+
+        return False
+
+def check_migration_status():
+    """Controlla lo stato della migrazione"""
+
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_path = os.path.join(base_path, 'data', 'database.db')
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+
+    print(f"📊 STATO MIGRAZIONE 007")
+    print("=" * 40)
+
+    cursor.execute("PRAGMA table_info(messaggi_email)")
+    found = any(col[1] == 'lotto' for col in cursor.fetchall())
+    status = "✅ Presente" if found else "❌ Mancante"
+    print(f"   messaggi_email.lotto: {status}")
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (messaggi_email_pagamenti.name,))
+    found = cursor.fetchone() is not None
+    status = "✅ Presente" if found else "❌ Mancante"
+    print(f"   {messaggi_email_pagamenti.name}: {status}")
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    esistenti = {row[0] for row in cursor.fetchall()}
+    for indice in ['ix_messaggi_email_lotto', 'ix_messaggi_email_pagamenti_pagamento']:
+        status = "✅ Presente" if indice in esistenti else "❌ Mancante"
+        print(f"   {indice}: {status}")
+
+    conn.close()
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_migration_status()
+    else:
+        success = run_migration()
+        if not success:
+            print("\n❌ Migrazione fallita!")
+            sys.exit(1)
+        else:
+            print("\n✅ Migrazione completata con successo!")
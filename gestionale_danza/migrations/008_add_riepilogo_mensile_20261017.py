@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Migration 008: Riepilogo mensile per corso
+Data: 17/10/2026
+Descrizione: Crea la tabella riepilogo_mensile (incassato, da incassare e compenso
+             insegnante per anno, mese e corso), i trigger che la aggiornano a ogni
+             modifica dei pagamenti e la popola dai pagamenti esistenti.
+             `check` confronta la tabella con un ricalcolo dai pagamenti,
+             `ricostruisci` la ricalcola da zero (riparazione).
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+# Aggiungi il percorso del progetto
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import sqlite
+from models import RiepilogoMensile
+from models.riepilogo_mensile import TRIGGER_RIEPILOGO, crea_trigger_riepilogo, ricostruisci_riepilogo
+from utils.backup_database import copia_online
+
+# Totali calcolati direttamente dai pagamenti, per il confronto
+CONFRONTO = """
+    SELECT p.anno, p.mese, p.corso_id,
+           ROUND(SUM(CASE WHEN p.pagato THEN COALESCE(p.importo, 0) ELSE 0 END), 2),
+           ROUND(SUM(CASE WHEN p.pagato THEN 0 ELSE COALESCE(p.importo, 0) END), 2),
+           COUNT(*)
+    FROM pagamenti p
+    GROUP BY p.anno, p.mese, p.corso_id
+"""
+
+def _database_path():
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, 'data', 'database.db')
+
+def run_migration():
+    """Esegue la migrazione del riepilogo mensile"""
+
+    print("🔄 MIGRAZIONE 008: Riepilogo mensile per corso")
+    print("=" * 70)
+
+    database_path = _database_path()
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    # Backup del database (copia online: comprende i commit ancora nel file -wal)
+    backup_path = f"{database_path}.backup_migration_008_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    copia_online(database_path, backup_path)
+    print(f"💾 Backup creato: {backup_path}")
+
+    conn = None
+    try:
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tabelle = {row[0] for row in cursor.fetchall()}
+        if RiepilogoMensile.__tablename__ not in tabelle:
+            cursor.execute(str(CreateTable(RiepilogoMensile.__table__).compile(dialect=sqlite.dialect())))
+            print(f"✅ Creata tabella: {RiepilogoMensile.__tablename__}")
+        else:
+            print(f"ℹ️  Tabella {RiepilogoMensile.__tablename__} già esistente")
+
+        crea_trigger_riepilogo(cursor)
+        for nome, _ in TRIGGER_RIEPILOGO:
+            print(f"✅ Trigger: {nome}")
+
+        ricostruisci_riepilogo(cursor)
+        cursor.execute("SELECT COUNT(*) FROM riepilogo_mensile")
+        print(f"✅ Riepilogo popolato: {cursor.fetchone()[0]} righe")
+
+        conn.commit()
+        conn.close()
+
+        print(f"\n🎉 MIGRAZIONE 008 COMPLETATA!")
+        print(f"💾 Backup disponibile in: {backup_path}")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Errore durante la migrazione: {str(e)}")
+
+        # Ripristina backup in caso di errore (la connessione va chiusa prima)
+        if conn is not None:
+            conn.close()
+        if os.path.exists(backup_path):
+            copia_online(backup_path, database_path, un_solo_file=False)
+            print(f"🔄 Database ripristinato dal backup")
+
+        return False
+
+def check_migration_status():
+    """Controlla lo stato della migrazione e la coerenza del riepilogo"""
+
+    database_path = _database_path()
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+
+    print(f"📊 STATO MIGRAZIONE 008")
+    print("=" * 40)
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'riepilogo_mensile'")
+    found = cursor.fetchone() is not None
+    status = "✅ Presente" if found else "❌ Mancante"
+    print(f"   riepilogo_mensile: {status}")
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+    esistenti = {row[0] for row in cursor.fetchall()}
+    for nome, _ in TRIGGER_RIEPILOGO:
+        status = "✅ Presente" if nome in esistenti else "❌ Mancante"
+        print(f"   {nome}: {status}")
+
+    if found:
+        cursor.execute(CONFRONTO)
+        attesi = {row[:3]: row[3:] for row in cursor.fetchall()}
+        cursor.execute("""SELECT anno, mese, corso_id, ROUND(incassato, 2), ROUND(da_incassare, 2), numero_pagamenti
+                          FROM riepilogo_mensile""")
+        salvati = {row[:3]: row[3:] for row in cursor.fetchall()}
+        differenze = [chiave for chiave in attesi.keys() | salvati.keys()
+                      if attesi.get(chiave) != salvati.get(chiave)]
+        if differenze:
+            print(f"   ⚠️  {len(differenze)} righe non allineate ai pagamenti (es. {sorted(differenze)[:5]})")
+            print("   Eseguire: python migrations/008_add_riepilogo_mensile_20261017.py ricostruisci")
+        else:
+            print(f"   ✅ Totali allineati ai pagamenti ({len(salvati)} righe)")
+
+    conn.close()
+
+def ricostruisci():
+    """Ricalcola riepilogo_mensile da tutti i pagamenti"""
+
+    database_path = _database_path()
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+    ricostruisci_riepilogo(cursor)
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM riepilogo_mensile")
+    print(f"✅ Riepilogo ricalcolato: {cursor.fetchone()[0]} righe")
+    conn.close()
+    return True
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_migration_status()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'ricostruisci':
+        if not ricostruisci():
+            sys.exit(1)
+    else:
+        success = run_migration()
+        if not success:
+            print("\n❌ Migrazione fallita!")
+            sys.exit(1)
+        else:
+            print("\n✅ Migrazione completata con successo!")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Migration 009: Ricerca full-text dei clienti
+Data: 17/10/2026
+Descrizione: Crea la tabella virtuale FTS5 clienti_fts (nome, cognome, email,
+             codice fiscale, telefono) con i trigger che la allineano a clienti
+             e la popola con i clienti esistenti.
+             `check` verifica l'indice, `ricostruisci` lo ricrea da zero.
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+# Aggiungi il percorso del progetto
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.ricerca_clienti import TRIGGER_RICERCA, crea_indice_ricerca, ricostruisci_indice_ricerca
+from utils.backup_database import copia_online
+
+def _database_path():
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, 'data', 'database.db')
+
+def run_migration():
+    """Esegue la migrazione della ricerca clienti"""
+
+    print("🔄 MIGRAZIONE 009: Ricerca full-text clienti (FTS5)")
+    print("=" * 70)
+
+    database_path = _database_path()
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    # Backup del database (copia online: comprende i commit ancora nel file -wal)
+    backup_path = f"{database_path}.backup_migration_009_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    copia_online(database_path, backup_path)
+    print(f"💾 Backup creato: {backup_path}")
+
+    conn = None
+    try:
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+
+        if crea_indice_ricerca(cursor):
+            print("✅ Creata tabella: clienti_fts")
+        else:
+            print("ℹ️  Tabella clienti_fts già esistente")
+        for nome, _ in TRIGGER_RICERCA:
+            print(f"✅ Trigger: {nome}")
+
+        ricostruisci_indice_ricerca(cursor)
+        cursor.execute("SELECT COUNT(*) FROM clienti")
+        print(f"✅ Clienti indicizzati: {cursor.fetchone()[0]}")
+
+        conn.commit()
+        conn.close()
+
+        print(f"\n🎉 MIGRAZIONE 009 COMPLETATA!")
+        print(f"💾 Backup disponibile in: {backup_path}")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Errore durante la migrazione: {str(e)}")
+
+        # Ripristina backup in caso di errore (la connessione va chiusa prima)
+        if conn is not None:
+            conn.close()
+        if os.path.exists(backup_path):
+            copia_online(backup_path, database_path, un_solo_file=False)
+            print(f"🔄 Database ripristinato dal backup")
+
+        return False
+
+def check_migration_status():
+    """Controlla lo stato della migrazione e l'integrità dell'indice"""
+
+    database_path = _database_path()
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+
+    print(f"📊 STATO MIGRAZIONE 009")
+    print("=" * 40)
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE name = 'clienti_fts'")
+    found = cursor.fetchone() is not None
+    status = "✅ Presente" if found else "❌ Mancante"
+    print(f"   clienti_fts: {status}")
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+    esistenti = {row[0] for row in cursor.fetchall()}
+    for nome, _ in TRIGGER_RICERCA:
+        status = "✅ Presente" if nome in esistenti else "❌ Mancante"
+        print(f"   {nome}: {status}")
+
+    if found:
+        try:
+            cursor.execute("INSERT INTO clienti_fts (clienti_fts, rank) VALUES ('integrity-check', 0)")
+            print("   ✅ Indice integro")
+        except sqlite3.DatabaseError as e:
+            print(f"   ⚠️  Indice non valido: {e}")
+            print("   Eseguire: python migrations/009_add_ricerca_clienti_fts_20261017.py ricostruisci")
+
+    conn.close()
+
+def ricostruisci():
+    """Reindicizza tutti i clienti"""
+
+    database_path = _database_path()
+
+    if not os.path.exists(database_path):
+        print("❌ Database non trovato!")
+        return False
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+    crea_indice_ricerca(cursor)
+    ricostruisci_indice_ricerca(cursor)
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM clienti")
+    print(f"✅ Indice ricostruito: {cursor.fetchone()[0]} clienti")
+    conn.close()
+    return True
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_migration_status()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'ricostruisci':
+        if not ricostruisci():
+            sys.exit(1)
+    else:
+        success = run_migration()
+        if not success:
+            print("\n❌ Migrazione fallita!")
+            sys.exit(1)
+        else:
+            print("\n✅ Migrazione completata con successo!")
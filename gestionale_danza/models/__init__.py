@@ -1,6 +1,6 @@
 # models/__init__.py
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Table, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -11,7 +11,9 @@ Base = declarative_base()
 # Tabella di associazione per relazione molti-a-molti tra Clienti e Corsi
 clienti_corsi = Table('clienti_corsi', db.Model.metadata,
     Column('cliente_id', Integer, ForeignKey('clienti.id'), primary_key=True),
-    Column('corso_id', Integer, ForeignKey('corsi.id'), primary_key=True)
+    Column('corso_id', Integer, ForeignKey('corsi.id'), primary_key=True),
+    # La chiave primaria copre la ricerca per cliente, questo indice quella per corso
+    Index('ix_clienti_corsi_corso', 'corso_id', 'cliente_id')
 )
 
 from .user import User, Role, WebAuthn
@@ -20,4 +22,8 @@ from .corso import Corso
 from .insegnante import Insegnante
 from .pagamento import Pagamento
 from .settings import Settings
-from .numerazione_ricevute import NumerazioneRicevute
\ No newline at end of file
+from .numerazione_ricevute import NumerazioneRicevute
+from .messaggio_email import MessaggioEmail, messaggi_email_pagamenti
+from .riepilogo_mensile import RiepilogoMensile
+from . import ricerca_clienti
+from .tentativo_accesso import TentativoAccesso
@@ -1,12 +1,17 @@
 # models/cliente.py
 from . import db, clienti_corsi
-from sqlalchemy import Column, Integer, String, Boolean, Date
+from sqlalchemy import Column, Integer, String, Boolean, Date, Index
 from sqlalchemy.orm import relationship
 from datetime import date
 import re
 
 class Cliente(db.Model):
     __tablename__ = 'clienti'
+    __table_args__ = (
+        # Ordinamento alfabetico della lista e delle select dei clienti attivi
+        Index('ix_clienti_cognome_nome', 'cognome', 'nome'),
+        Index('ix_clienti_attivo_cognome_nome', 'attivo', 'cognome', 'nome'),
+    )
     
     id = Column(Integer, primary_key=True)
     nome = Column(String(100), nullable=False)
@@ -1,11 +1,15 @@
 # models/corso.py
 from . import db, clienti_corsi
-from sqlalchemy import Column, Integer, String, ForeignKey, Time, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, Time, DateTime, Index, select, func
+from sqlalchemy.orm import relationship, column_property
 from datetime import datetime
 
 class Corso(db.Model):
     __tablename__ = 'corsi'
+    __table_args__ = (
+        Index('ix_corsi_insegnante', 'insegnante_id'),
+        Index('ix_corsi_nome', 'nome'),
+    )
     
     id = Column(Integer, primary_key=True)
     nome = Column(String(100), nullable=False)
@@ -27,12 +31,25 @@ class Corso(db.Model):
     # Relazione uno-a-molti con Pagamenti
     pagamenti = relationship('Pagamento', back_populates='corso', cascade='all, delete-orphan')
     
+    # Conteggio iscritti calcolato in SQL: differito, le viste che mostrano solo il numero
+    # lo caricano insieme al corso con undefer(Corso.conteggio_iscritti)
+    conteggio_iscritti = column_property(
+        select(func.count(clienti_corsi.c.cliente_id))
+        .where(clienti_corsi.c.corso_id == id)
+        .correlate_except(clienti_corsi)
+        .scalar_subquery(),
+        deferred=True
+    )
+    
     def __repr__(self):
         return f'<Corso {self.nome} - {self.giorno} {self.orario}>'
     
     @property
     def numero_iscritti(self):
-        return len(self.clienti)
+        # Se gli iscritti sono già caricati li conta in memoria (riflette anche modifiche non salvate)
+        if 'clienti' in self.__dict__:
+            return len(self.clienti)
+        return self.conteggio_iscritti
     
     @property
     def posti_disponibili(self):
@@ -0,0 +1,102 @@
+# models/indici.py
+"""
+Gestione degli indici secondari dichiarati sui modelli.
+Usato da setup_database.py e dalle migrazioni, che lavorano con sqlite3 puro.
+"""
+import sqlite3
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.dialects import sqlite
+from . import db
+
+# Tabelle con indici gestiti
+TABELLE_INDICIZZATE = ['pagamenti', 'clienti_corsi', 'corsi', 'clienti', 'messaggi_email', 'messaggi_email_pagamenti',
+                       'tentativi_accesso']
+
+# Query frequenti che devono sempre usare un indice: (descrizione, sql, parametri)
+QUERY_CRITICHE = [
+    ('Dashboard: incasso del mese',
+     "SELECT SUM(importo) FROM pagamenti WHERE mese = ? AND anno = ? AND pagato = 1",
+     (1, 2025)),
+    ('Generazione bulk: pagamento già esistente',
+     "SELECT id FROM pagamenti WHERE cliente_id = ? AND corso_id = ? AND mese = ? AND anno = ?",
+     (1, 1, 1, 2025)),
+    ('Insegnante: guadagno per corso',
+     "SELECT SUM(importo), COUNT(*) FROM pagamenti WHERE corso_id = ? AND pagato = 1 AND mese = ? AND anno = ?",
+     (1, 1, 2025)),
+    ('Report: incassi per corso',
+     """SELECT corsi.id, insegnanti.id, SUM(pagamenti.importo), COUNT(pagamenti.id)
+        FROM corsi JOIN pagamenti ON pagamenti.corso_id = corsi.id
+        JOIN insegnanti ON corsi.insegnante_id = insegnanti.id
+        WHERE pagamenti.mese = ? AND pagamenti.anno = ? AND pagamenti.pagato = 1
+        GROUP BY corsi.id, insegnanti.id""",
+     (1, 2025)),
+    ('Pagamenti: incassato del giorno',
+     "SELECT SUM(importo) FROM pagamenti WHERE data_pagamento >= ? AND data_pagamento < ? AND pagato = 1",
+     ('2025-01-01 00:00:00.000000', '2025-01-02 00:00:00.000000')),
+    ('Cliente: pagamenti',
+     "SELECT id FROM pagamenti WHERE cliente_id = ?",
+     (1,)),
+    ('Corso: iscritti',
+     "SELECT cliente_id FROM clienti_corsi WHERE corso_id = ?",
+     (1,)),
+    ('Insegnante: corsi',
+     "SELECT id FROM corsi WHERE insegnante_id = ?",
+     (1,)),
+]
+
+
+def indici_gestiti():
+    """Restituisce gli indici dichiarati sui modelli delle tabelle gestite"""
+    indici = []
+    for nome_tabella in TABELLE_INDICIZZATE:
+        tabella = db.Model.metadata.tables[nome_tabella]
+        indici.extend(sorted(tabella.indexes, key=lambda indice: indice.name))
+    return indici
+
+
+def ddl_indice(indice):
+    """Istruzione CREATE INDEX IF NOT EXISTS per SQLite"""
+    return str(CreateIndex(indice, if_not_exists=True).compile(dialect=sqlite.dialect()))
+
+
+def crea_indici(cursor):
+    """
+    Crea gli indici mancanti. Restituisce (creati, saltati): un indice univoco
+    viene saltato se i dati esistenti contengono duplicati.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    esistenti = {row[0] for row in cursor.fetchall()}
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tabelle = {row[0] for row in cursor.fetchall()}
+
+    creati = []
+    saltati = []
+    for indice in indici_gestiti():
+        # Tabelle create da migrazioni successive
+        if indice.name in esistenti or indice.table.name not in tabelle:
+            continue
+        try:
+            cursor.execute(ddl_indice(indice))
+            creati.append(indice.name)
+        except sqlite3.IntegrityError as e:
+            saltati.append((indice.name, str(e)))
+
+    # Aggiorna le statistiche usate dal query planner
+    cursor.execute("ANALYZE")
+    return creati, saltati
+
+
+def verifica_piani_query(cursor):
+    """
+    Esegue EXPLAIN QUERY PLAN sulle query critiche.
+    Restituisce la lista (descrizione, dettaglio) dei passi che scansionano una tabella.
+    """
+    problemi = []
+    for descrizione, sql, parametri in QUERY_CRITICHE:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parametri)
+        for row in cursor.fetchall():
+            dettaglio = row[-1]
+            if dettaglio.startswith('SCAN'):
+                problemi.append((descrizione, dettaglio))
+    return problemi
@@ -37,23 +37,16 @@ class Insegnante(db.Model):
         return len(self.corsi)
     
     def calcola_guadagno_corso(self, corso, mese=None, anno=None):
-        """Calcola il guadagno dell'insegnante per un corso in un periodo specifico"""
-        from .pagamento import Pagamento
+        """Calcola il guadagno dell'insegnante per un corso in un periodo specifico (da riepilogo_mensile)"""
+        from .riepilogo_mensile import RiepilogoMensile
         
-        query = Pagamento.query.filter_by(corso_id=corso.id, pagato=True)
-        
-        if mese:
-            query = query.filter_by(mese=mese)
-        if anno:
-            query = query.filter_by(anno=anno)
-        
-        pagamenti = query.all()
-        incasso_totale = sum(p.importo for p in pagamenti)
+        totali = RiepilogoMensile.totali(mese=mese, anno=anno, corso_id=corso.id)
+        incasso_totale = totali['incassato']
         guadagno = incasso_totale * (self.percentuale_guadagno / 100)
         
         return {
             'incasso_totale': incasso_totale,
             'percentuale': self.percentuale_guadagno,
             'guadagno': guadagno,
-            'numero_pagamenti': len(pagamenti)
-        }
\ No newline at end of file
+            'numero_pagamenti': totali['numero_pagati']
+        }
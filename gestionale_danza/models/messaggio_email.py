@@ -0,0 +1,236 @@
+# models/messaggio_email.py
+from . import db
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, Table, select, update, union_all
+from datetime import datetime, timedelta
+
+# Ricevute allegate ai messaggi che ne contengono più di una (invio massivo per cliente)
+messaggi_email_pagamenti = Table('messaggi_email_pagamenti', db.Model.metadata,
+    Column('messaggio_id', Integer, ForeignKey('messaggi_email.id', ondelete='CASCADE'), primary_key=True),
+    Column('pagamento_id', Integer, ForeignKey('pagamenti.id', ondelete='CASCADE'), primary_key=True),
+    # Stato delle email per pagamento
+    Index('ix_messaggi_email_pagamenti_pagamento', 'pagamento_id', 'messaggio_id')
+)
+
+class MessaggioEmail(db.Model):
+    """
+    Email in uscita (outbox). Le route accodano il messaggio già composto e
+    rispondono subito; l'invio lo fa il worker in background (utils/coda_email.py)
+    che registra tentativi, errori ed esito di ogni messaggio.
+    """
+    __tablename__ = 'messaggi_email'
+    __table_args__ = (
+        # Prelievo dei messaggi da inviare
+        Index('ix_messaggi_email_stato_prossimo_tentativo', 'stato', 'prossimo_tentativo'),
+        # Stato per pagamento e per insegnante
+        Index('ix_messaggi_email_pagamento', 'pagamento_id'),
+        Index('ix_messaggi_email_insegnante', 'insegnante_id'),
+        # Avanzamento di un invio massivo
+        Index('ix_messaggi_email_lotto', 'lotto', 'stato'),
+    )
+
+    # Tipi di messaggio: determinano gli allegati aggiunti al momento dell'invio
+    TIPO_RICEVUTA = 'ricevuta'
+    TIPO_REPORT_INSEGNANTE = 'report_insegnante'
+
+    # Stati
+    IN_CODA = 'in_coda'
+    IN_INVIO = 'in_invio'
+    INVIATO = 'inviato'
+    NON_INVIATO = 'non_inviato'  # modalità test (mail_suppress_send)
+    FALLITO = 'fallito'
+    STATI_IN_ATTESA = (IN_CODA, IN_INVIO)
+    STATI_INVIATI = (INVIATO, NON_INVIATO)
+
+    id = Column(Integer, primary_key=True)
+    tipo = Column(String(30), nullable=False)
+    stato = Column(String(20), nullable=False, default=IN_CODA)
+    destinatario = Column(String(120), nullable=False)
+    oggetto = Column(String(300), nullable=False)
+    corpo_testo = Column(Text, nullable=False)
+    corpo_html = Column(Text)
+
+    # Riferimenti per lo stato per pagamento / insegnante (e per gli allegati)
+    pagamento_id = Column(Integer, ForeignKey('pagamenti.id', ondelete='SET NULL'))
+    insegnante_id = Column(Integer, ForeignKey('insegnanti.id', ondelete='SET NULL'))
+    mese = Column(Integer)
+    anno = Column(Integer)
+    # Invio massivo di cui fa parte il messaggio
+    lotto = Column(String(32))
+
+    tentativi = Column(Integer, nullable=False, default=0)
+    prossimo_tentativo = Column(DateTime, nullable=False, default=datetime.now)
+    ultimo_errore = Column(Text)
+    inizio_invio = Column(DateTime)
+    data_creazione = Column(DateTime, default=datetime.now)
+    data_invio = Column(DateTime)
+
+    def __repr__(self):
+        return f'<MessaggioEmail {self.id} {self.tipo} {self.destinatario} {self.stato}>'
+
+    @property
+    def in_attesa(self):
+        return self.stato in self.STATI_IN_ATTESA
+
+    @property
+    def stato_descrizione(self):
+        descrizioni = {
+            self.IN_CODA: 'In coda' if not self.tentativi else 'In attesa di nuovo tentativo',
+            self.IN_INVIO: 'In invio',
+            self.INVIATO: 'Inviata',
+            self.NON_INVIATO: 'Non inviata (modalità test)',
+            self.FALLITO: 'Fallita',
+        }
+        return descrizioni.get(self.stato, self.stato)
+
+    @property
+    def stato_colore(self):
+        """Colore Bootstrap dello stato"""
+        colori = {
+            self.IN_CODA: 'warning' if self.tentativi else 'secondary',
+            self.IN_INVIO: 'info',
+            self.INVIATO: 'success',
+            self.NON_INVIATO: 'secondary',
+            self.FALLITO: 'danger',
+        }
+        return colori.get(self.stato, 'secondary')
+
+    @classmethod
+    def in_attesa_per(cls, **riferimenti):
+        """Messaggio non ancora inviato con gli stessi riferimenti (evita doppi invii)"""
+        return cls.query.filter_by(**riferimenti).filter(cls.stato.in_(cls.STATI_IN_ATTESA)).first()
+
+    @property
+    def pagamenti_ids(self):
+        """Id dei pagamenti di cui allegare la ricevuta"""
+        collegati = db.session.scalars(
+            select(messaggi_email_pagamenti.c.pagamento_id)
+            .where(messaggi_email_pagamenti.c.messaggio_id == self.id)
+        ).all()
+        if collegati:
+            return collegati
+        return [self.pagamento_id] if self.pagamento_id else []
+
+    @classmethod
+    def _messaggi_per_pagamento(cls, pagamenti_ids=None):
+        """(pagamento_id, messaggio_id) sia delle ricevute singole che di quelle collegate"""
+        singoli = select(cls.pagamento_id.label('pagamento_id'), cls.id.label('messaggio_id')) \
+            .where(cls.pagamento_id.isnot(None))
+        collegati = select(messaggi_email_pagamenti.c.pagamento_id, messaggi_email_pagamenti.c.messaggio_id)
+        if pagamenti_ids is not None:
+            singoli = singoli.where(cls.pagamento_id.in_(pagamenti_ids))
+            collegati = collegati.where(messaggi_email_pagamenti.c.pagamento_id.in_(pagamenti_ids))
+        return union_all(singoli, collegati).subquery()
+
+    @classmethod
+    def filtro_pagamento(cls, pagamento_id):
+        """Criterio dei messaggi con la ricevuta del pagamento"""
+        collegati = cls._messaggi_per_pagamento([pagamento_id])
+        return cls.id.in_(select(collegati.c.messaggio_id))
+
+    @classmethod
+    def pagamenti_in_attesa(cls, pagamenti_ids=None):
+        """Pagamenti con una ricevuta ancora da inviare (evita doppi invii)"""
+        collegati = cls._messaggi_per_pagamento(pagamenti_ids)
+        return set(db.session.scalars(
+            select(collegati.c.pagamento_id)
+            .join(cls, cls.id == collegati.c.messaggio_id)
+            .where(cls.tipo == cls.TIPO_RICEVUTA, cls.stato.in_(cls.STATI_IN_ATTESA))
+        ))
+
+    @classmethod
+    def ricevuta_in_stato(cls, pagamento_id, stati):
+        """
+        Criterio SQL (EXISTS correlato a `pagamento_id`, es. Pagamento.id): esiste
+        un messaggio con la ricevuta del pagamento in uno degli `stati`
+        """
+        singoli = select(cls.id).where(
+            cls.pagamento_id == pagamento_id, cls.tipo == cls.TIPO_RICEVUTA, cls.stato.in_(stati)
+        )
+        collegati = select(messaggi_email_pagamenti.c.messaggio_id) \
+            .join(cls, cls.id == messaggi_email_pagamenti.c.messaggio_id) \
+            .where(messaggi_email_pagamenti.c.pagamento_id == pagamento_id,
+                   cls.tipo == cls.TIPO_RICEVUTA, cls.stato.in_(stati))
+        return singoli.exists() | collegati.exists()
+
+    @classmethod
+    def ultimo_per_pagamento(cls, pagamenti_ids):
+        """Ultimo messaggio di ciascun pagamento: {pagamento_id: messaggio}, con una query"""
+        if not pagamenti_ids:
+            return {}
+        collegati = cls._messaggi_per_pagamento(pagamenti_ids)
+        ultimi = select(collegati.c.pagamento_id, db.func.max(collegati.c.messaggio_id).label('messaggio_id')) \
+            .group_by(collegati.c.pagamento_id).subquery()
+        righe = db.session.execute(
+            select(ultimi.c.pagamento_id, cls).join(cls, cls.id == ultimi.c.messaggio_id)
+        )
+        return {pagamento_id: messaggio for pagamento_id, messaggio in righe}
+
+    @classmethod
+    def conteggi_per_stato(cls, *criteri):
+        """{stato: numero di messaggi} con una query"""
+        return dict(db.session.query(cls.stato, db.func.count(cls.id)).filter(*criteri).group_by(cls.stato).all())
+
+    @classmethod
+    def ultimo_per_insegnante(cls, insegnanti_ids, mese, anno):
+        """Ultimo report del periodo per ciascun insegnante: {insegnante_id: messaggio}"""
+        if not insegnanti_ids:
+            return {}
+        ultimi = select(db.func.max(cls.id)).where(
+            cls.insegnante_id.in_(insegnanti_ids), cls.mese == mese, cls.anno == anno
+        ).group_by(cls.insegnante_id)
+        return {messaggio.insegnante_id: messaggio for messaggio in cls.query.filter(cls.id.in_(ultimi))}
+
+    @classmethod
+    def preleva(cls, quanti, adesso=None):
+        """
+        Passa a 'in_invio' fino a `quanti` messaggi pronti e ne restituisce gli id.
+        Un solo UPDATE ... RETURNING: con più processi ogni messaggio viene
+        prelevato da uno solo. Non fa commit.
+        """
+        adesso = adesso or datetime.now()
+        # Lettura preliminare: a coda vuota nessuna scrittura (e nessun lock)
+        pronti = db.session.scalars(
+            select(cls.id).where(cls.stato == cls.IN_CODA, cls.prossimo_tentativo <= adesso)
+            .order_by(cls.prossimo_tentativo, cls.id).limit(quanti)
+        ).all()
+        if not pronti:
+            return []
+        # La condizione sullo stato esclude quelli prelevati nel frattempo da un altro processo
+        risultato = db.session.execute(
+            update(cls.__table__)
+            .where(cls.id.in_(pronti), cls.stato == cls.IN_CODA)
+            .values(stato=cls.IN_INVIO, inizio_invio=adesso, tentativi=cls.tentativi + 1)
+            .returning(cls.id)
+        )
+        return sorted(riga[0] for riga in risultato)
+
+    @classmethod
+    def ripristina_interrotti(cls, timeout_secondi, adesso=None):
+        """Rimette in coda i messaggi rimasti 'in_invio' (processo terminato durante l'invio)"""
+        adesso = adesso or datetime.now()
+        risultato = db.session.execute(
+            update(cls.__table__)
+            .where(cls.stato == cls.IN_INVIO, cls.inizio_invio < adesso - timedelta(seconds=timeout_secondi))
+            .values(stato=cls.IN_CODA, prossimo_tentativo=adesso)
+        )
+        return risultato.rowcount
+
+    def segna_inviato(self, soppresso=False):
+        self.stato = self.NON_INVIATO if soppresso else self.INVIATO
+        self.data_invio = datetime.now()
+        self.ultimo_errore = None
+
+    def segna_errore(self, errore, ritardo_secondi=None):
+        """Registra l'errore: con un ritardo il messaggio torna in coda, altrimenti fallisce"""
+        self.ultimo_errore = errore
+        if ritardo_secondi is None:
+            self.stato = self.FALLITO
+        else:
+            self.stato = self.IN_CODA
+            self.prossimo_tentativo = datetime.now() + timedelta(seconds=ritardo_secondi)
+
+    def rimetti_in_coda(self):
+        """Nuovo invio manuale di un messaggio fallito"""
+        self.stato = self.IN_CODA
+        self.tentativi = 0
+        self.prossimo_tentativo = datetime.now()
@@ -1,6 +1,7 @@
 # models/numerazione_ricevute.py
 from . import db
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime
 
 class NumerazioneRicevute(db.Model):
@@ -17,35 +18,61 @@ class NumerazioneRicevute(db.Model):
         return f'<NumerazioneRicevute {self.anno}: {self.ultimo_numero}>'
     
     @classmethod
-    def get_prossimo_numero(cls, anno):
+    def _assicura_anno(cls, anno):
         """
-        Ottiene il prossimo numero di ricevuta per l'anno specificato.
-        Se l'anno non esiste, lo crea partendo dal numero iniziale impostato nelle configurazioni.
+        Crea il contatore dell'anno se manca, partendo dal numero iniziale delle impostazioni.
+        INSERT ... ON CONFLICT DO NOTHING: se due processi lo creano insieme ne resta uno.
         """
         from .settings import Settings
         
-        # Cerca il record per l'anno corrente
-        numerazione = cls.query.filter_by(anno=anno).first()
+        tabella = cls.__table__
+        if db.session.execute(select(tabella.c.id).where(tabella.c.anno == anno)).first():
+            return
         
-        if not numerazione:
-            # Se non esiste, crea un nuovo record per l'anno
-            settings = Settings.get_settings()
-            numero_iniziale = getattr(settings, 'numero_ricevuta_iniziale', 1)
-            
-            numerazione = cls(
+        # Lettura diretta: Settings.get_settings() potrebbe fare commit creando i default
+        numero_iniziale = db.session.query(Settings.numero_ricevuta_iniziale) \
+            .order_by(Settings.id).limit(1).scalar() or 1
+        adesso = datetime.now()
+        db.session.execute(
+            sqlite_insert(tabella).values(
                 anno=anno,
-                ultimo_numero=numero_iniziale,
-                numero_iniziale=numero_iniziale
-            )
-            db.session.add(numerazione)
-            db.session.commit()
-            return numero_iniziale
-        else:
-            # Se esiste, incrementa il numero
-            numerazione.ultimo_numero += 1
-            numerazione.data_aggiornamento = datetime.now()
-            db.session.commit()
-            return numerazione.ultimo_numero
+                ultimo_numero=numero_iniziale - 1,
+                numero_iniziale=numero_iniziale,
+                data_creazione=adesso,
+                data_aggiornamento=adesso
+            ).on_conflict_do_nothing(index_elements=['anno'])
+        )
+    
+    @classmethod
+    def riserva_blocco(cls, anno, quanti):
+        """
+        Riserva in modo atomico `quanti` numeri consecutivi per l'anno e li restituisce come range.
+        Un solo UPDATE ... RETURNING nella transazione del chiamante, senza commit: SQLite
+        serializza le scritture, quindi due processi non ottengono mai lo stesso numero.
+        I numeri diventano definitivi con il commit del chiamante; con un rollback tornano
+        disponibili, così la numerazione resta senza buchi.
+        """
+        if quanti < 1:
+            return range(0)
+        
+        cls._assicura_anno(anno)
+        tabella = cls.__table__
+        ultimo = db.session.execute(
+            update(tabella)
+            .where(tabella.c.anno == anno)
+            .values(ultimo_numero=tabella.c.ultimo_numero + quanti, data_aggiornamento=datetime.now())
+            .returning(tabella.c.ultimo_numero)
+        ).scalar_one()
+        return range(ultimo - quanti + 1, ultimo + 1)
+    
+    @classmethod
+    def get_prossimo_numero(cls, anno):
+        """
+        Ottiene il prossimo numero di ricevuta per l'anno specificato.
+        Se l'anno non esiste, lo crea partendo dal numero iniziale impostato nelle configurazioni.
+        Non esegue commit: il numero viene confermato insieme alle modifiche del chiamante.
+        """
+        return cls.riserva_blocco(anno, 1)[0]
     
     @classmethod
     def get_ultimo_numero(cls, anno):
@@ -72,7 +99,7 @@ class NumerazioneRicevute(db.Model):
             db.session.add(numerazione)
         else:
             # Se esiste già, aggiorna solo se non sono state ancora emesse ricevute
-            if numerazione.ultimo_numero == numerazione.numero_iniziale:
+            if numerazione.ultimo_numero < numerazione.numero_iniziale:
                 numerazione.numero_iniziale = numero_iniziale
                 numerazione.ultimo_numero = numero_iniziale - 1
             else:
@@ -1,11 +1,22 @@
 # models/pagamento.py
 from . import db
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 class Pagamento(db.Model):
     __tablename__ = 'pagamenti'
+    __table_args__ = (
+        # Un solo pagamento per cliente/corso/periodo (controllo duplicati generazione bulk)
+        Index('ix_pagamenti_cliente_corso_periodo', 'cliente_id', 'corso_id', 'mese', 'anno', unique=True),
+        # Coprente per i totali di periodo (dashboard, report, totali lista pagamenti)
+        Index('ix_pagamenti_periodo_stato_importo', 'anno', 'mese', 'pagato', 'importo'),
+        # Coprente per i totali per corso (report, calcolo compensi insegnanti)
+        Index('ix_pagamenti_corso_periodo_stato', 'corso_id', 'anno', 'mese', 'pagato'),
+        Index('ix_pagamenti_data_pagamento', 'data_pagamento'),
+        Index('ix_pagamenti_data_creazione', 'data_creazione'),
+        Index('ix_pagamenti_numero_ricevuta', 'numero_ricevuta'),
+    )
     
     id = Column(Integer, primary_key=True)
     mese = Column(Integer, nullable=False)  # 1-12
@@ -0,0 +1,158 @@
+# models/ricerca_clienti.py
+"""
+Indice full-text (SQLite FTS5) per la ricerca dei clienti.
+La tabella virtuale clienti_fts contiene nome, cognome, email, codice fiscale
+e telefono (anche solo cifre) di ogni cliente, con rowid = clienti.id, ed è
+mantenuta allineata a clienti da trigger. Il tokenizer unicode61 ignora
+maiuscole e accenti ("Nicolò" si trova con "nicolo"), l'indice dei prefissi
+rende veloce la ricerca mentre si digita.
+"""
+import re
+from sqlalchemy import event, select, or_, case, func, text, literal_column
+from . import db
+from .cliente import Cliente
+
+# Caratteri ignorati nel confronto dei numeri di telefono
+SEPARATORI_TELEFONO = ' -./+()'
+# Parole della ricerca considerate (le altre vengono ignorate)
+MAX_PAROLE = 8
+
+
+def _cifre_sql(colonna):
+    """Espressione SQL del telefono senza separatori"""
+    espressione = colonna
+    for carattere in SEPARATORI_TELEFONO:
+        espressione = f"REPLACE({espressione}, '{carattere}', '')"
+    return espressione
+
+
+def cifre_telefono(telefono):
+    """Telefono senza separatori, come _cifre_sql"""
+    if not telefono:
+        return ''
+    for carattere in SEPARATORI_TELEFONO:
+        telefono = telefono.replace(carattere, '')
+    return telefono
+
+
+DDL_RICERCA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS clienti_fts USING fts5(
+        nome, cognome, email, codice_fiscale, telefono, telefono_cifre,
+        content='',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )"""
+
+
+def _valori(riga):
+    return (f"{riga}.id, {riga}.nome, {riga}.cognome, {riga}.email, {riga}.codice_fiscale, "
+            f"{riga}.telefono, {_cifre_sql(f'{riga}.telefono')}")
+
+
+_COLONNE = "rowid, nome, cognome, email, codice_fiscale, telefono, telefono_cifre"
+
+# Tabella senza contenuto: per togliere una riga vanno ripassati i valori indicizzati
+TRIGGER_RICERCA = [
+    ('trg_clienti_fts_inserito', f"""
+    CREATE TRIGGER IF NOT EXISTS trg_clienti_fts_inserito AFTER INSERT ON clienti
+    BEGIN
+        INSERT INTO clienti_fts ({_COLONNE}) VALUES ({_valori('NEW')});
+    END"""),
+    ('trg_clienti_fts_eliminato', f"""
+    CREATE TRIGGER IF NOT EXISTS trg_clienti_fts_eliminato AFTER DELETE ON clienti
+    BEGIN
+        INSERT INTO clienti_fts (clienti_fts, {_COLONNE}) VALUES ('delete', {_valori('OLD')});
+    END"""),
+    ('trg_clienti_fts_modificato', f"""
+    CREATE TRIGGER IF NOT EXISTS trg_clienti_fts_modificato
+    AFTER UPDATE OF nome, cognome, email, codice_fiscale, telefono ON clienti
+    BEGIN
+        INSERT INTO clienti_fts (clienti_fts, {_COLONNE}) VALUES ('delete', {_valori('OLD')});
+        INSERT INTO clienti_fts ({_COLONNE}) VALUES ({_valori('NEW')});
+    END"""),
+]
+
+RICOSTRUZIONE_RICERCA = [
+    "INSERT INTO clienti_fts (clienti_fts) VALUES ('delete-all')",
+    f"INSERT INTO clienti_fts ({_COLONNE}) SELECT {_valori('clienti')} FROM clienti",
+]
+
+
+def crea_indice_ricerca(cursor):
+    """
+    Crea tabella FTS e trigger mancanti (cursore sqlite3 o connessione SQLAlchemy).
+    Restituisce True se la tabella è stata creata ora (da popolare).
+    """
+    esistente = _esegui(cursor, "SELECT 1 FROM sqlite_master WHERE name = 'clienti_fts'").fetchone()
+    _esegui(cursor, DDL_RICERCA)
+    for _, istruzione in TRIGGER_RICERCA:
+        _esegui(cursor, istruzione)
+    return esistente is None
+
+
+def ricostruisci_indice_ricerca(cursor):
+    """Reindicizza tutti i clienti. Non fa commit"""
+    for istruzione in RICOSTRUZIONE_RICERCA:
+        _esegui(cursor, istruzione)
+
+
+def _esegui(cursor, istruzione):
+    if hasattr(cursor, 'exec_driver_sql'):
+        return cursor.exec_driver_sql(istruzione)
+    return cursor.execute(istruzione)
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def _dopo_create_all(target, connection, **kw):
+    """db.create_all(): crea l'indice se manca e lo popola con i clienti esistenti"""
+    if crea_indice_ricerca(connection):
+        ricostruisci_indice_ricerca(connection)
+
+
+def espressione_match(termine):
+    """
+    Query FTS5 per il testo cercato: ogni parola come prefisso, tutte presenti.
+    Un termine che sembra un telefono cerca anche tra le sole cifre.
+    Restituisce None se non ci sono parole da cercare.
+    """
+    parole = re.findall(r'\w+', termine or '')[:MAX_PAROLE]
+    if not parole:
+        return None
+    espressione = ' AND '.join(f'"{parola}"*' for parola in parole)
+    cifre = cifre_telefono(termine.strip())
+    if len(parole) > 1 and cifre.isdigit():
+        espressione = f'({espressione}) OR telefono_cifre : "{cifre}"*'
+    return espressione
+
+
+def filtro_ricerca(termine):
+    """Criterio sui clienti che corrispondono al testo cercato"""
+    espressione = espressione_match(termine)
+    if espressione is None:
+        return Cliente.id.is_(None)
+    trovati = select(literal_column('rowid')).select_from(text('clienti_fts')) \
+        .where(text('clienti_fts MATCH :ricerca_clienti').bindparams(ricerca_clienti=espressione))
+    return Cliente.id.in_(trovati)
+
+
+def priorita_ricerca(termine):
+    """
+    Espressione di ordinamento: 0 per i clienti con codice fiscale o telefono
+    uguali al testo cercato, 1 per gli altri.
+    """
+    termine = (termine or '').strip()
+    condizioni = [func.upper(Cliente.codice_fiscale) == termine.upper()]
+    cifre = cifre_telefono(termine)
+    if cifre:
+        condizioni.append(text(_cifre_sql('clienti.telefono') + ' = :ricerca_telefono')
+                          .bindparams(ricerca_telefono=cifre))
+    return case((or_(*condizioni), 0), else_=1)
+
+
+def corrisponde_esattamente(cliente, termine):
+    """Come priorita_ricerca, sul cliente già letto (0 = corrispondenza esatta)"""
+    termine = (termine or '').strip()
+    cifre = cifre_telefono(termine)
+    esatto = (cliente.codice_fiscale or '').upper() == termine.upper() \
+        or (bool(cifre) and cifre_telefono(cliente.telefono) == cifre)
+    return 0 if esatto else 1
@@ -0,0 +1,162 @@
+# models/riepilogo_mensile.py
+"""
+Totali dei pagamenti per periodo e corso, mantenuti dal database.
+Ogni inserimento, modifica o eliminazione di un pagamento aggiorna la riga
+(anno, mese, corso_id) tramite trigger SQLite: restano allineati anche gli
+INSERT ... SELECT della generazione bulk e gli UPDATE fatti fuori dall'ORM.
+Il compenso dell'insegnante segue la percentuale attuale dell'insegnante del
+corso, come nei report. ricostruisci_riepilogo() ricalcola tutto da zero.
+"""
+from . import db
+from sqlalchemy import Column, Integer, Float, ForeignKey, event, text
+
+# Compenso dell'insegnante del corso sull'incassato della riga
+_PERCENTUALE_CORSO = """COALESCE((SELECT i.percentuale_guadagno FROM corsi c
+        JOIN insegnanti i ON i.id = c.insegnante_id WHERE c.id = {corso_id}), 0)"""
+
+
+class RiepilogoMensile(db.Model):
+    __tablename__ = 'riepilogo_mensile'
+
+    anno = Column(Integer, primary_key=True)
+    mese = Column(Integer, primary_key=True)
+    corso_id = Column(Integer, ForeignKey('corsi.id', ondelete='CASCADE'), primary_key=True)
+
+    incassato = Column(Float, nullable=False, default=0, server_default=text('0'))
+    da_incassare = Column(Float, nullable=False, default=0, server_default=text('0'))
+    numero_pagamenti = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    numero_pagati = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    compenso_insegnante = Column(Float, nullable=False, default=0, server_default=text('0'))
+
+    def __repr__(self):
+        return f'<RiepilogoMensile {self.mese}/{self.anno} corso {self.corso_id}: €{self.incassato}>'
+
+    @classmethod
+    def totali(cls, mese=None, anno=None, corso_id=None):
+        """Somme delle righe del periodo (e del corso): una lettura su poche righe"""
+        criteri = []
+        if mese:
+            criteri.append(cls.mese == mese)
+        if anno:
+            criteri.append(cls.anno == anno)
+        if corso_id:
+            criteri.append(cls.corso_id == corso_id)
+        riga = db.session.query(
+            db.func.coalesce(db.func.sum(cls.incassato), 0),
+            db.func.coalesce(db.func.sum(cls.da_incassare), 0),
+            db.func.coalesce(db.func.sum(cls.numero_pagamenti), 0),
+            db.func.coalesce(db.func.sum(cls.numero_pagati), 0),
+            db.func.coalesce(db.func.sum(cls.compenso_insegnante), 0)
+        ).filter(*criteri).one()
+        return {
+            'incassato': riga[0],
+            'da_incassare': riga[1],
+            'numero_pagamenti': riga[2],
+            'numero_pagati': riga[3],
+            'compenso_insegnante': riga[4]
+        }
+
+
+def _aggiorna_riga(riga, segno):
+    """Istruzioni che aggiungono (segno '+') o tolgono ('-') il pagamento NEW/OLD dalla sua riga"""
+    chiave = f"anno = {riga}.anno AND mese = {riga}.mese AND corso_id = {riga}.corso_id"
+    istruzioni = f"""
+        INSERT INTO riepilogo_mensile (anno, mese, corso_id, incassato, da_incassare, numero_pagamenti, numero_pagati)
+        VALUES ({riga}.anno, {riga}.mese, {riga}.corso_id,
+                {segno}CASE WHEN {riga}.pagato THEN COALESCE({riga}.importo, 0) ELSE 0 END,
+                {segno}CASE WHEN {riga}.pagato THEN 0 ELSE COALESCE({riga}.importo, 0) END,
+                {segno}1,
+                {segno}CASE WHEN {riga}.pagato THEN 1 ELSE 0 END)
+        ON CONFLICT (anno, mese, corso_id) DO UPDATE SET
+            incassato = ROUND(incassato + excluded.incassato, 2),
+            da_incassare = ROUND(da_incassare + excluded.da_incassare, 2),
+            numero_pagamenti = numero_pagamenti + excluded.numero_pagamenti,
+            numero_pagati = numero_pagati + excluded.numero_pagati;
+        UPDATE riepilogo_mensile
+        SET compenso_insegnante = incassato * {_PERCENTUALE_CORSO.format(corso_id=f'{riga}.corso_id')} / 100
+        WHERE {chiave};"""
+    if segno == '-':
+        # Periodo/corso senza più pagamenti
+        istruzioni += f"""
+        DELETE FROM riepilogo_mensile WHERE {chiave} AND numero_pagamenti <= 0;"""
+    return istruzioni
+
+
+# Trigger che mantengono riepilogo_mensile (nome, istruzione)
+TRIGGER_RIEPILOGO = [
+    ('trg_riepilogo_pagamento_inserito', f"""
+    CREATE TRIGGER IF NOT EXISTS trg_riepilogo_pagamento_inserito AFTER INSERT ON pagamenti
+    BEGIN{_aggiorna_riga('NEW', '+')}
+    END"""),
+    ('trg_riepilogo_pagamento_eliminato', f"""
+    CREATE TRIGGER IF NOT EXISTS trg_riepilogo_pagamento_eliminato AFTER DELETE ON pagamenti
+    BEGIN{_aggiorna_riga('OLD', '-')}
+    END"""),
+    ('trg_riepilogo_pagamento_modificato', f"""
+    CREATE TRIGGER IF NOT EXISTS trg_riepilogo_pagamento_modificato
+    AFTER UPDATE OF importo, pagato, mese, anno, corso_id ON pagamenti
+    BEGIN{_aggiorna_riga('OLD', '-')}{_aggiorna_riga('NEW', '+')}
+    END"""),
+    ('trg_riepilogo_percentuale_insegnante', """
+    CREATE TRIGGER IF NOT EXISTS trg_riepilogo_percentuale_insegnante
+    AFTER UPDATE OF percentuale_guadagno ON insegnanti
+    BEGIN
+        UPDATE riepilogo_mensile
+        SET compenso_insegnante = incassato * COALESCE(NEW.percentuale_guadagno, 0) / 100
+        WHERE corso_id IN (SELECT id FROM corsi WHERE insegnante_id = NEW.id);
+    END"""),
+    ('trg_riepilogo_insegnante_corso', f"""
+    CREATE TRIGGER IF NOT EXISTS trg_riepilogo_insegnante_corso AFTER UPDATE OF insegnante_id ON corsi
+    BEGIN
+        UPDATE riepilogo_mensile
+        SET compenso_insegnante = incassato * {_PERCENTUALE_CORSO.format(corso_id='NEW.id')} / 100
+        WHERE corso_id = NEW.id;
+    END"""),
+]
+
+# Ricalcolo completo dai pagamenti (riparazione, prima popolazione)
+RICOSTRUZIONE_RIEPILOGO = [
+    "DELETE FROM riepilogo_mensile",
+    """
+    INSERT INTO riepilogo_mensile (anno, mese, corso_id, incassato, da_incassare, numero_pagamenti, numero_pagati)
+    SELECT anno, mese, corso_id,
+           ROUND(SUM(CASE WHEN pagato THEN COALESCE(importo, 0) ELSE 0 END), 2),
+           ROUND(SUM(CASE WHEN pagato THEN 0 ELSE COALESCE(importo, 0) END), 2),
+           COUNT(*),
+           SUM(CASE WHEN pagato THEN 1 ELSE 0 END)
+    FROM pagamenti
+    GROUP BY anno, mese, corso_id""",
+    f"""
+    UPDATE riepilogo_mensile
+    SET compenso_insegnante = incassato * {_PERCENTUALE_CORSO.format(corso_id='riepilogo_mensile.corso_id')} / 100""",
+]
+
+
+def crea_trigger_riepilogo(cursor):
+    """Crea i trigger mancanti (cursore sqlite3 o connessione SQLAlchemy)"""
+    for _, istruzione in TRIGGER_RIEPILOGO:
+        _esegui(cursor, istruzione)
+
+
+def ricostruisci_riepilogo(cursor):
+    """Ricalcola riepilogo_mensile da tutti i pagamenti. Non fa commit"""
+    for istruzione in RICOSTRUZIONE_RIEPILOGO:
+        _esegui(cursor, istruzione)
+
+
+def _esegui(cursor, istruzione):
+    if hasattr(cursor, 'exec_driver_sql'):
+        cursor.exec_driver_sql(istruzione)
+    else:
+        cursor.execute(istruzione)
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def _dopo_create_all(target, connection, tables=(), **kw):
+    """
+    db.create_all(): crea i trigger e, se la tabella è nuova (database esistente
+    aggiornato), la popola dai pagamenti già presenti.
+    """
+    crea_trigger_riepilogo(connection)
+    if RiepilogoMensile.__table__ in tables:
+        ricostruisci_riepilogo(connection)
@@ -2,7 +2,22 @@
 from . import db
 from sqlalchemy import Column, Integer, String, Text, Boolean
 import os
+import threading
+from functools import lru_cache
 from cryptography.fernet import Fernet
+from flask import g, has_request_context
+
+# Cache per processo delle impostazioni: copia staccata dalla sessione e versione
+# con cui è stata letta. La versione è nel DB, così ogni worker vede le modifiche.
+_cache_lock = threading.Lock()
+_cache = {'versione': None, 'settings': None}
+
+
+@lru_cache(maxsize=8)
+def _decifra(key, token):
+    """Decifra una password una sola volta per coppia chiave/testo cifrato"""
+    return Fernet(key).decrypt(token.encode()).decode()
+
 
 class Settings(db.Model):
     __tablename__ = 'settings'
@@ -36,6 +51,9 @@ class Settings(db.Model):
     # Numerazione Ricevute
     numero_ricevuta_iniziale = Column(Integer, default=1)  # Numero da cui iniziare la numerazione ricevute
     
+    # Versione delle impostazioni, incrementata a ogni salvataggio (invalida le cache dei worker)
+    versione = Column(Integer, nullable=False, default=1)
+    
     def __repr__(self):
         return f'<Settings {self.denominazione_sociale}>'
     
@@ -75,8 +93,7 @@ class Settings(db.Model):
         if not self.mail_password:
             return None
         try:
-            fernet = Fernet(self._get_encryption_key())
-            return fernet.decrypt(self.mail_password.encode()).decode()
+            return _decifra(self._get_encryption_key(), self.mail_password)
         except:
             return None
     
@@ -128,4 +145,43 @@ class Settings(db.Model):
             )
             db.session.add(settings)
             db.session.commit()
-        return settings
\ No newline at end of file
+        return settings
+    
+    @classmethod
+    def _versione_corrente(cls):
+        """Versione salvata nel DB, letta al massimo una volta per richiesta"""
+        if has_request_context() and 'settings_versione' in g:
+            return g.settings_versione
+        versione = db.session.query(cls.versione).order_by(cls.id).limit(1).scalar()
+        if has_request_context():
+            g.settings_versione = versione
+        return versione
+    
+    @classmethod
+    def get_settings_cached(cls):
+        """
+        Impostazioni in sola lettura dalla cache del processo, ricaricate solo
+        quando cambia la versione nel DB. Per modificarle usare get_settings().
+        """
+        versione = cls._versione_corrente()
+        with _cache_lock:
+            if versione is not None and _cache['versione'] == versione:
+                return _cache['settings']
+        
+        settings = cls.get_settings()
+        copia = cls(**{colonna.key: getattr(settings, colonna.key) for colonna in cls.__table__.columns})
+        with _cache_lock:
+            _cache['versione'] = settings.versione
+            _cache['settings'] = copia
+        if has_request_context():
+            g.settings_versione = settings.versione
+        return copia
+    
+    def incrementa_versione(self):
+        """Da chiamare prima del commit di una modifica: invalida la cache in tutti i worker"""
+        self.versione = Settings.versione + 1
+        with _cache_lock:
+            _cache['versione'] = None
+            _cache['settings'] = None
+        if has_request_context():
+            g.pop('settings_versione', None)
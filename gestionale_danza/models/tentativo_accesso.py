@@ -0,0 +1,24 @@
+# models/tentativo_accesso.py
+from . import db
+from sqlalchemy import Column, Integer, String, Float, Index
+
+class TentativoAccesso(db.Model):
+    """
+    Tentativo di accesso fallito, condiviso tra i processi dell'app
+    (archivio SQLite di utils/tentativi_accesso.py). Per ogni chiave restano
+    solo gli ultimi tentativi utili a decidere il blocco.
+    """
+    __tablename__ = 'tentativi_accesso'
+    __table_args__ = (
+        # Tentativi di una chiave in ordine di tempo (blocco, potatura per chiave)
+        Index('ix_tentativi_accesso_chiave_istante', 'chiave', 'istante'),
+        # Rimozione dei tentativi scaduti
+        Index('ix_tentativi_accesso_istante', 'istante'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chiave = Column(String(64), nullable=False)  # IP del client
+    istante = Column(Float, nullable=False)  # Secondi epoch (time.time())
+
+    def __repr__(self):
+        return f'<TentativoAccesso {self.chiave} @ {self.istante}>'
@@ -26,13 +26,14 @@ def create_complete_database():
     print("=" * 60)
     print(f"📁 Database: {database_path}")
     
-    # Se il database esiste, crea backup
+    # Se il database esiste, salvalo nell'archivio dei backup (gestione_backup.py ripristina <id>)
     if os.path.exists(database_path):
-        backup_path = f"{database_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        import shutil
-        shutil.copy2(database_path, backup_path)
-        print(f"💾 Backup creato: {backup_path}")
-        os.remove(database_path)
+        from utils.archivio_backup import archivio_da_ambiente
+        istantanea = archivio_da_ambiente(base_path, database_path).crea(database_path, motivo='setup database')
+        print(f"💾 Backup creato: istantanea {istantanea['id']}")
+        for percorso in (database_path, f'{database_path}-wal', f'{database_path}-shm'):
+            if os.path.exists(percorso):
+                os.remove(percorso)
     
     # Crea database con schema completo
     conn = sqlite3.connect(database_path)
@@ -225,6 +226,7 @@ def create_complete_database():
             mail_suppress_send BOOLEAN, 
             mail_debug BOOLEAN, 
             numero_ricevuta_iniziale INTEGER, 
+            versione INTEGER NOT NULL DEFAULT 1, 
             PRIMARY KEY (id)
         )
     """)
@@ -243,8 +245,90 @@ def create_complete_database():
         )
     """)
     
+    # 12. Tabella messaggi_email (coda delle email in uscita)
+    cursor.execute("""
+        CREATE TABLE messaggi_email (
+            id INTEGER NOT NULL, 
+            tipo VARCHAR(30) NOT NULL, 
+            stato VARCHAR(20) NOT NULL, 
+            destinatario VARCHAR(120) NOT NULL, 
+            oggetto VARCHAR(300) NOT NULL, 
+            corpo_testo TEXT NOT NULL, 
+            corpo_html TEXT, 
+            pagamento_id INTEGER, 
+            insegnante_id INTEGER, 
+            mese INTEGER, 
+            anno INTEGER, 
+            lotto VARCHAR(32), 
+            tentativi INTEGER NOT NULL, 
+            prossimo_tentativo DATETIME NOT NULL, 
+            ultimo_errore TEXT, 
+            inizio_invio DATETIME, 
+            data_creazione DATETIME, 
+            data_invio DATETIME, 
+            PRIMARY KEY (id), 
+            FOREIGN KEY(pagamento_id) REFERENCES pagamenti (id) ON DELETE SET NULL, 
+            FOREIGN KEY(insegnante_id) REFERENCES insegnanti (id) ON DELETE SET NULL
+        )
+    """)
+    
+    # 13. Tabella messaggi_email_pagamenti (ricevute allegate agli invii massivi)
+    cursor.execute("""
+        CREATE TABLE messaggi_email_pagamenti (
+            messaggio_id INTEGER NOT NULL, 
+            pagamento_id INTEGER NOT NULL, 
+            PRIMARY KEY (messaggio_id, pagamento_id), 
+            FOREIGN KEY(messaggio_id) REFERENCES messaggi_email (id) ON DELETE CASCADE, 
+            FOREIGN KEY(pagamento_id) REFERENCES pagamenti (id) ON DELETE CASCADE
+        )
+    """)
+    
+    # 14. Tabella riepilogo_mensile (totali per periodo e corso, mantenuti dai trigger)
+    cursor.execute("""
+        CREATE TABLE riepilogo_mensile (
+            anno INTEGER NOT NULL, 
+            mese INTEGER NOT NULL, 
+            corso_id INTEGER NOT NULL, 
+            incassato FLOAT DEFAULT 0 NOT NULL, 
+            da_incassare FLOAT DEFAULT 0 NOT NULL, 
+            numero_pagamenti INTEGER DEFAULT 0 NOT NULL, 
+            numero_pagati INTEGER DEFAULT 0 NOT NULL, 
+            compenso_insegnante FLOAT DEFAULT 0 NOT NULL, 
+            PRIMARY KEY (anno, mese, corso_id), 
+            FOREIGN KEY(corso_id) REFERENCES corsi (id) ON DELETE CASCADE
+        )
+    """)
+    from models.riepilogo_mensile import crea_trigger_riepilogo
+    crea_trigger_riepilogo(cursor)
+    
+    # 15. Indice full-text clienti_fts (ricerca clienti, mantenuto dai trigger)
+    from models.ricerca_clienti import crea_indice_ricerca
+    crea_indice_ricerca(cursor)
+    
+    # 16. Tabella tentativi_accesso (protezione brute force condivisa tra i worker)
+    cursor.execute("""
+        CREATE TABLE tentativi_accesso (
+            id INTEGER NOT NULL, 
+            chiave VARCHAR(64) NOT NULL, 
+            istante FLOAT NOT NULL, 
+            PRIMARY KEY (id)
+        )
+    """)
+    
     print("   ✅ Schema database creato")
     
+    # 17. Indici secondari dichiarati sui modelli
+    from models.indici import crea_indici, verifica_piani_query
+    creati, saltati = crea_indici(cursor)
+    print(f"   ✅ Indici creati: {len(creati)}")
+    
+    problemi = verifica_piani_query(cursor)
+    for descrizione, dettaglio in problemi:
+        print(f"   ❌ Query senza indice - {descrizione}: {dettaglio}")
+    if problemi:
+        conn.close()
+        return False
+    
     # Commit dello schema
     conn.commit()
     conn.close()
@@ -0,0 +1,31 @@
+// Select2 con risultati caricati dalle API di ricerca (/api/clienti/search, /api/corsi/search):
+// la pagina contiene solo le opzioni già selezionate, le altre arrivano mentre si digita
+function selezioneRemota(selettore, url, opzioni) {
+    function conDettaglio(elemento) {
+        if (!elemento.id || !elemento.dettaglio) {
+            return elemento.text;
+        }
+        return $('<span>').text(elemento.text)
+            .append($('<small class="text-muted ms-2">').text(elemento.dettaglio));
+    }
+
+    return $(selettore).select2(Object.assign({
+        theme: 'bootstrap-5',
+        width: '100%',
+        allowClear: true,
+        language: {
+            searching: () => 'Ricerca in corso...',
+            noResults: () => 'Nessun risultato',
+            loadingMore: () => 'Caricamento altri risultati...',
+            errorLoading: () => 'Impossibile caricare i risultati'
+        },
+        templateResult: conDettaglio,
+        ajax: {
+            url: url,
+            dataType: 'json',
+            delay: 250,
+            cache: true,
+            data: params => ({ q: params.term || '', page: params.page || 1 })
+        }
+    }, opzioni || {}));
+}
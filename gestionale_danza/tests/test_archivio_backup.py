@@ -0,0 +1,73 @@
+# tests/test_archivio_backup.py
+"""
+Conservazione dei backup incrementali: le istantanee di sicurezza (prima del
+ripristino, prima del setup) non vengono eliminate dai backup pianificati.
+
+Esecuzione (dalla cartella gestionale_danza):
+    python -m pytest -q tests
+"""
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.archivio_backup import ArchivioBackup
+
+
+@pytest.fixture
+def database(tmp_path):
+    percorso = str(tmp_path / 'database.db')
+    connessione = sqlite3.connect(percorso)
+    connessione.execute('CREATE TABLE clienti (id INTEGER PRIMARY KEY, nome TEXT)')
+    connessione.execute("INSERT INTO clienti (nome) VALUES ('Mario')")
+    connessione.commit()
+    connessione.close()
+    return percorso
+
+
+@pytest.fixture
+def archivio(tmp_path):
+    return ArchivioBackup(str(tmp_path / 'backup'), orarie=1, giornaliere=1, mensili=1)
+
+
+def _aggiungi_cliente(database, nome):
+    connessione = sqlite3.connect(database)
+    connessione.execute('INSERT INTO clienti (nome) VALUES (?)', (nome,))
+    connessione.commit()
+    connessione.close()
+
+
+def test_istantanea_prima_del_ripristino_sopravvive_ai_pianificati(archivio, database):
+    pianificata = archivio.crea(database)['id']
+    _aggiungi_cliente(database, 'Luigi')
+    sicurezza = archivio.ripristina(pianificata, database)
+    assert archivio.leggi(sicurezza)['motivo'] == 'prima del ripristino'
+
+    # Backup pianificato successivo nella stessa ora
+    archivio.crea(database)
+    archivio.pulisci(database)
+
+    ids = [manifest['id'] for manifest in archivio.elenco(database)]
+    assert sicurezza in ids
+    assert pianificata not in ids
+    assert archivio.verifica(sicurezza) == []
+
+
+def test_istantanea_setup_sopravvive_ai_pianificati(archivio, database):
+    setup = archivio.crea(database, motivo='setup database')['id']
+    for nome in ('Luigi', 'Anna'):
+        _aggiungi_cliente(database, nome)
+        archivio.crea(database)
+        archivio.pulisci(database)
+
+    ids = [manifest['id'] for manifest in archivio.elenco(database)]
+    assert setup in ids
+    assert len(ids) == 2
+    assert archivio.verifica(setup) == []
+
+    # Solo la pulizia esplicita di tutte le istantanee la elimina
+    archivio.pulisci(database, tutte=True)
+    assert setup not in [manifest['id'] for manifest in archivio.elenco(database)]
@@ -0,0 +1,86 @@
+# tests/test_cache_ricevute.py
+"""
+Cache dei PDF delle ricevute: una modifica ai dati stampati del cliente deve
+produrre un ETag nuovo (e quindi un PDF rigenerato).
+
+Esecuzione (dalla cartella gestionale_danza):
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, time
+
+import pytest
+
+CARTELLA = tempfile.mkdtemp(prefix='test_ricevute_')
+os.environ['DATABASE_PATH'] = os.path.join(CARTELLA, 'database.db')
+os.environ['PDF_CACHE_DIR'] = os.path.join(CARTELLA, 'cache')
+os.environ['PDF_WORKERS'] = '0'
+os.environ['EMAIL_OUTBOX_WORKER'] = 'False'
+os.environ['BACKUP_SCHEDULE_MINUTES'] = '0'
+os.environ.setdefault('DISABLE_TALISMAN_FOR_TEST', 'True')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, init_db
+from models import db, User, Cliente, Corso, Insegnante, Pagamento
+
+
+@pytest.fixture(scope='module')
+def pagamento_id():
+    app.config['WTF_CSRF_ENABLED'] = False
+    init_db()
+    with app.app_context():
+        insegnante = Insegnante(nome='Anna', cognome='Neri', percentuale_guadagno=30)
+        corso = Corso(nome='Hip Hop', giorno='Lunedì', orario=time(18, 0), costo_mensile=50, insegnante=insegnante)
+        cliente = Cliente(nome='Mario', cognome='Rossi', telefono='3330000000', email='mario@example.com',
+                          via='Via Roma', civico='1', cap='00100', citta='Roma', provincia='RM', attivo=True)
+        pagamento = Pagamento(cliente=cliente, corso=corso, mese=3, anno=2026, importo=50, pagato=True,
+                              data_pagamento=datetime(2026, 3, 5, 10, 0), numero_ricevuta=1,
+                              metodo_pagamento='Contanti')
+        db.session.add_all([insegnante, corso, cliente, pagamento])
+        db.session.commit()
+        return pagamento.id
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        uniquifier = User.query.first().fs_uniquifier
+    client = app.test_client()
+    with client.session_transaction() as sessione:
+        sessione['_user_id'] = uniquifier
+        sessione['_fresh'] = True
+    return client
+
+
+def _dati_cliente(cliente, **modifiche):
+    dati = {
+        'nome': cliente.nome, 'cognome': cliente.cognome, 'telefono': cliente.telefono,
+        'email': cliente.email, 'via': cliente.via, 'civico': cliente.civico, 'cap': cliente.cap,
+        'citta': cliente.citta, 'provincia': cliente.provincia, 'attivo': 'on',
+    }
+    dati.update(modifiche)
+    return dati
+
+
+def test_modifica_indirizzo_cliente_cambia_etag(client, pagamento_id):
+    url = f'/pagamenti/{pagamento_id}/ricevuta'
+    prima = client.get(url)
+    assert prima.status_code == 200
+    assert prima.headers['ETag']
+
+    # Stessi dati: la ricevuta viene servita dalla cache con lo stesso ETag
+    assert client.get(url).headers['ETag'] == prima.headers['ETag']
+
+    with app.app_context():
+        cliente = db.session.get(Pagamento, pagamento_id).cliente
+        cliente_id = cliente.id
+        dati = _dati_cliente(cliente, via='Via Milano', civico='22')
+    risposta = client.post(f'/clienti/{cliente_id}/modifica', data=dati)
+    assert risposta.status_code == 302
+
+    dopo = client.get(url)
+    assert dopo.status_code == 200
+    assert dopo.headers['ETag'] != prima.headers['ETag']
+    assert dopo.get_data() != prima.get_data()
@@ -0,0 +1,516 @@
+# utils/archivio_backup.py
+"""
+Backup periodici incrementali con deduplicazione e politica di conservazione.
+Ogni istantanea (copia online di utils/backup_database.py) viene divisa in
+blocchi di BACKUP_CHUNK_PAGES pagine SQLite: l'API di backup copia le pagine
+nella stessa posizione, quindi tra due istantanee cambiano solo i blocchi
+toccati dalle scritture. Blocchi e ricevute PDF sono salvati una sola volta,
+compressi e indicizzati per SHA-256 (oggetti/); ogni istantanea è un
+manifest JSON (istantanee/) con l'elenco dei blocchi e dei file e il
+percorso del database di origine (`sorgente`).
+
+Struttura di BACKUP_DIR:
+    oggetti/ab/abcd...   contenuti compressi (zlib), nome = sha256 del contenuto
+    istantanee/<id>.json manifest (id = data e ora, es. 20261017_230000)
+
+La conservazione tiene l'ultima istantanea pianificata di ciascuna delle
+ultime BACKUP_KEEP_HOURLY ore, BACKUP_KEEP_DAILY giorni e BACKUP_KEEP_MONTHLY
+mesi, poi elimina gli oggetti non più usati. Le altre istantanee (manuali,
+prima del ripristino, prima del setup) restano finché non vengono eliminate
+esplicitamente (gestione_backup.py pulisci --tutte). Pianificazione e conservazione
+considerano solo le istantanee dello stesso database di origine, quindi due
+database che condividono la cartella non si intralciano. Il ripristino
+rifiuta le istantanee di un altro database, ricostruisce il database, ne
+verifica checksum e PRAGMA integrity_check e solo allora lo sostituisce a
+quello attuale (salvato prima come istantanea).
+
+Configurazione da ambiente:
+- BACKUP_SCHEDULE_MINUTES: intervallo dei backup automatici (default 60, 0 = disattivati)
+- BACKUP_DIR: cartella dell'archivio (default: cartella backup accanto al
+  database, cioè data/backup per il database predefinito)
+- BACKUP_KEEP_HOURLY, BACKUP_KEEP_DAILY, BACKUP_KEEP_MONTHLY: istantanee
+  conservate per ora, giorno e mese (default 24, 30, 12)
+- BACKUP_CHUNK_PAGES: pagine SQLite per blocco (default 16)
+"""
+import os
+import json
+import time
+import zlib
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from utils.backup_database import copia_online, conteggi_tabelle, file_cartella
+
+FORMATO_ID = '%Y%m%d_%H%M%S'
+# Motivo delle istantanee automatiche, le sole soggette alla conservazione
+MOTIVO_PIANIFICATO = 'pianificato'
+# Un lock più vecchio di così è rimasto da un processo terminato
+LOCK_SCADUTO_SECONDI = 3600
+# Attesa prima di riprovare quando un altro processo sta già facendo il backup
+ATTESA_LOCK_SECONDI = 60
+# Attesa dopo un backup fallito
+ATTESA_ERRORE_SECONDI = 300
+
+
+def percorso_sorgente(database_path):
+    """Percorso del database come registrato nei manifest"""
+    return os.path.normcase(os.path.abspath(database_path))
+
+
+class ErroreBackup(Exception):
+    """Istantanea mancante, danneggiata o non ripristinabile"""
+
+
+class BackupInCorso(ErroreBackup):
+    """Un altro processo sta scrivendo nell'archivio"""
+
+
+def _intero(nome_env, predefinito):
+    try:
+        return max(int(os.environ.get(nome_env, predefinito)), 0)
+    except ValueError:
+        print(f"⚠️ {nome_env} non è un numero intero, uso {predefinito}")
+        return predefinito
+
+
+def da_conservare(istantanee, orarie, giornaliere, mensili):
+    """
+    Id da tenere tra `istantanee` (lista di (id, datetime)): la più recente
+    di ciascuna delle ultime `orarie` ore, `giornaliere` giorni e `mensili`
+    mesi in cui esiste un'istantanea, più l'ultima in assoluto.
+    """
+    # A parità di data e ora (stesso secondo) decide l'id, che ha il suffisso progressivo
+    ordinate = sorted(istantanee, key=lambda istantanea: (istantanea[1], istantanea[0]), reverse=True)
+    tenute = {ordinate[0][0]} if ordinate else set()
+    for formato, quante in (('%Y%m%d%H', orarie), ('%Y%m%d', giornaliere), ('%Y%m', mensili)):
+        periodi = set()
+        for id_istantanea, creata in ordinate:
+            periodo = creata.strftime(formato)
+            if periodo in periodi:
+                continue
+            if len(periodi) >= quante:
+                break
+            periodi.add(periodo)
+            tenute.add(id_istantanea)
+    return tenute
+
+
+def verifica_integrita(percorso):
+    """Messaggi di PRAGMA integrity_check; lista vuota se il database è integro"""
+    connessione = sqlite3.connect(f'file:{percorso}?mode=ro', uri=True)
+    try:
+        righe = [riga[0] for riga in connessione.execute('PRAGMA integrity_check').fetchall()]
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        connessione.close()
+    return [] if righe == ['ok'] else righe
+
+
+class ArchivioBackup:
+    """Archivio delle istantanee in `cartella` (vedi docstring del modulo)"""
+
+    def __init__(self, cartella, pagine_blocco=16, orarie=24, giornaliere=30, mensili=12):
+        self.cartella = cartella
+        self.pagine_blocco = max(int(pagine_blocco), 1)
+        self.orarie = orarie
+        self.giornaliere = giornaliere
+        self.mensili = mensili
+        self.cartella_oggetti = os.path.join(cartella, 'oggetti')
+        self.cartella_istantanee = os.path.join(cartella, 'istantanee')
+        os.makedirs(self.cartella_oggetti, exist_ok=True)
+        os.makedirs(self.cartella_istantanee, exist_ok=True)
+
+    # Lock tra processi (più worker dell'app e riga di comando)
+
+    @contextmanager
+    def _esclusivo(self):
+        percorso = os.path.join(self.cartella, '.lock')
+        for _ in range(2):
+            try:
+                os.close(os.open(percorso, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(percorso) < LOCK_SCADUTO_SECONDI:
+                        raise BackupInCorso('Un altro backup è in corso')
+                    os.remove(percorso)
+                except FileNotFoundError:
+                    pass
+        else:
+            raise BackupInCorso('Un altro backup è in corso')
+        try:
+            yield
+        finally:
+            try:
+                os.remove(percorso)
+            except FileNotFoundError:
+                pass
+
+    # Oggetti
+
+    def _percorso_oggetto(self, hash_contenuto):
+        return os.path.join(self.cartella_oggetti, hash_contenuto[:2], hash_contenuto)
+
+    def _salva_oggetto(self, contenuto):
+        """Salva il contenuto se non presente; restituisce (hash, byte scritti)"""
+        hash_contenuto = hashlib.sha256(contenuto).hexdigest()
+        percorso = self._percorso_oggetto(hash_contenuto)
+        if os.path.exists(percorso):
+            return hash_contenuto, 0
+        os.makedirs(os.path.dirname(percorso), exist_ok=True)
+        compresso = zlib.compress(contenuto, 6)
+        temporaneo = f'{percorso}.tmp{os.getpid()}'
+        with open(temporaneo, 'wb') as file:
+            file.write(compresso)
+        os.replace(temporaneo, percorso)
+        return hash_contenuto, len(compresso)
+
+    def _leggi_oggetto(self, hash_contenuto):
+        try:
+            with open(self._percorso_oggetto(hash_contenuto), 'rb') as file:
+                contenuto = zlib.decompress(file.read())
+        except (OSError, zlib.error) as e:
+            raise ErroreBackup(f'Oggetto {hash_contenuto[:12]} mancante o danneggiato: {e}')
+        if hashlib.sha256(contenuto).hexdigest() != hash_contenuto:
+            raise ErroreBackup(f'Oggetto {hash_contenuto[:12]} danneggiato')
+        return contenuto
+
+    # Istantanee
+
+    def elenco(self, database_path=None):
+        """
+        Manifest delle istantanee, dalla più vecchia alla più recente; con
+        `database_path` solo quelle di quel database.
+        """
+        sorgente = percorso_sorgente(database_path) if database_path else None
+        manifest = []
+        for nome in sorted(os.listdir(self.cartella_istantanee)):
+            if nome.endswith('.json'):
+                with open(os.path.join(self.cartella_istantanee, nome), encoding='utf-8') as file:
+                    dati = json.load(file)
+                if sorgente is None or dati.get('sorgente') == sorgente:
+                    manifest.append(dati)
+        return manifest
+
+    def leggi(self, id_istantanea):
+        percorso = os.path.join(self.cartella_istantanee, f'{os.path.basename(id_istantanea)}.json')
+        if not os.path.exists(percorso):
+            raise ErroreBackup(f'Istantanea {id_istantanea} non trovata')
+        with open(percorso, encoding='utf-8') as file:
+            return json.load(file)
+
+    def ultima(self, database_path):
+        """Data e ora dell'istantanea più recente del database, o None"""
+        istantanee = self.elenco(database_path)
+        return datetime.fromisoformat(istantanee[-1]['creato']) if istantanee else None
+
+    def crea(self, database_path, cartelle_extra=(), base_path=None, motivo=MOTIVO_PIANIFICATO):
+        """Nuova istantanea del database e delle cartelle indicate; restituisce il manifest"""
+        with self._esclusivo():
+            return self._crea(database_path, cartelle_extra, base_path, motivo)
+
+    def _crea(self, database_path, cartelle_extra, base_path, motivo):
+        inizio = time.perf_counter()
+        adesso = datetime.now()
+        id_istantanea = adesso.strftime(FORMATO_ID)
+        numero = 1
+        while os.path.exists(os.path.join(self.cartella_istantanee, f'{id_istantanea}.json')):
+            id_istantanea = f'{adesso.strftime(FORMATO_ID)}_{numero}'
+            numero += 1
+
+        temporanea = tempfile.mkdtemp(prefix='tmp_', dir=self.cartella)
+        try:
+            istantanea = os.path.join(temporanea, 'database.db')
+            copia_online(database_path, istantanea)
+            connessione = sqlite3.connect(istantanea)
+            dimensione_pagina = connessione.execute('PRAGMA page_size').fetchone()[0]
+            connessione.close()
+
+            byte_nuovi = 0
+            blocchi = []
+            hash_database = hashlib.sha256()
+            with open(istantanea, 'rb') as file:
+                for blocco in iter(lambda: file.read(dimensione_pagina * self.pagine_blocco), b''):
+                    hash_database.update(blocco)
+                    hash_blocco, scritti = self._salva_oggetto(blocco)
+                    blocchi.append(hash_blocco)
+                    byte_nuovi += scritti
+
+            file_salvati, scritti = self._salva_file(
+                database_path, cartelle_extra, base_path or os.path.dirname(database_path)
+            )
+            byte_nuovi += scritti
+
+            manifest = {
+                'id': id_istantanea,
+                'creato': adesso.isoformat(timespec='seconds'),
+                'motivo': motivo,
+                'sorgente': percorso_sorgente(database_path),
+                'database': {
+                    'dimensione': os.path.getsize(istantanea),
+                    'sha256': hash_database.hexdigest(),
+                    'dimensione_pagina': dimensione_pagina,
+                    'dimensione_blocco': dimensione_pagina * self.pagine_blocco,
+                    'blocchi': blocchi,
+                },
+                'righe': conteggi_tabelle(istantanea),
+                'file': file_salvati,
+                'byte_nuovi': byte_nuovi,
+                'secondi': round(time.perf_counter() - inizio, 3),
+            }
+        finally:
+            shutil.rmtree(temporanea, ignore_errors=True)
+
+        percorso = os.path.join(self.cartella_istantanee, f'{id_istantanea}.json')
+        with open(f'{percorso}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=1, ensure_ascii=False)
+        os.replace(f'{percorso}.tmp', percorso)
+        print(f"💾 Backup {id_istantanea}: {manifest['database']['dimensione'] // 1024} KB, "
+              f"{len(blocchi)} blocchi, {len(file_salvati)} file, {byte_nuovi // 1024} KB nuovi "
+              f"in {manifest['secondi']:.2f} s")
+        return manifest
+
+    def _salva_file(self, database_path, cartelle, base_path):
+        """
+        File delle cartelle come {nome: {sha256, dimensione, modificato}}. I file
+        con dimensione e data di modifica uguali all'istantanea precedente dello
+        stesso database non vengono riletti.
+        """
+        istantanee = self.elenco(database_path) if cartelle else []
+        precedenti = istantanee[-1]['file'] if istantanee else {}
+        salvati = {}
+        byte_nuovi = 0
+        for cartella in cartelle:
+            for percorso, nome in file_cartella(cartella, base_path):
+                try:
+                    stato = os.stat(percorso)
+                    precedente = precedenti.get(nome)
+                    if precedente and precedente['dimensione'] == stato.st_size \
+                            and precedente['modificato'] == stato.st_mtime:
+                        salvati[nome] = precedente
+                        continue
+                    with open(percorso, 'rb') as file:
+                        hash_file, scritti = self._salva_oggetto(file.read())
+                except FileNotFoundError:
+                    continue
+                salvati[nome] = {'sha256': hash_file, 'dimensione': stato.st_size, 'modificato': stato.st_mtime}
+                byte_nuovi += scritti
+        return salvati, byte_nuovi
+
+    def ricostruisci(self, id_istantanea, destinazione):
+        """Scrive il database dell'istantanea in `destinazione` verificandone il checksum"""
+        manifest = self.leggi(id_istantanea)
+        hash_database = hashlib.sha256()
+        with open(destinazione, 'wb') as file:
+            for hash_blocco in manifest['database']['blocchi']:
+                blocco = self._leggi_oggetto(hash_blocco)
+                hash_database.update(blocco)
+                file.write(blocco)
+        if hash_database.hexdigest() != manifest['database']['sha256']:
+            raise ErroreBackup(f'Checksum del database dell\'istantanea {id_istantanea} non corrispondente')
+        return manifest
+
+    def verifica(self, id_istantanea):
+        """Ricostruisce l'istantanea in una cartella temporanea; restituisce i problemi trovati"""
+        temporanea = tempfile.mkdtemp(prefix='tmp_', dir=self.cartella)
+        try:
+            percorso = os.path.join(temporanea, 'database.db')
+            manifest = self.ricostruisci(id_istantanea, percorso)
+            problemi = verifica_integrita(percorso)
+            for nome, dati in manifest['file'].items():
+                if not os.path.exists(self._percorso_oggetto(dati['sha256'])):
+                    problemi.append(f'File {nome} mancante nell\'archivio')
+            return problemi
+        except ErroreBackup as e:
+            return [str(e)]
+        finally:
+            shutil.rmtree(temporanea, ignore_errors=True)
+
+    def ripristina(self, id_istantanea, database_path, base_path=None, file=False):
+        """
+        Sostituisce il database con quello dell'istantanea, dopo averne
+        verificato checksum e integrità e aver salvato il database attuale.
+        Con file=True ripristina anche le ricevute PDF diverse o mancanti.
+        Rifiuta le istantanee di un altro database. L'app deve essere ferma.
+        Restituisce l'id dell'istantanea di sicurezza.
+        """
+        base_path = base_path or os.path.dirname(database_path)
+        sorgente = self.leggi(id_istantanea).get('sorgente')
+        if sorgente != percorso_sorgente(database_path):
+            raise ErroreBackup(f'L\'istantanea {id_istantanea} è del database {sorgente or "sconosciuto"}, '
+                               f'non di {database_path}')
+        with self._esclusivo():
+            temporaneo = f'{database_path}.ripristino'
+            try:
+                manifest = self.ricostruisci(id_istantanea, temporaneo)
+                problemi = verifica_integrita(temporaneo)
+                if problemi:
+                    raise ErroreBackup(f'integrity_check fallito: {"; ".join(problemi[:5])}')
+
+                sicurezza = None
+                if os.path.exists(database_path):
+                    _chiudi_wal(database_path)
+                    sicurezza = self._crea(database_path, (), base_path, 'prima del ripristino')['id']
+                os.replace(temporaneo, database_path)
+            finally:
+                if os.path.exists(temporaneo):
+                    os.remove(temporaneo)
+
+            if file:
+                for nome, dati in manifest['file'].items():
+                    percorso = os.path.join(base_path, *nome.split('/'))
+                    if os.path.exists(percorso) and os.path.getsize(percorso) == dati['dimensione']:
+                        with open(percorso, 'rb') as attuale:
+                            if hashlib.sha256(attuale.read()).hexdigest() == dati['sha256']:
+                                continue
+                    os.makedirs(os.path.dirname(percorso), exist_ok=True)
+                    with open(percorso, 'wb') as destinazione:
+                        destinazione.write(self._leggi_oggetto(dati['sha256']))
+            return sicurezza
+
+    # Conservazione
+
+    def pulisci(self, database_path, tutte=False):
+        """
+        Applica la politica di conservazione alle istantanee pianificate del
+        database (con tutte=True anche alle altre) ed elimina gli oggetti non
+        più usati da nessuna istantanea
+        """
+        with self._esclusivo():
+            istantanee = [(manifest['id'], datetime.fromisoformat(manifest['creato']))
+                          for manifest in self.elenco(database_path)
+                          if tutte or manifest['motivo'] == MOTIVO_PIANIFICATO]
+            tenute = da_conservare(istantanee, self.orarie, self.giornaliere, self.mensili)
+            eliminate = [id_istantanea for id_istantanea, _ in istantanee if id_istantanea not in tenute]
+            for id_istantanea in eliminate:
+                os.remove(os.path.join(self.cartella_istantanee, f'{id_istantanea}.json'))
+
+            usati = set()
+            for manifest in self.elenco():
+                usati.update(manifest['database']['blocchi'])
+                usati.update(dati['sha256'] for dati in manifest['file'].values())
+            oggetti_eliminati = 0
+            for root, dirs, files in os.walk(self.cartella_oggetti):
+                for nome in files:
+                    if nome not in usati:
+                        os.remove(os.path.join(root, nome))
+                        oggetti_eliminati += 1
+            if eliminate or oggetti_eliminati:
+                print(f"🧹 Backup: eliminate {len(eliminate)} istantanee e {oggetti_eliminati} oggetti")
+            return eliminate
+
+
+def _chiudi_wal(database_path):
+    """Riporta il -wal nel database e lo rimuove; fallisce se il database è in uso"""
+    connessione = sqlite3.connect(database_path, timeout=5)
+    try:
+        modalita = connessione.execute('PRAGMA journal_mode = DELETE').fetchone()[0]
+    except sqlite3.OperationalError as e:
+        raise ErroreBackup(f'Database in uso, fermare l\'applicazione prima del ripristino ({e})')
+    finally:
+        connessione.close()
+    if modalita.lower() != 'delete':
+        raise ErroreBackup('Database in uso, fermare l\'applicazione prima del ripristino')
+
+
+def archivio_da_ambiente(base_path, database_path):
+    """
+    ArchivioBackup configurato con le variabili BACKUP_*. Senza BACKUP_DIR
+    l'archivio sta nella cartella backup accanto al database: un database
+    diverso (es. di benchmark) non finisce nell'archivio dell'app.
+    """
+    cartella = os.environ.get('BACKUP_DIR') or os.path.join(os.path.dirname(os.path.abspath(database_path)), 'backup')
+    if not os.path.isabs(cartella):
+        cartella = os.path.join(base_path, cartella)
+    return ArchivioBackup(
+        cartella,
+        pagine_blocco=_intero('BACKUP_CHUNK_PAGES', 16) or 16,
+        orarie=_intero('BACKUP_KEEP_HOURLY', 24),
+        giornaliere=_intero('BACKUP_KEEP_DAILY', 30),
+        mensili=_intero('BACKUP_KEEP_MONTHLY', 12)
+    )
+
+
+class BackupPianificati:
+    """Thread che crea un'istantanea ogni `intervallo` secondi e applica la conservazione"""
+
+    def __init__(self, archivio, database_path, cartelle_extra, base_path, intervallo):
+        self.archivio = archivio
+        self.database_path = database_path
+        self.cartelle_extra = cartelle_extra
+        self.base_path = base_path
+        self.intervallo = intervallo
+        self._evento = threading.Event()
+        self._thread = None
+        self._avvio_lock = threading.Lock()
+        self._fermato = False
+
+    @property
+    def attivo(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def avvia(self):
+        with self._avvio_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._fermato = False
+                self._thread = threading.Thread(target=self._ciclo, name='backup-pianificati', daemon=True)
+                self._thread.start()
+
+    def ferma(self):
+        self._fermato = True
+        self._evento.set()
+
+    def esegui_se_dovuto(self):
+        """
+        Crea l'istantanea se l'ultima (anche di un altro processo) è più
+        vecchia dell'intervallo. Restituisce i secondi da attendere.
+        """
+        ultima = self.archivio.ultima(self.database_path)
+        if ultima is not None:
+            trascorsi = (datetime.now() - ultima).total_seconds()
+            if 0 <= trascorsi < self.intervallo:
+                return self.intervallo - trascorsi
+        try:
+            self.archivio.crea(self.database_path, self.cartelle_extra, self.base_path)
+            self.archivio.pulisci(self.database_path)
+        except BackupInCorso:
+            return ATTESA_LOCK_SECONDI
+        return self.intervallo
+
+    def _ciclo(self):
+        while not self._fermato:
+            try:
+                attesa = self.esegui_se_dovuto()
+            except Exception as e:
+                print(f"❌ Backup pianificato: {str(e)}")
+                attesa = ATTESA_ERRORE_SECONDI
+            self._evento.wait(attesa)
+            self._evento.clear()
+
+
+def init_backup_pianificati(app, database_path, cartelle_extra, base_path):
+    """
+    Crea l'archivio dei backup e, con BACKUP_SCHEDULE_MINUTES > 0, il thread
+    dei backup automatici, avviato alla prima richiesta servita dal processo.
+    Registra l'archivio in app.extensions['archivio_backup'].
+    """
+    archivio = archivio_da_ambiente(base_path, database_path)
+    app.extensions['archivio_backup'] = archivio
+
+    minuti = _intero('BACKUP_SCHEDULE_MINUTES', 60)
+    if not minuti:
+        return None
+    pianificati = BackupPianificati(archivio, database_path, cartelle_extra, base_path, minuti * 60)
+    app.extensions['backup_pianificati'] = pianificati
+
+    @app.before_request
+    def _avvia_backup_pianificati():
+        if not pianificati.attivo:
+            pianificati.avvia()
+
+    return pianificati
@@ -0,0 +1,195 @@
+# utils/backup_database.py
+"""
+Backup online del database con l'API di backup di SQLite.
+Copiare il file database.db mentre l'app scrive può produrre una copia
+incoerente (pagine di transazioni diverse, commit ancora nel file -wal).
+sqlite3.Connection.backup copia invece le pagine a passi di poche centinaia:
+in WAL la sorgente resta aperta in una transazione di lettura, così tutti i
+passi vedono la stessa istantanea e gli scrittori non vengono bloccati; negli
+altri journal il lock viene rilasciato tra un passo e l'altro.
+
+L'istantanea va in una cartella temporanea, viene verificata (SHA-256 e righe
+per tabella, riportati in BACKUP.json nell'archivio) e poi compressa in ZIP
+man mano che il client la scarica. La cartella temporanea viene rimossa a
+fine download, anche se interrotto o mai iniziato (la route registra
+pulisci() con response.call_on_close).
+
+Configurazione da ambiente:
+- BACKUP_PAGES_PER_STEP: pagine copiate a ogni passo (default 1024)
+- BACKUP_STEP_PAUSE_MS: pausa tra i passi fuori da WAL, per lasciare spazio
+  agli scrittori (default 5)
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import zipfile
+from datetime import datetime
+from utils.flusso_zip import FlussoZip
+
+# Byte letti (e compressi) per ogni blocco inviato al client
+BLOCCO_LETTURA = 1024 * 1024
+# Nome del database e del manifest nell'archivio
+NOME_DATABASE = 'database.db'
+NOME_MANIFEST = 'BACKUP.json'
+
+
+def _intero(nome_env, predefinito):
+    try:
+        return max(int(os.environ.get(nome_env, predefinito)), 0)
+    except ValueError:
+        print(f"⚠️ {nome_env} non è un numero intero, uso {predefinito}")
+        return predefinito
+
+
+def copia_online(sorgente, destinazione, pagine=None, pausa_ms=None, un_solo_file=True):
+    """
+    Copia coerente del database `sorgente` nel file `destinazione` con
+    l'API di backup, a passi di `pagine` pagine. Restituisce il numero di passi.
+    Con un_solo_file la copia passa al journal DELETE (nessun -wal accanto);
+    per ripristinare sopra un database in uso va lasciato il suo journal.
+    """
+    pagine = pagine or _intero('BACKUP_PAGES_PER_STEP', 1024) or 1024
+    pausa = (_intero('BACKUP_STEP_PAUSE_MS', 5) if pausa_ms is None else pausa_ms) / 1000
+    passi = 0
+
+    origine = sqlite3.connect(sorgente, isolation_level=None, timeout=30)
+    copia = sqlite3.connect(destinazione)
+    try:
+        wal = origine.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+        if wal:
+            # Istantanea di lettura per tutta la copia: nessun riavvio per le
+            # scritture concorrenti, che proseguono sul file -wal
+            origine.execute('BEGIN')
+            origine.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+
+        def avanzamento(stato, rimanenti, totali):
+            nonlocal passi
+            passi += 1
+            if pausa and not wal and rimanenti:
+                time.sleep(pausa)
+
+        origine.backup(copia, pages=pagine, progress=avanzamento)
+        if wal:
+            origine.execute('COMMIT')
+        if un_solo_file:
+            # La copia resta in un solo file, senza -wal accanto
+            copia.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        copia.close()
+        origine.close()
+    return passi
+
+
+def conteggi_tabelle(percorso):
+    """Righe per tabella (escluse le tabelle interne e quelle virtuali FTS)"""
+    connessione = sqlite3.connect(percorso)
+    try:
+        tabelle = connessione.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).fetchall()
+        virtuali = [nome for nome, sql in tabelle if (sql or '').upper().startswith('CREATE VIRTUAL')]
+        return {
+            nome: connessione.execute(f'SELECT COUNT(*) FROM "{nome}"').fetchone()[0]
+            for nome, sql in tabelle
+            if nome not in virtuali and not any(nome.startswith(f'{virtuale}_') for virtuale in virtuali)
+        }
+    finally:
+        connessione.close()
+
+
+def sha256_file(percorso):
+    hash_file = hashlib.sha256()
+    with open(percorso, 'rb') as file:
+        for blocco in iter(lambda: file.read(BLOCCO_LETTURA), b''):
+            hash_file.update(blocco)
+    return hash_file.hexdigest()
+
+
+def file_cartella(cartella, base_path):
+    """(percorso, nome nell'archivio) dei file della cartella, se esiste"""
+    if not cartella or not os.path.isdir(cartella):
+        return
+    for root, dirs, files in os.walk(cartella):
+        dirs.sort()
+        for file in sorted(files):
+            percorso = os.path.join(root, file)
+            yield percorso, os.path.relpath(percorso, base_path).replace(os.sep, '/')
+
+
+def _scrivi_file(archivio, flusso, percorso, nome):
+    """Aggiunge un file all'archivio a blocchi, prelevando i byte compressi man mano"""
+    try:
+        file = open(percorso, 'rb')
+    except FileNotFoundError:
+        # Ricevuta eliminata durante il backup
+        return
+    info = zipfile.ZipInfo.from_file(percorso, nome)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    with file, archivio.open(info, 'w', force_zip64=True) as destinazione:
+        for blocco in iter(lambda: file.read(BLOCCO_LETTURA), b''):
+            destinazione.write(blocco)
+            yield flusso.preleva()
+
+
+class BackupOnline:
+    """
+    Istantanea del database pronta per il download. `manifest` descrive la
+    copia (checksum, righe per tabella); stream() produce l'archivio ZIP.
+    pulisci() rimuove i file temporanei e va chiamato alla chiusura della
+    risposta: il generatore potrebbe non essere mai avviato (HEAD, client
+    disconnesso prima del primo byte).
+    """
+
+    def __init__(self, database_path, cartelle_extra=(), base_path=None):
+        self.database_path = database_path
+        self.cartelle_extra = cartelle_extra
+        self.base_path = base_path or os.path.dirname(database_path)
+        self.cartella = tempfile.mkdtemp(prefix='backup_danza_')
+        self.istantanea = os.path.join(self.cartella, NOME_DATABASE)
+        self.manifest = None
+
+    def prepara(self):
+        """Crea e verifica l'istantanea; in caso di errore pulisce e rilancia"""
+        try:
+            inizio = time.perf_counter()
+            passi = copia_online(self.database_path, self.istantanea)
+            durata = time.perf_counter() - inizio
+            self.manifest = {
+                'creato': datetime.now().isoformat(timespec='seconds'),
+                'database': NOME_DATABASE,
+                'dimensione': os.path.getsize(self.istantanea),
+                'sha256': sha256_file(self.istantanea),
+                'righe': conteggi_tabelle(self.istantanea),
+                'versione_sqlite': sqlite3.sqlite_version,
+                'passi_copia': passi,
+                'secondi_copia': round(durata, 3),
+            }
+            print(f"💾 Istantanea database: {self.manifest['dimensione'] // 1024} KB in {passi} passi, "
+                  f"{durata:.2f} s, sha256 {self.manifest['sha256'][:12]}…")
+            return self
+        except Exception:
+            self.pulisci()
+            raise
+
+    def pulisci(self):
+        shutil.rmtree(self.cartella, ignore_errors=True)
+
+    def stream(self):
+        """Archivio ZIP (database, manifest e cartelle extra) scritto in streaming"""
+        flusso = FlussoZip()
+        try:
+            with zipfile.ZipFile(flusso, 'w', compression=zipfile.ZIP_DEFLATED) as archivio:
+                yield from _scrivi_file(archivio, flusso, self.istantanea, NOME_DATABASE)
+                archivio.writestr(NOME_MANIFEST, json.dumps(self.manifest, indent=2, ensure_ascii=False))
+                yield flusso.preleva()
+                for cartella in self.cartelle_extra:
+                    for percorso, nome in file_cartella(cartella, self.base_path):
+                        yield from _scrivi_file(archivio, flusso, percorso, nome)
+            yield flusso.preleva()
+        finally:
+            # Anche quando il client interrompe il download
+            self.pulisci()
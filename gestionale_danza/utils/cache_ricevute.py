@@ -0,0 +1,188 @@
+# utils/cache_ricevute.py
+"""
+Cache su disco dei PDF delle ricevute, indirizzata per contenuto.
+La chiave è l'hash dei dati che finiscono nella ricevuta (pagamento, cliente
+con indirizzo, corso, numero ricevuta) e della versione delle impostazioni
+aziendali, quindi una modifica al pagamento, al cliente o alle impostazioni
+produce una chiave nuova e la vecchia voce non viene più servita. Le voci
+superflue vengono comunque rimosse (invalidazione esplicita) e la dimensione
+totale è limitata con politica LRU.
+
+I file sono condivisi tra i processi dell'app: le scritture sono atomiche e
+l'ordine LRU usa la data di modifica del file, aggiornata a ogni lettura.
+
+Configurazione da ambiente:
+- PDF_CACHE_DIR: cartella della cache (default data/cache/ricevute)
+- PDF_CACHE_MAX_MB: dimensione massima in MB (default 200, 0 = cache disattivata)
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+# Da incrementare quando cambia il layout delle ricevute (template o ReportLab)
+FORMATO_RICEVUTA = 1
+# Dopo una pulizia la cache scende a questa frazione della dimensione massima
+QUOTA_DOPO_PULIZIA = 0.9
+ESTENSIONE = '.pdf'
+
+
+def chiave_ricevuta(pagamento, settings, motore):
+    """
+    Hash dei dati che determinano il contenuto della ricevuta.
+    `motore` distingue i PDF WeasyPrint da quelli ReportLab.
+    """
+    dati = [
+        FORMATO_RICEVUTA,
+        motore,
+        pagamento.id,
+        pagamento.numero_ricevuta,
+        pagamento.mese,
+        pagamento.anno,
+        pagamento.importo,
+        pagamento.pagato,
+        pagamento.data_pagamento.isoformat() if pagamento.data_pagamento else None,
+        pagamento.metodo_pagamento,
+        pagamento.note,
+        # Tutti i campi di cliente e corso stampati (template ricevuta.html e ReportLab)
+        pagamento.cliente.nome,
+        pagamento.cliente.cognome,
+        pagamento.cliente.codice_fiscale,
+        pagamento.cliente.via,
+        pagamento.cliente.civico,
+        pagamento.cliente.cap,
+        pagamento.cliente.citta,
+        pagamento.cliente.provincia,
+        pagamento.corso.nome,
+        settings.versione if settings else None,
+        settings.logo_filename if settings else None,
+    ]
+    testo = json.dumps(dati, ensure_ascii=False, default=str)
+    return hashlib.sha256(testo.encode('utf-8')).hexdigest()
+
+
+class CacheRicevute:
+    """Cache LRU su disco dei PDF, un file per voce: <pagamento_id>-<chiave>.pdf"""
+
+    def __init__(self, cartella, max_bytes):
+        self.cartella = cartella
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cartella, exist_ok=True)
+        self._dimensione = self._scansiona()[1]
+
+    def _percorso(self, pagamento_id, chiave):
+        return os.path.join(self.cartella, f'{pagamento_id}-{chiave}{ESTENSIONE}')
+
+    def _scansiona(self):
+        """Voci presenti (percorso, dimensione, ultimo uso) e dimensione totale"""
+        voci = []
+        totale = 0
+        with os.scandir(self.cartella) as elementi:
+            for elemento in elementi:
+                if not elemento.name.endswith(ESTENSIONE):
+                    continue
+                try:
+                    stat = elemento.stat()
+                except FileNotFoundError:
+                    continue
+                voci.append((elemento.path, stat.st_size, stat.st_mtime))
+                totale += stat.st_size
+        return voci, totale
+
+    def leggi(self, pagamento_id, chiave):
+        """Contenuto del PDF, oppure None se non presente"""
+        percorso = self._percorso(pagamento_id, chiave)
+        try:
+            with open(percorso, 'rb') as f:
+                contenuto = f.read()
+            os.utime(percorso)  # usato di recente
+            return contenuto
+        except FileNotFoundError:
+            return None
+
+    def contiene(self, pagamento_id, chiave):
+        return os.path.exists(self._percorso(pagamento_id, chiave))
+
+    def salva(self, pagamento_id, chiave, contenuto):
+        """Scrive la voce in modo atomico e, se serve, libera spazio"""
+        if len(contenuto) > self.max_bytes:
+            return
+
+        descrittore, temporaneo = tempfile.mkstemp(dir=self.cartella, suffix='.tmp')
+        try:
+            with os.fdopen(descrittore, 'wb') as f:
+                f.write(contenuto)
+            os.replace(temporaneo, self._percorso(pagamento_id, chiave))
+        except OSError:
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
+            return
+
+        with self._lock:
+            self._dimensione += len(contenuto)
+            if self._dimensione > self.max_bytes:
+                self._pulisci()
+
+    def _pulisci(self):
+        """Rimuove le voci usate meno di recente (la scansione vale per tutti i processi)"""
+        voci, totale = self._scansiona()
+        obiettivo = self.max_bytes * QUOTA_DOPO_PULIZIA
+        for percorso, dimensione, _ in sorted(voci, key=lambda voce: voce[2]):
+            if totale <= obiettivo:
+                break
+            try:
+                os.remove(percorso)
+                totale -= dimensione
+            except FileNotFoundError:
+                pass
+        self._dimensione = totale
+
+    def invalida(self, pagamento_id):
+        """Elimina le ricevute in cache di un pagamento (modificato o eliminato)"""
+        prefisso = f'{pagamento_id}-'
+        with os.scandir(self.cartella) as elementi:
+            da_eliminare = [
+                elemento.path for elemento in elementi
+                if elemento.name.startswith(prefisso) and elemento.name.endswith(ESTENSIONE)
+            ]
+        for percorso in da_eliminare:
+            try:
+                os.remove(percorso)
+            except FileNotFoundError:
+                pass
+
+    def svuota(self):
+        """Elimina tutte le voci (es. dopo una modifica delle impostazioni aziendali)"""
+        voci, _ = self._scansiona()
+        for percorso, _, _ in voci:
+            try:
+                os.remove(percorso)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._dimensione = 0
+
+    def statistiche(self):
+        voci, totale = self._scansiona()
+        return {'voci': len(voci), 'dimensione_bytes': totale, 'dimensione_massima_bytes': self.max_bytes}
+
+
+def init_cache_ricevute(app, base_path):
+    """
+    Crea la cache delle ricevute e la registra in app.extensions['cache_ricevute'].
+    Restituisce la cache, oppure None se disattivata (PDF_CACHE_MAX_MB=0).
+    """
+    try:
+        max_mb = float(os.environ.get('PDF_CACHE_MAX_MB', 200))
+    except ValueError:
+        max_mb = 200
+    if max_mb <= 0:
+        app.extensions['cache_ricevute'] = None
+        return None
+
+    cartella = os.environ.get('PDF_CACHE_DIR') or os.path.join(base_path, 'data', 'cache', 'ricevute')
+    cache = CacheRicevute(cartella, int(max_mb * 1024 * 1024))
+    app.extensions['cache_ricevute'] = cache
+    return cache
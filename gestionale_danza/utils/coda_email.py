@@ -0,0 +1,324 @@
+# utils/coda_email.py
+"""
+Invio asincrono delle email tramite la tabella messaggi_email (outbox).
+Le route accodano i messaggi e rispondono subito; un thread in background
+in ogni processo dell'app preleva i messaggi pronti, li invia e registra
+l'esito. I messaggi consecutivi condividono la stessa connessione SMTP
+(utils/invio_smtp.py), chiusa quando la coda si svuota. Gli errori temporanei (SMTP non raggiungibile, timeout, ...) vengono
+ritentati con backoff esponenziale, quelli definitivi (destinatario
+rifiutato, pagamento eliminato) chiudono subito il messaggio come fallito.
+
+Configurazione da ambiente:
+- EMAIL_OUTBOX_WORKER: avvia il thread di invio nell'app (default True)
+- EMAIL_POLL_SECONDS: intervallo di controllo della coda (default 5)
+- EMAIL_MAX_ATTEMPTS: tentativi prima di segnare il messaggio come fallito (default 5)
+- EMAIL_RETRY_BASE_SECONDS: attesa dopo il primo errore, raddoppiata a ogni tentativo (default 60)
+"""
+import os
+import time
+import random
+import smtplib
+import threading
+import mimetypes
+from datetime import datetime
+from email.mime.image import MIMEImage
+from flask import current_app
+from flask_mailman import EmailMultiAlternatives
+from sqlalchemy.orm import joinedload
+from models import db, MessaggioEmail, Pagamento, Settings
+from utils.invio_smtp import InvioSMTP
+
+# Messaggi prelevati per ogni giro del worker
+BLOCCO_INVIO = 20
+# Attesa massima tra due tentativi
+RITARDO_MASSIMO_SECONDI = 3600
+# Dopo questo tempo un messaggio ancora 'in_invio' si considera interrotto
+TIMEOUT_INVIO_SECONDI = 600
+
+
+class MessaggioNonValido(Exception):
+    """Il messaggio non può essere costruito: inutile ritentare"""
+
+
+def _env_numero(nome, default):
+    try:
+        return float(os.environ.get(nome, default))
+    except ValueError:
+        return default
+
+
+def accoda_email(tipo, destinatario, oggetto, corpo_testo, corpo_html=None, **riferimenti):
+    """
+    Aggiunge un messaggio alla coda nella sessione corrente; il chiamante fa
+    il commit e poi chiama sveglia_invio() per farlo partire subito.
+    `riferimenti`: pagamento_id, insegnante_id, mese, anno.
+    """
+    messaggio = MessaggioEmail(
+        tipo=tipo,
+        destinatario=destinatario,
+        oggetto=oggetto,
+        corpo_testo=corpo_testo,
+        corpo_html=corpo_html,
+        **riferimenti
+    )
+    db.session.add(messaggio)
+    return messaggio
+
+
+def allega_logo_inline(email, settings, static_folder):
+    """Allega il logo aziendale come immagine inline (cid:logo) per i template HTML"""
+    if not settings.logo_filename:
+        return
+    logo_path = os.path.join(static_folder, 'uploads', settings.logo_filename)
+    if not os.path.exists(logo_path):
+        return
+    with open(logo_path, 'rb') as f:
+        logo_data = f.read()
+    content_type, _ = mimetypes.guess_type(logo_path)
+    sottotipo = content_type.split('/')[1] if content_type and content_type.startswith('image/') else 'png'
+    logo_attachment = MIMEImage(logo_data, _subtype=sottotipo)
+    logo_attachment.add_header('Content-ID', '<logo>')
+    logo_attachment.add_header('Content-Disposition', 'inline', filename=settings.logo_filename)
+    email.attach(logo_attachment)
+
+
+def _carica_pagamenti(ids):
+    """
+    Pagamenti (con cliente e corso) staccati dalla sessione: i commit fatti
+    dopo ogni invio non li fanno ricaricare mentre le ricevute vengono generate.
+    """
+    pagamenti = Pagamento.query.options(joinedload(Pagamento.cliente), joinedload(Pagamento.corso)) \
+        .filter(Pagamento.id.in_(ids)).all()
+    for pagamento in pagamenti:
+        for oggetto in (pagamento, pagamento.cliente, pagamento.corso):
+            if oggetto in db.session:
+                db.session.expunge(oggetto)
+    return {pagamento.id: pagamento for pagamento in pagamenti}
+
+
+def ricevute_messaggi(messaggi):
+    """
+    Per ogni messaggio, nell'ordine, (messaggio, ricevute, errore) con le ricevute
+    da allegare come [(pdf_content, filename)] (None per i messaggi senza ricevute).
+    Le ricevute di tutti i messaggi vengono generate insieme dal servizio PDF, in
+    parallelo; in memoria restano solo quelle del messaggio in corso.
+    """
+    from utils.stampa_pdf import genera_ricevute_pdf
+
+    pagamenti_messaggi = {
+        messaggio.id: messaggio.pagamenti_ids
+        for messaggio in messaggi if messaggio.tipo == MessaggioEmail.TIPO_RICEVUTA
+    }
+    caricati = _carica_pagamenti([pid for ids in pagamenti_messaggi.values() for pid in ids])
+
+    elenco = []
+    for messaggio in messaggi:
+        if messaggio.id not in pagamenti_messaggi:
+            elenco.append((messaggio, None))
+            continue
+        # Ricevute in ordine di incasso; quelle dei pagamenti eliminati vengono saltate
+        pagamenti = sorted(
+            (caricati[pid] for pid in pagamenti_messaggi[messaggio.id] if pid in caricati),
+            key=lambda p: (p.data_pagamento or datetime.min, p.numero_ricevuta or 0, p.id)
+        )
+        elenco.append((messaggio, pagamenti))
+
+    risultati = genera_ricevute_pdf(p for _, pagamenti in elenco if pagamenti for p in pagamenti)
+    try:
+        for messaggio, pagamenti in elenco:
+            if pagamenti is None:
+                yield messaggio, None, None
+                continue
+            if not pagamenti:
+                yield messaggio, None, MessaggioNonValido('Il pagamento della ricevuta è stato eliminato')
+                continue
+            ricevute = []
+            errore = None
+            for _ in pagamenti:
+                pagamento, pdf_content, filename, errore_pdf = next(risultati)
+                if errore_pdf:
+                    errore = errore or RuntimeError(f'{filename}: {errore_pdf}')
+                else:
+                    ricevute.append((pdf_content, filename))
+            yield messaggio, ricevute, errore
+    finally:
+        risultati.close()
+
+
+def costruisci_email(messaggio, settings, static_folder, ricevute=None):
+    """Email pronta per l'invio, con gli allegati del tipo di messaggio"""
+    email = EmailMultiAlternatives(
+        subject=messaggio.oggetto,
+        body=messaggio.corpo_testo,
+        from_email=settings.mail_default_sender,
+        to=[messaggio.destinatario]
+    )
+    if messaggio.corpo_html:
+        email.attach_alternative(messaggio.corpo_html, 'text/html')
+
+    if messaggio.tipo == MessaggioEmail.TIPO_RICEVUTA:
+        if ricevute is None:
+            _, ricevute, errore = next(ricevute_messaggi([messaggio]))
+            if errore:
+                raise errore
+        for pdf_content, filename in ricevute:
+            email.attach(filename, pdf_content, 'application/pdf')
+    elif messaggio.tipo == MessaggioEmail.TIPO_REPORT_INSEGNANTE:
+        allega_logo_inline(email, settings, static_folder)
+
+    return email
+
+
+def errore_definitivo(errore):
+    """Errori per cui un nuovo tentativo darebbe lo stesso risultato"""
+    return isinstance(errore, (MessaggioNonValido, smtplib.SMTPRecipientsRefused))
+
+
+class InvioEmailCoda:
+    """Thread di invio della coda email di un processo"""
+
+    def __init__(self, app, configura_mail, intervallo=5, max_tentativi=5, ritardo_base=60):
+        self.app = app
+        self.configura_mail = configura_mail
+        self.intervallo = intervallo
+        self.max_tentativi = max_tentativi
+        self.ritardo_base = ritardo_base
+        self._evento = threading.Event()
+        self._thread = None
+        self._avvio_lock = threading.Lock()
+        self._fermato = False
+        self._versione_configurazione = None
+        self._ultimo_ripristino = float('-inf')
+        # Connessione SMTP riusata tra un blocco di messaggi e il successivo
+        self._smtp = None
+
+    @property
+    def attivo(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def avvia(self):
+        with self._avvio_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._fermato = False
+                self._thread = threading.Thread(target=self._ciclo, name='invio-email', daemon=True)
+                self._thread.start()
+
+    def ferma(self):
+        self._fermato = True
+        self._evento.set()
+
+    def sveglia(self):
+        """Fa controllare subito la coda (dopo aver accodato dei messaggi)"""
+        self._evento.set()
+
+    def ritardo(self, tentativi):
+        """Backoff esponenziale con un po' di casualità, per non ritentare tutti insieme"""
+        ritardo = min(self.ritardo_base * 2 ** max(tentativi - 1, 0), RITARDO_MASSIMO_SECONDI)
+        return ritardo * random.uniform(0.8, 1.2)
+
+    def _ciclo(self):
+        while not self._fermato:
+            elaborati = 0
+            try:
+                with self.app.app_context():
+                    elaborati = self.elabora()
+            except Exception as e:
+                print(f"❌ Coda email: {str(e)}")
+            # Con messaggi appena inviati si riprova subito: la coda potrebbe non essere vuota
+            if not elaborati:
+                self._evento.wait(self.intervallo)
+                self._evento.clear()
+        self._chiudi_smtp()
+
+    def _aggiorna_configurazione(self, settings):
+        if settings.versione != self._versione_configurazione:
+            # La connessione aperta usa la vecchia configurazione
+            self._chiudi_smtp()
+            self.configura_mail(settings)
+            self._versione_configurazione = settings.versione
+
+    def _connessione_smtp(self, settings):
+        if self._smtp is None:
+            self._smtp = InvioSMTP(settings.mail_max_emails)
+        return self._smtp
+
+    def _chiudi_smtp(self):
+        if self._smtp is not None:
+            self._smtp.chiudi()
+            self._smtp = None
+
+    def elabora(self):
+        """Un giro del worker: preleva e invia un blocco di messaggi. Restituisce quanti"""
+        try:
+            settings = Settings.get_settings_cached()
+            if not settings.mail_configured:
+                # I messaggi restano in coda finché l'SMTP non viene configurato
+                self._chiudi_smtp()
+                return 0
+            self._aggiorna_configurazione(settings)
+
+            if time.monotonic() - self._ultimo_ripristino > TIMEOUT_INVIO_SECONDI / 10:
+                MessaggioEmail.ripristina_interrotti(TIMEOUT_INVIO_SECONDI)
+                self._ultimo_ripristino = time.monotonic()
+            ids = MessaggioEmail.preleva(BLOCCO_INVIO)
+            db.session.commit()
+            if not ids:
+                # Coda vuota: la connessione non resta aperta inutilmente
+                self._chiudi_smtp()
+
+            messaggi = [db.session.get(MessaggioEmail, messaggio_id) for messaggio_id in ids]
+            for messaggio, ricevute, errore in ricevute_messaggi(messaggi):
+                self.invia(messaggio, settings, ricevute, errore)
+                db.session.commit()
+            return len(ids)
+        finally:
+            db.session.remove()
+
+    def invia(self, messaggio, settings, ricevute=None, errore=None):
+        try:
+            if errore:
+                raise errore
+            email = costruisci_email(messaggio, settings, self.app.static_folder, ricevute)
+            if settings.mail_suppress_send:
+                messaggio.segna_inviato(soppresso=True)
+            else:
+                self._connessione_smtp(settings).invia(email)
+                messaggio.segna_inviato()
+        except Exception as e:
+            db.session.rollback()
+            if errore_definitivo(e) or messaggio.tentativi >= self.max_tentativi:
+                messaggio.segna_errore(str(e))
+                print(f"❌ Email {messaggio.id} a {messaggio.destinatario} fallita: {str(e)}")
+            else:
+                messaggio.segna_errore(str(e), self.ritardo(messaggio.tentativi))
+
+
+def init_coda_email(app, configura_mail):
+    """
+    Crea il worker della coda email e lo registra in app.extensions['coda_email'].
+    Con EMAIL_OUTBOX_WORKER=True (default) il thread parte alla prima richiesta
+    servita dal processo.
+    """
+    worker = InvioEmailCoda(
+        app,
+        configura_mail,
+        intervallo=_env_numero('EMAIL_POLL_SECONDS', 5),
+        max_tentativi=int(_env_numero('EMAIL_MAX_ATTEMPTS', 5)),
+        ritardo_base=_env_numero('EMAIL_RETRY_BASE_SECONDS', 60)
+    )
+    app.extensions['coda_email'] = worker
+
+    if os.environ.get('EMAIL_OUTBOX_WORKER', 'True').lower() == 'true':
+        @app.before_request
+        def _avvia_invio_email():
+            if not worker.attivo:
+                worker.avvia()
+
+    return worker
+
+
+def sveglia_invio():
+    """Da chiamare dopo il commit dei messaggi accodati"""
+    worker = current_app.extensions.get('coda_email')
+    if worker is not None:
+        worker.sveglia()
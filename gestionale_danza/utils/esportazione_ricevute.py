@@ -0,0 +1,97 @@
+# utils/esportazione_ricevute.py
+"""
+Esportazione delle ricevute dei pagamenti filtrati in un archivio ZIP
+(un PDF per ricevuta) o in un unico PDF.
+I pagamenti vengono caricati a blocchi, le ricevute generate in parallelo dal
+servizio PDF e l'output prodotto man mano: la memoria usata non dipende dal
+numero di ricevute esportate.
+"""
+import zipfile
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from models import db, Pagamento
+from utils.unione_pdf import UnionePDF
+from utils.flusso_zip import FlussoZip
+
+# Pagamenti caricati per ogni query
+BLOCCO_CARICAMENTO = 200
+
+
+def ids_ricevute(filtro):
+    """Id dei pagamenti incassati che rispettano i filtri della lista, in ordine di incasso"""
+    query = db.session.query(Pagamento.id).select_from(Pagamento)
+    if filtro.richiede_join:
+        query = query.join(Pagamento.cliente).join(Pagamento.corso)
+    query = query.filter(*filtro.criteri(), Pagamento.pagato == True) \
+        .order_by(Pagamento.data_pagamento, Pagamento.numero_ricevuta, Pagamento.id)
+    return [riga[0] for riga in query]
+
+
+def pagamenti_a_blocchi(ids):
+    """
+    Pagamenti (con cliente e corso) nell'ordine degli id, caricati a blocchi:
+    ogni query è breve e non tiene aperta una lettura sul database per tutta
+    la durata dell'esportazione.
+    """
+    for inizio in range(0, len(ids), BLOCCO_CARICAMENTO):
+        blocco = ids[inizio:inizio + BLOCCO_CARICAMENTO]
+        caricati = {
+            pagamento.id: pagamento
+            for pagamento in Pagamento.query
+                .options(joinedload(Pagamento.cliente), joinedload(Pagamento.corso))
+                .filter(Pagamento.id.in_(blocco))
+        }
+        for pagamento_id in blocco:
+            # Un pagamento eliminato nel frattempo viene saltato
+            if pagamento_id in caricati:
+                yield caricati[pagamento_id]
+
+
+def _descrizione_errore(pagamento, filename, errore):
+    descrizione = f"{filename} ({pagamento.cliente.nome_completo}, {pagamento.periodo}): {errore}"
+    print(f"❌ Esportazione ricevute: {descrizione}")
+    return descrizione
+
+
+def stream_zip(risultati):
+    """
+    Archivio ZIP scritto in streaming dai risultati di genera_ricevute_pdf.
+    Le ricevute non generate sono elencate in ERRORI.txt in fondo all'archivio.
+    """
+    flusso = FlussoZip()
+    nomi = set()
+    errori = []
+    with zipfile.ZipFile(flusso, 'w', compression=zipfile.ZIP_DEFLATED) as archivio:
+        for pagamento, pdf_content, filename, errore in risultati:
+            if errore:
+                errori.append(_descrizione_errore(pagamento, filename, errore))
+                continue
+
+            # Stesso numero di ricevuta in anni diversi
+            nome = filename
+            if nome in nomi:
+                nome = f"{filename[:-4]}-ID{pagamento.id}.pdf"
+            nomi.add(nome)
+
+            # data_pagamento può mancare (dati importati o modificati fuori dal form)
+            data_file = pagamento.data_pagamento or pagamento.data_creazione or datetime.now()
+            info = zipfile.ZipInfo(nome, date_time=data_file.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archivio.writestr(info, pdf_content)
+            yield flusso.preleva()
+
+        if errori:
+            archivio.writestr('ERRORI.txt', '\n'.join(errori) + '\n')
+    yield flusso.preleva()
+
+
+def stream_pdf_unico(risultati):
+    """PDF unico scritto in streaming dai risultati di genera_ricevute_pdf"""
+    unione = UnionePDF()
+    yield unione.intestazione()
+    for pagamento, pdf_content, filename, errore in risultati:
+        if errore:
+            _descrizione_errore(pagamento, filename, errore)
+            continue
+        yield unione.aggiungi(pdf_content)
+    yield unione.chiudi()
@@ -0,0 +1,179 @@
+# utils/filtri_pagamenti.py
+from datetime import datetime
+from sqlalchemy.orm import contains_eager
+from models import db, Cliente, Corso, Pagamento
+from utils.periodi import intervallo_da_parametri, filtro_intervallo
+from utils.paginazione import Chiave
+
+
+class FiltroPagamenti:
+    """
+    Specifica dei filtri della lista pagamenti, definita in un solo punto.
+    La stessa specifica costruisce la query della lista e quella dei totali.
+    """
+
+    def __init__(self, mese=None, anno=None, giorno=None, tipo_filtro_data='periodo',
+                 cliente_id=None, corso_id=None, metodo_pagamento='', search='', stato='tutti',
+                 data_specifica=None):
+        self.mese = mese
+        self.anno = anno
+        self.giorno = giorno
+        self.tipo_filtro_data = tipo_filtro_data if tipo_filtro_data in ['periodo', 'data_pagamento'] else 'periodo'
+        self.cliente_id = cliente_id
+        self.corso_id = corso_id
+        self.metodo_pagamento = metodo_pagamento
+        self.search = search
+        self.stato = stato
+        self.data_specifica = data_specifica
+
+    @classmethod
+    def da_richiesta(cls, args):
+        """Costruisce la specifica dai parametri della query string"""
+        mese = args.get('mese', type=int)
+        anno = args.get('anno', type=int)
+        giorno = args.get('giorno', type=int)
+        data_specifica = args.get('data_specifica')  # HTML5 date input formato YYYY-MM-DD
+
+        # Se viene fornita data_specifica, sovrascrive giorno/mese/anno
+        if data_specifica:
+            try:
+                data_obj = datetime.strptime(data_specifica, '%Y-%m-%d')
+                giorno = data_obj.day
+                mese = data_obj.month
+                anno = data_obj.year
+            except (ValueError, TypeError):
+                data_specifica = None
+
+        return cls(
+            mese=mese,
+            anno=anno,
+            giorno=giorno,
+            tipo_filtro_data=args.get('tipo_filtro_data', 'periodo'),
+            cliente_id=args.get('cliente_id', type=int),
+            corso_id=args.get('corso_id', type=int),
+            metodo_pagamento=args.get('metodo_pagamento', ''),
+            search=args.get('search', ''),
+            stato=args.get('stato', 'tutti'),
+            data_specifica=data_specifica
+        )
+
+    @property
+    def intervallo_giorno(self):
+        """Intervallo del giorno selezionato, se giorno/mese/anno formano una data valida"""
+        if self.giorno and self.mese and self.anno:
+            return intervallo_da_parametri(self.giorno, self.mese, self.anno)
+        return None
+
+    @property
+    def richiede_join(self):
+        """La ricerca testuale filtra anche su cliente e corso"""
+        return bool(self.search)
+
+    def criteri(self):
+        """Lista dei criteri SQL corrispondenti ai filtri attivi"""
+        criteri = []
+
+        # Filtri temporali basati su tipo_filtro_data
+        if self.tipo_filtro_data == 'periodo':
+            # Filtra per periodo di competenza (mese/anno del pagamento)
+            if self.mese:
+                criteri.append(Pagamento.mese == self.mese)
+            if self.anno:
+                criteri.append(Pagamento.anno == self.anno)
+            # Con il giorno specifico filtra anche per data_pagamento (compatibilità)
+            if self.intervallo_giorno:
+                criteri.extend(filtro_intervallo(Pagamento.data_pagamento, self.intervallo_giorno))
+        else:
+            # Filtra per data effettiva di pagamento: giorno, mese/anno o solo anno
+            intervallo = intervallo_da_parametri(self.giorno, self.mese, self.anno)
+            if intervallo:
+                criteri.extend(filtro_intervallo(Pagamento.data_pagamento, intervallo))
+
+        if self.cliente_id:
+            criteri.append(Pagamento.cliente_id == self.cliente_id)
+        if self.corso_id:
+            criteri.append(Pagamento.corso_id == self.corso_id)
+        if self.metodo_pagamento:
+            criteri.append(Pagamento.metodo_pagamento == self.metodo_pagamento)
+
+        # Ricerca live
+        if self.search:
+            criteri.append(
+                (Cliente.nome.contains(self.search)) |
+                (Cliente.cognome.contains(self.search)) |
+                (Corso.nome.contains(self.search)) |
+                (Pagamento.metodo_pagamento.contains(self.search)) |
+                (Pagamento.note.contains(self.search))
+            )
+
+        # Filtro stato pagamento
+        if self.stato == 'pagati':
+            criteri.append(Pagamento.pagato == True)
+        elif self.stato == 'non_pagati':
+            criteri.append(Pagamento.pagato == False)
+
+        return criteri
+
+    def query(self):
+        """Query della lista: pagamenti filtrati con cliente e corso caricati dalla stessa join"""
+        return Pagamento.query.join(Pagamento.cliente).join(Pagamento.corso) \
+            .options(contains_eager(Pagamento.cliente), contains_eager(Pagamento.corso)) \
+            .filter(*self.criteri())
+
+    def totali(self):
+        """
+        Calcola con un'unica istruzione (aggregazione condizionale) incassato,
+        da incassare, complessivo, numero di pagamenti e incassato del giorno.
+        """
+        colonne = [
+            db.func.coalesce(db.func.sum(db.case((Pagamento.pagato == True, Pagamento.importo), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case((Pagamento.pagato == False, Pagamento.importo), else_=0)), 0),
+            db.func.coalesce(db.func.sum(Pagamento.importo), 0),
+            db.func.count(Pagamento.id)
+        ]
+
+        # Incassato del giorno (indipendente dagli altri filtri) come sottoquery scalare
+        if self.intervallo_giorno:
+            pagati_giorno = db.aliased(Pagamento)
+            colonne.append(
+                db.select(db.func.coalesce(db.func.sum(pagati_giorno.importo), 0))
+                .where(*filtro_intervallo(pagati_giorno.data_pagamento, self.intervallo_giorno),
+                       pagati_giorno.pagato == True)
+                .scalar_subquery()
+            )
+
+        query = db.session.query(*colonne).select_from(Pagamento)
+        if self.richiede_join:
+            query = query.join(Pagamento.cliente).join(Pagamento.corso)
+        riga = query.filter(*self.criteri()).one()
+
+        return {
+            'totale_incassato': riga[0],
+            'totale_da_incassare': riga[1],
+            'totale_complessivo': riga[2],
+            'numero_pagamenti': riga[3],
+            'totale_giornaliero': riga[4] if self.intervallo_giorno else 0
+        }
+
+
+def ordinamento_pagamenti(sort_by, sort_order):
+    """Chiavi di ordinamento della lista pagamenti; l'id finale rende l'ordine univoco"""
+    discendente = sort_order == 'desc'
+
+    if sort_by == 'periodo':
+        chiavi = [Chiave(Pagamento.anno, discendente), Chiave(Pagamento.mese, discendente)]
+    elif sort_by == 'cliente':
+        chiavi = [
+            Chiave(Cliente.cognome, discendente, lambda p: p.cliente.cognome),
+            Chiave(Cliente.nome, False, lambda p: p.cliente.nome)
+        ]
+    elif sort_by == 'corso':
+        chiavi = [Chiave(Corso.nome, discendente, lambda p: p.corso.nome)]
+    elif sort_by == 'stato':
+        chiavi = [Chiave(Pagamento.pagato, discendente)]
+    elif sort_by in ['numero_ricevuta', 'importo', 'data_pagamento']:
+        chiavi = [Chiave(getattr(Pagamento, sort_by), discendente)]
+    else:  # data_creazione (default)
+        chiavi = [Chiave(Pagamento.data_creazione, discendente)]
+
+    return chiavi + [Chiave(Pagamento.id, discendente)]
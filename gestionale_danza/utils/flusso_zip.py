@@ -0,0 +1,25 @@
+# utils/flusso_zip.py
+"""
+Destinazione per gli archivi ZIP scritti in streaming (esportazione delle
+ricevute, backup): zipfile vi scrive i byte compressi e chi produce la
+risposta li preleva a ogni blocco, senza tenere l'archivio in memoria.
+"""
+
+
+class FlussoZip:
+    """File di sola scrittura che accumula i byte fino al prelievo successivo"""
+
+    def __init__(self):
+        self._parti = []
+
+    def write(self, dati):
+        self._parti.append(bytes(dati))
+        return len(dati)
+
+    def flush(self):
+        pass
+
+    def preleva(self):
+        dati = b''.join(self._parti)
+        self._parti = []
+        return dati
@@ -0,0 +1,140 @@
+# utils/invio_ricevute.py
+"""
+Invio massivo delle ricevute per email.
+Dai pagamenti incassati che rispettano i filtri della lista viene accodato un
+solo messaggio per cliente con tutte le sue ricevute. In coda finiscono solo
+testo e riferimenti ai pagamenti: i PDF vengono generati (in parallelo) dal
+worker della coda al momento dell'invio, quindi la memoria usata non dipende
+dal numero di ricevute. Tutti i messaggi dello stesso invio hanno lo stesso
+`lotto`, usato per seguirne l'avanzamento.
+"""
+import uuid
+from itertools import groupby
+from sqlalchemy import false
+from sqlalchemy.orm import joinedload
+from models import db, Pagamento, Cliente, MessaggioEmail, messaggi_email_pagamenti
+from utils.coda_email import accoda_email
+from utils.stampa_pdf import numero_ricevuta_formattato
+
+# Clienti i cui messaggi vengono composti con la stessa query
+BLOCCO_CLIENTI = 200
+
+
+def _pagamenti_per_cliente(filtro, con_email=True):
+    """Query (cliente_id, pagamento_id) dei pagamenti incassati filtrati"""
+    query = db.session.query(Pagamento.cliente_id, Pagamento.id).select_from(Pagamento) \
+        .join(Pagamento.cliente)
+    if filtro.richiede_join:
+        query = query.join(Pagamento.corso)
+    query = query.filter(*filtro.criteri(), Pagamento.pagato == True)
+    if con_email:
+        query = query.filter(Cliente.email.isnot(None), Cliente.email != '')
+    else:
+        query = query.filter((Cliente.email.is_(None)) | (Cliente.email == ''))
+    return query
+
+
+def _firma(settings):
+    righe = [settings.denominazione_sociale or '']
+    if settings.indirizzo_completo:
+        righe.append(settings.indirizzo_completo)
+    if settings.telefono:
+        righe.append(f'Tel: {settings.telefono}')
+    if settings.email:
+        righe.append(f'Email: {settings.email}')
+    return '\n'.join(righe)
+
+
+def componi_email_ricevute(cliente, pagamenti, settings):
+    """Oggetto e testo dell'email con le ricevute di un cliente"""
+    if len(pagamenti) == 1:
+        pagamento = pagamenti[0]
+        oggetto = f"Ricevuta Pagamento #{numero_ricevuta_formattato(pagamento)} - {settings.denominazione_sociale}"
+        introduzione = f"In allegato troverà la ricevuta per il pagamento del corso {pagamento.corso.nome}."
+    else:
+        oggetto = f"Ricevute Pagamenti ({len(pagamenti)}) - {settings.denominazione_sociale}"
+        introduzione = f"In allegato troverà le ricevute dei seguenti {len(pagamenti)} pagamenti."
+
+    dettagli = '\n'.join(
+        f"- Ricevuta #{numero_ricevuta_formattato(p)}: {p.corso.nome}, {p.periodo}, "
+        f"{p.importo:,.2f} €, pagato il {p.data_pagamento.strftime('%d/%m/%Y') if p.data_pagamento else 'N/D'}"
+        for p in pagamenti
+    )
+
+    corpo = f"""Gentile {cliente.nome_completo},
+
+{introduzione}
+
+Dettagli:
+{dettagli}
+
+Grazie per aver scelto {settings.denominazione_sociale}!
+
+---
+{_firma(settings)}
+"""
+    return oggetto, corpo
+
+
+def accoda_ricevute(filtro, settings, reinvia=False):
+    """
+    Accoda un messaggio per cliente con le ricevute dei pagamenti filtrati.
+    Salta le ricevute già in coda e, salvo `reinvia`, quelle già inviate.
+    Non fa commit.
+    Restituisce (lotto, messaggi, ricevute, gia_in_coda, gia_inviate, senza_email).
+    """
+    lotto = uuid.uuid4().hex
+
+    # Solo id in memoria, raggruppati per cliente; lo stato delle ricevute
+    # già accodate o inviate viene dalla stessa query
+    in_attesa = MessaggioEmail.ricevuta_in_stato(Pagamento.id, MessaggioEmail.STATI_IN_ATTESA)
+    inviata = false() if reinvia else MessaggioEmail.ricevuta_in_stato(Pagamento.id, MessaggioEmail.STATI_INVIATI)
+    righe = _pagamenti_per_cliente(filtro).add_columns(in_attesa, inviata).order_by(
+        Pagamento.cliente_id, Pagamento.data_pagamento, Pagamento.numero_ricevuta, Pagamento.id
+    )
+    gruppi = []
+    gia_in_coda = 0
+    gia_inviate = 0
+    for cliente_id, gruppo in groupby(righe, key=lambda riga: riga[0]):
+        da_inviare = []
+        for _, pid, pid_in_attesa, pid_inviata in gruppo:
+            if pid_in_attesa:
+                gia_in_coda += 1
+            elif pid_inviata:
+                gia_inviate += 1
+            else:
+                da_inviare.append(pid)
+        if da_inviare:
+            gruppi.append((cliente_id, da_inviare))
+
+    senza_email = _pagamenti_per_cliente(filtro, con_email=False).count()
+
+    messaggi = 0
+    ricevute = 0
+    for inizio in range(0, len(gruppi), BLOCCO_CLIENTI):
+        blocco = gruppi[inizio:inizio + BLOCCO_CLIENTI]
+        pagamenti = {
+            pagamento.id: pagamento
+            for pagamento in Pagamento.query
+                .options(joinedload(Pagamento.cliente), joinedload(Pagamento.corso))
+                .filter(Pagamento.id.in_([pid for _, ids in blocco for pid in ids]))
+        }
+
+        nuovi = []
+        for cliente_id, ids in blocco:
+            pagamenti_cliente = [pagamenti[pid] for pid in ids]
+            cliente = pagamenti_cliente[0].cliente
+            oggetto, corpo = componi_email_ricevute(cliente, pagamenti_cliente, settings)
+            messaggio = accoda_email(MessaggioEmail.TIPO_RICEVUTA, cliente.email, oggetto, corpo, lotto=lotto)
+            nuovi.append((messaggio, ids))
+        db.session.flush()
+
+        collegamenti = [
+            {'messaggio_id': messaggio.id, 'pagamento_id': pid}
+            for messaggio, ids in nuovi for pid in ids
+        ]
+        db.session.execute(messaggi_email_pagamenti.insert(), collegamenti)
+        messaggi += len(nuovi)
+        ricevute += len(collegamenti)
+
+    return lotto, messaggi, ricevute, gia_in_coda, gia_inviate, senza_email
@@ -0,0 +1,90 @@
+# utils/invio_smtp.py
+"""
+Invio di più email sulla stessa connessione SMTP.
+Ogni email.send() di Flask-Mailman apre una connessione, ripete handshake TLS
+e login e la chiude: per gli invii massivi InvioSMTP apre una sola connessione
+autenticata e la riusa per i messaggi successivi, fino al limite per
+connessione di Settings.mail_max_emails (molti provider chiudono la sessione
+oltre un certo numero di messaggi). Raggiunto il limite, o se il server chiude
+la connessione inattiva, ne apre una nuova in modo trasparente.
+"""
+import smtplib
+from flask import current_app
+
+
+class InvioSMTP:
+    """
+    Uso:
+        with InvioSMTP(settings.mail_max_emails) as smtp:
+            for email in messaggi:
+                smtp.invia(email)
+    """
+
+    def __init__(self, max_per_connessione=None):
+        # None o 0: nessun limite
+        self.max_per_connessione = max_per_connessione or None
+        self._connessione = None
+        self._inviati_connessione = 0
+        self.connessioni = 0
+        self.inviati = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+    @property
+    def aperta(self):
+        return self._connessione is not None
+
+    def _apri(self):
+        connessione = current_app.extensions['mailman'].get_connection()
+        connessione.open()
+        self._connessione = connessione
+        self._inviati_connessione = 0
+        self.connessioni += 1
+
+    def chiudi(self):
+        if self._connessione is None:
+            return
+        connessione, self._connessione = self._connessione, None
+        try:
+            connessione.close()
+        except (smtplib.SMTPException, OSError):
+            # Connessione già persa: niente da chiudere
+            pass
+
+    def invia(self, email):
+        """Invia un'email sulla connessione corrente; solleva le eccezioni SMTP"""
+        if self._connessione is not None and self.max_per_connessione \
+                and self._inviati_connessione >= self.max_per_connessione:
+            self.chiudi()
+        if self._connessione is None:
+            self._apri()
+
+        try:
+            self._connessione.send_messages([email])
+        except smtplib.SMTPServerDisconnected:
+            # Il server ha chiuso la connessione (inattività, limite raggiunto):
+            # il messaggio non è stato accettato, si riprova una volta su una nuova
+            self.chiudi()
+            self._apri()
+            self._invia_o_chiudi(email)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+            # Messaggio rifiutato: la connessione resta utilizzabile
+            raise
+        except Exception:
+            # Stato della connessione sconosciuto: la prossima email ne apre una nuova
+            self.chiudi()
+            raise
+
+        self._inviati_connessione += 1
+        self.inviati += 1
+
+    def _invia_o_chiudi(self, email):
+        try:
+            self._connessione.send_messages([email])
+        except Exception:
+            self.chiudi()
+            raise
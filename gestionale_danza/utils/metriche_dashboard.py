@@ -0,0 +1,142 @@
+# utils/metriche_dashboard.py
+"""
+Metriche della dashboard (conteggi, totali del mese, andamento incassi degli
+ultimi 12 mesi) lette con una sola query aggregata su riepilogo_mensile.
+Il risultato resta in cache nel processo per pochi secondi: la dashboard è la
+pagina aperta più spesso e non serve ricalcolarla a ogni visita. Un commit
+che modifica pagamenti, clienti, corsi o insegnanti invalida subito la cache
+del processo che lo esegue; gli altri worker si riallineano alla scadenza.
+
+Configurazione da ambiente:
+- DASHBOARD_CACHE_SECONDS: durata della cache in secondi (default 30, 0 = disattivata)
+"""
+import os
+import time
+import threading
+from datetime import date
+from sqlalchemy import event, text
+
+# Mesi mostrati nell'andamento, compreso quello corrente
+MESI_ANDAMENTO = 12
+
+# Una riga per mese (dal più vecchio al corrente), con i conteggi come
+# sottoquery non correlate, valutate una sola volta
+QUERY_METRICHE = text("""
+    WITH RECURSIVE periodi(n, anno, mese) AS (
+        SELECT 1, :anno, :mese
+        UNION ALL
+        SELECT n + 1,
+               CASE WHEN mese = 1 THEN anno - 1 ELSE anno END,
+               CASE WHEN mese = 1 THEN 12 ELSE mese - 1 END
+        FROM periodi WHERE n < :mesi
+    )
+    SELECT p.anno, p.mese,
+           COALESCE(SUM(r.incassato), 0) AS incassato,
+           COALESCE(SUM(r.da_incassare), 0) AS da_incassare,
+           (SELECT COUNT(*) FROM clienti WHERE attivo = 1) AS clienti_attivi,
+           (SELECT COUNT(*) FROM corsi) AS corsi,
+           (SELECT COUNT(*) FROM insegnanti) AS insegnanti
+    FROM periodi p
+    LEFT JOIN riepilogo_mensile r ON r.anno = p.anno AND r.mese = p.mese
+    GROUP BY p.anno, p.mese
+    ORDER BY p.anno, p.mese
+""")
+
+# Modelli le cui modifiche cambiano le metriche
+TABELLE_METRICHE = {'pagamenti', 'clienti', 'corsi', 'insegnanti'}
+
+
+def calcola_metriche(session, oggi=None):
+    """Esegue la query aggregata e restituisce il dizionario delle metriche"""
+    oggi = oggi or date.today()
+    righe = session.execute(QUERY_METRICHE, {
+        'anno': oggi.year, 'mese': oggi.month, 'mesi': MESI_ANDAMENTO
+    }).all()
+    corrente = righe[-1]
+    return {
+        'total_clienti': corrente.clienti_attivi,
+        'total_corsi': corrente.corsi,
+        'total_insegnanti': corrente.insegnanti,
+        'mese_corrente': oggi.month,
+        'anno_corrente': oggi.year,
+        'incasso_mese': corrente.incassato,
+        'debiti_mese': corrente.da_incassare,
+        'andamento': tuple(
+            {'anno': riga.anno, 'mese': riga.mese, 'incassato': riga.incassato, 'da_incassare': riga.da_incassare}
+            for riga in righe
+        ),
+    }
+
+
+class MetricheDashboard:
+    """Cache per processo delle metriche, con scadenza e invalidazione esplicita"""
+
+    def __init__(self, db, durata):
+        self.db = db
+        self.durata = durata
+        self._lock = threading.Lock()
+        self._valori = None
+        self._periodo = None
+        self._scadenza = 0.0
+
+    def leggi(self):
+        oggi = date.today()
+        with self._lock:
+            if self._valori is not None and self._periodo == oggi \
+                    and time.monotonic() < self._scadenza:
+                return self._valori
+            valori = calcola_metriche(self.db.session, oggi)
+            if self.durata > 0:
+                self._valori = valori
+                self._periodo = oggi
+                self._scadenza = time.monotonic() + self.durata
+            return valori
+
+    def invalida(self):
+        with self._lock:
+            self._valori = None
+
+    # Eventi di sessione: le modifiche vengono annotate durante il flush (o
+    # nelle INSERT/UPDATE/DELETE ORM massive) e applicate solo al commit
+
+    @staticmethod
+    def _tocca_metriche(oggetti):
+        return any(getattr(oggetto, '__tablename__', None) in TABELLE_METRICHE for oggetto in oggetti)
+
+    def _dopo_flush(self, session, flush_context):
+        if self._tocca_metriche(session.new) or self._tocca_metriche(session.dirty) \
+                or self._tocca_metriche(session.deleted):
+            session.info['metriche_dashboard_modificate'] = True
+
+    def _esecuzione_orm(self, stato):
+        if (stato.is_insert or stato.is_update or stato.is_delete) and stato.bind_mapper is not None \
+                and stato.bind_mapper.local_table.name in TABELLE_METRICHE:
+            stato.session.info['metriche_dashboard_modificate'] = True
+
+    def _dopo_commit(self, session):
+        if session.info.pop('metriche_dashboard_modificate', False):
+            self.invalida()
+
+    def _dopo_rollback(self, session, transazione_precedente):
+        session.info.pop('metriche_dashboard_modificate', None)
+
+    def registra_eventi(self):
+        event.listen(self.db.session, 'after_flush', self._dopo_flush)
+        event.listen(self.db.session, 'do_orm_execute', self._esecuzione_orm)
+        event.listen(self.db.session, 'after_commit', self._dopo_commit)
+        event.listen(self.db.session, 'after_soft_rollback', self._dopo_rollback)
+
+
+def init_metriche_dashboard(app, db):
+    """
+    Crea la cache delle metriche e la registra in app.extensions['metriche_dashboard'].
+    Con DASHBOARD_CACHE_SECONDS=0 le metriche vengono ricalcolate a ogni richiesta.
+    """
+    try:
+        durata = float(os.environ.get('DASHBOARD_CACHE_SECONDS', 30))
+    except ValueError:
+        durata = 30
+    metriche = MetricheDashboard(db, max(durata, 0))
+    metriche.registra_eventi()
+    app.extensions['metriche_dashboard'] = metriche
+    return metriche
@@ -0,0 +1,195 @@
+# utils/paginazione.py
+"""
+Paginazione keyset (seek): la pagina successiva/precedente si individua con
+una condizione sulle chiavi di ordinamento dell'ultimo/primo elemento
+invece che con OFFSET, quindi costa uguale a qualunque profondità.
+Il cursore è opaco (JSON in base64) e porta con sé anche il numero di pagina
+e il totale, così le pagine successive non ripetono il COUNT(*).
+"""
+import base64
+import hashlib
+import json
+from datetime import date, datetime
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import and_, or_, false, literal
+
+
+class Chiave:
+    """Chiave di ordinamento: colonna, direzione e come leggerne il valore da un elemento"""
+
+    def __init__(self, colonna, discendente=False, valore=None):
+        self.colonna = colonna
+        self.discendente = discendente
+        self.valore = valore or (lambda item: getattr(item, colonna.key))
+        self.nullable = getattr(colonna.expression, 'nullable', True)
+
+    def ordine(self, inverti=False):
+        discendente = self.discendente != inverti
+        return self.colonna.desc() if discendente else self.colonna.asc()
+
+
+def _codifica_valore(valore):
+    if isinstance(valore, datetime):
+        return {'dt': valore.isoformat()}
+    if isinstance(valore, date):
+        return {'d': valore.isoformat()}
+    return valore
+
+
+def _decodifica_valore(valore):
+    if isinstance(valore, dict):
+        if 'dt' in valore:
+            return datetime.fromisoformat(valore['dt'])
+        if 'd' in valore:
+            return date.fromisoformat(valore['d'])
+        raise ValueError('Valore cursore non valido')
+    return valore
+
+
+def _firma(chiavi):
+    """
+    Identifica l'ordinamento, per scartare cursori creati con un ordinamento
+    diverso. È un hash breve: le chiavi possono essere espressioni SQL lunghe
+    (es. la priorità della ricerca clienti) che non devono finire nell'URL.
+    """
+    ordinamento = ','.join(f"{chiave.colonna}:{'d' if chiave.discendente else 'a'}" for chiave in chiavi)
+    return hashlib.sha1(ordinamento.encode()).hexdigest()[:16]
+
+
+def codifica_cursore(chiavi, item, direzione, pagina, totale):
+    dati = {
+        's': _firma(chiavi),
+        'd': direzione,
+        'p': pagina,
+        't': totale,
+        'k': [_codifica_valore(chiave.valore(item)) for chiave in chiavi]
+    }
+    return base64.urlsafe_b64encode(json.dumps(dati, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decodifica_cursore(chiavi, cursore):
+    """Restituisce il cursore decodificato, oppure None se non valido per questo ordinamento"""
+    if not cursore:
+        return None
+    try:
+        padding = '=' * (-len(cursore) % 4)
+        dati = json.loads(base64.urlsafe_b64decode(cursore + padding))
+        if dati['s'] != _firma(chiavi) or dati['d'] not in ('n', 'p') or len(dati['k']) != len(chiavi):
+            return None
+        dati['k'] = [_decodifica_valore(valore) for valore in dati['k']]
+        dati['p'] = max(int(dati['p']), 1)
+        dati['t'] = int(dati['t']) if dati['t'] is not None else None
+        return dati
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def condizione_dopo(chiavi, valori, inverti=False):
+    """
+    Condizione "viene dopo (valori)" nell'ordinamento delle chiavi.
+    Segue l'ordine di SQLite: NULL prima in ordine crescente, dopo in decrescente.
+    """
+    if not chiavi:
+        return false()
+
+    chiave, valore = chiavi[0], valori[0]
+    colonna = chiave.colonna
+    discendente = chiave.discendente != inverti
+
+    if valore is None:
+        successivo = false() if discendente else colonna.isnot(None)
+        uguale = colonna.is_(None)
+    else:
+        # literal tipizzato: SQLAlchemy non ammette < e > con True/False nudi
+        valore = literal(valore, colonna.type)
+        successivo = colonna < valore if discendente else colonna > valore
+        if discendente and chiave.nullable:
+            successivo = or_(successivo, colonna.is_(None))
+        uguale = colonna == valore
+
+    if len(chiavi) == 1:
+        return successivo
+    return or_(successivo, and_(uguale, condizione_dopo(chiavi[1:], valori[1:], inverti)))
+
+
+class PaginazioneKeyset(Pagination):
+    """
+    Paginazione compatibile con flask_sqlalchemy.Pagination (stessi attributi
+    usati dai template) che aggiunge i cursori prev_cursor/next_cursor.
+    Con un cursore valido la pagina è letta con keyset, altrimenti con OFFSET
+    a partire dal numero di pagina (link numerati).
+    Il totale può essere passato (es. già calcolato), ereditato dal cursore
+    oppure contato solo sulla prima richiesta.
+    """
+
+    def __init__(self, query, chiavi, page=1, per_page=25, cursore=None, totale=None, conta=True):
+        self._chiavi = chiavi
+        self._cursore = decodifica_cursore(chiavi, cursore)
+        self._precedenti = False
+        self._successivi = False
+
+        if self._cursore:
+            page = self._cursore['p']
+            if totale is None:
+                totale = self._cursore['t']
+
+        super().__init__(
+            page=page,
+            per_page=per_page,
+            max_per_page=None,
+            error_out=False,
+            count=totale is None and conta,
+            query=query
+        )
+        if totale is not None:
+            self.total = totale
+
+    def _query_items(self):
+        query = self._query_args['query']
+
+        if not self._cursore:
+            # Accesso diretto a una pagina: OFFSET
+            items = query.order_by(*[chiave.ordine() for chiave in self._chiavi]) \
+                .limit(self.per_page + 1).offset((self.page - 1) * self.per_page).all()
+            self._precedenti = self.page > 1
+            self._successivi = len(items) > self.per_page
+            return items[:self.per_page]
+
+        indietro = self._cursore['d'] == 'p'
+        items = query.filter(condizione_dopo(self._chiavi, self._cursore['k'], inverti=indietro)) \
+            .order_by(*[chiave.ordine(inverti=indietro) for chiave in self._chiavi]) \
+            .limit(self.per_page + 1).all()
+        altri = len(items) > self.per_page
+        items = items[:self.per_page]
+
+        if indietro:
+            items.reverse()
+            self._precedenti = altri and self.page > 1
+            self._successivi = True
+        else:
+            self._precedenti = self.page > 1
+            self._successivi = altri
+        return items
+
+    def _query_count(self):
+        return self._query_args['query'].order_by(None).count()
+
+    @property
+    def has_prev(self):
+        return self._precedenti and bool(self.items)
+
+    @property
+    def has_next(self):
+        return self._successivi and bool(self.items)
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev:
+            return None
+        return codifica_cursore(self._chiavi, self.items[0], 'p', self.page - 1, self.total)
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return codifica_cursore(self._chiavi, self.items[-1], 'n', self.page + 1, self.total)
@@ -0,0 +1,49 @@
+# utils/periodi.py
+"""
+Filtri per data come intervalli semiaperti [inizio, fine).
+A differenza di date()/extract() sulla colonna, un confronto per intervallo
+può usare l'indice su pagamenti.data_pagamento.
+"""
+from datetime import date, datetime, timedelta
+
+
+def intervallo_giorno(giorno):
+    """Intervallo [00:00 del giorno, 00:00 del giorno successivo)"""
+    inizio = datetime(giorno.year, giorno.month, giorno.day)
+    return inizio, inizio + timedelta(days=1)
+
+
+def intervallo_mese(anno, mese):
+    """Intervallo [primo del mese, primo del mese successivo)"""
+    inizio = datetime(anno, mese, 1)
+    if mese == 12:
+        return inizio, datetime(anno + 1, 1, 1)
+    return inizio, datetime(anno, mese + 1, 1)
+
+
+def intervallo_anno(anno):
+    """Intervallo [1 gennaio, 1 gennaio dell'anno successivo)"""
+    return datetime(anno, 1, 1), datetime(anno + 1, 1, 1)
+
+
+def intervallo_da_parametri(giorno=None, mese=None, anno=None):
+    """
+    Restituisce l'intervallo più stretto individuato da giorno/mese/anno,
+    oppure None se i parametri non bastano o non formano una data valida.
+    """
+    try:
+        if giorno and mese and anno:
+            return intervallo_giorno(date(anno, mese, giorno))
+        if mese and anno:
+            return intervallo_mese(anno, mese)
+        if anno:
+            return intervallo_anno(anno)
+    except (ValueError, TypeError, OverflowError):
+        pass
+    return None
+
+
+def filtro_intervallo(colonna, intervallo):
+    """Criteri SQL inizio <= colonna < fine"""
+    inizio, fine = intervallo
+    return [colonna >= inizio, colonna < fine]
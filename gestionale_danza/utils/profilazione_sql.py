@@ -0,0 +1,181 @@
+# utils/profilazione_sql.py
+"""
+Profilazione delle query SQL per richiesta (opzionale, SQL_PROFILING=True).
+Agganciata agli eventi dell'engine SQLAlchemy: conta le istruzioni, somma il
+tempo passato nel database e tiene le più lente di ogni richiesta.
+I dati finiscono nell'header Server-Timing, in un buffer delle ultime
+richieste (letto dall'endpoint admin) e, oltre la soglia configurata,
+nel log rotante delle query lente.
+"""
+import os
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+# Istruzioni più lente conservate per ogni richiesta
+MAX_QUERY_LENTE_RICHIESTA = 5
+# Lunghezza massima di istruzioni e parametri nei dati esposti e nel log
+MAX_LUNGHEZZA_TESTO = 1000
+
+
+def _tronca(testo):
+    testo = ' '.join(str(testo).split())
+    if len(testo) > MAX_LUNGHEZZA_TESTO:
+        return testo[:MAX_LUNGHEZZA_TESTO] + '...'
+    return testo
+
+
+class StatisticheRichiesta:
+    """Statistiche SQL di una singola richiesta"""
+
+    def __init__(self):
+        self.numero_query = 0
+        self.tempo_db = 0.0
+        self._lente = []  # min-heap (durata, progressivo, istruzione)
+
+    def registra(self, istruzione, durata):
+        self.numero_query += 1
+        self.tempo_db += durata
+        voce = (durata, self.numero_query, istruzione)
+        if len(self._lente) < MAX_QUERY_LENTE_RICHIESTA:
+            heapq.heappush(self._lente, voce)
+        elif durata > self._lente[0][0]:
+            heapq.heapreplace(self._lente, voce)
+
+    @property
+    def query_lente(self):
+        return [
+            {'durata_ms': round(durata * 1000, 2), 'istruzione': _tronca(istruzione)}
+            for durata, _, istruzione in sorted(self._lente, reverse=True)
+        ]
+
+    def server_timing(self):
+        return f'db;dur={self.tempo_db * 1000:.2f};desc="{self.numero_query} query"'
+
+
+class ProfilatoreSQL:
+    """Collega gli eventi dell'engine al ciclo di vita delle richieste Flask"""
+
+    def __init__(self, app, db, soglia_lenta_ms=200, file_log=None, max_richieste=200):
+        self.soglia_lenta = soglia_lenta_ms / 1000
+        self.richieste_recenti = deque(maxlen=max_richieste)
+        self._lock = threading.Lock()
+        self.logger = self._crea_logger(file_log) if file_log else None
+
+        with app.app_context():
+            engine = db.engine
+
+        event.listen(engine, 'before_cursor_execute', self._prima_query)
+        event.listen(engine, 'after_cursor_execute', self._dopo_query)
+        app.before_request(self._inizio_richiesta)
+        app.after_request(self._fine_richiesta)
+
+    @staticmethod
+    def _crea_logger(file_log):
+        cartella = os.path.dirname(file_log)
+        if cartella:
+            # Un nome di file semplice va nella cartella corrente
+            os.makedirs(cartella, exist_ok=True)
+        logger = logging.getLogger('gestionale_danza.query_lente')
+        logger.setLevel(logging.WARNING)
+        logger.propagate = False
+        if not logger.handlers:
+            handler = RotatingFileHandler(file_log, maxBytes=5 * 1024 * 1024, backupCount=5, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            logger.addHandler(handler)
+        return logger
+
+    def _prima_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profilazione_inizio', []).append(time.perf_counter())
+
+    def _dopo_query(self, conn, cursor, statement, parameters, context, executemany):
+        inizi = conn.info.get('profilazione_inizio')
+        if not inizi:
+            return
+        durata = time.perf_counter() - inizi.pop()
+
+        endpoint = None
+        if has_request_context():
+            endpoint = request.endpoint
+            statistiche = g.get('statistiche_sql')
+            if statistiche is not None:
+                statistiche.registra(statement, durata)
+
+        if self.logger and durata >= self.soglia_lenta:
+            self.logger.warning(
+                'QUERY LENTA %.1f ms endpoint=%s statement=%s parametri=%s',
+                durata * 1000, endpoint, _tronca(statement), _tronca(parameters)
+            )
+
+    def _inizio_richiesta(self):
+        g.statistiche_sql = StatisticheRichiesta()
+
+    def _fine_richiesta(self, response):
+        statistiche = g.pop('statistiche_sql', None)
+        if statistiche is None:
+            return response
+
+        response.headers.add('Server-Timing', statistiche.server_timing())
+
+        # L'endpoint di consultazione non finisce nei propri dati
+        if request.endpoint != 'admin_statistiche_sql':
+            self.richieste_recenti.append({
+                'data': datetime.now().isoformat(timespec='seconds'),
+                'metodo': request.method,
+                'percorso': request.path,
+                'endpoint': request.endpoint,
+                'stato': response.status_code,
+                'numero_query': statistiche.numero_query,
+                'tempo_db_ms': round(statistiche.tempo_db * 1000, 2),
+                'query_lente': statistiche.query_lente
+            })
+        return response
+
+    def riepilogo(self):
+        """Ultime richieste e aggregato per endpoint, per l'endpoint admin"""
+        richieste = list(self.richieste_recenti)
+
+        per_endpoint = {}
+        for richiesta in richieste:
+            voce = per_endpoint.setdefault(richiesta['endpoint'] or richiesta['percorso'], {
+                'richieste': 0, 'query_totali': 0, 'query_max': 0, 'tempo_db_ms_totale': 0.0
+            })
+            voce['richieste'] += 1
+            voce['query_totali'] += richiesta['numero_query']
+            voce['query_max'] = max(voce['query_max'], richiesta['numero_query'])
+            voce['tempo_db_ms_totale'] = round(voce['tempo_db_ms_totale'] + richiesta['tempo_db_ms'], 2)
+
+        for voce in per_endpoint.values():
+            voce['query_medie'] = round(voce['query_totali'] / voce['richieste'], 1)
+
+        return {
+            'abilitata': True,
+            'soglia_query_lenta_ms': round(self.soglia_lenta * 1000, 2),
+            'per_endpoint': per_endpoint,
+            'richieste_recenti': list(reversed(richieste))
+        }
+
+
+def init_profilazione_sql(app, db, base_path):
+    """
+    Attiva la profilazione se SQL_PROFILING=True. Configurazione da ambiente:
+    SQL_SLOW_QUERY_MS (soglia, default 200) e SQL_SLOW_QUERY_LOG (file del log).
+    Restituisce il profilatore, oppure None se disattivata.
+    """
+    if os.environ.get('SQL_PROFILING', 'False').lower() != 'true':
+        return None
+
+    try:
+        soglia = float(os.environ.get('SQL_SLOW_QUERY_MS', 200))
+    except ValueError:
+        soglia = 200
+    file_log = os.environ.get('SQL_SLOW_QUERY_LOG') or os.path.join(base_path, 'data', 'logs', 'query_lente.log')
+
+    print(f"🔍 Profilazione SQL attiva (soglia query lente: {soglia:g} ms, log: {file_log})")
+    return ProfilatoreSQL(app, db, soglia_lenta_ms=soglia, file_log=file_log)
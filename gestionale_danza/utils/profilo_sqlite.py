@@ -0,0 +1,108 @@
+# utils/profilo_sqlite.py
+"""
+PRAGMA applicati a ogni nuova connessione SQLite dell'app.
+Con i valori predefiniti di SQLite (journal in rollback, synchronous=FULL)
+ogni commit fa un fsync completo e una scrittura blocca anche i lettori, da
+cui gli errori "database is locked" con più utenti. Il profilo predefinito
+usa il journal WAL (lettori e scrittore non si bloccano a vicenda), un
+busy_timeout per attendere il lock invece di fallire, synchronous=NORMAL
+(sicuro in WAL: al massimo si perdono gli ultimi commit in caso di blackout),
+memory map e cache più grandi, tabelle temporanee in memoria e il controllo
+delle chiavi esterne (ON DELETE CASCADE / SET NULL dichiarati sui modelli).
+
+Configurazione da ambiente:
+- SQLITE_TUNING: False per lasciare i PRAGMA predefiniti di SQLite (default True)
+- SQLITE_JOURNAL_MODE: WAL, DELETE, TRUNCATE, PERSIST, MEMORY (default WAL)
+- SQLITE_BUSY_TIMEOUT_MS: attesa massima di un lock in millisecondi (default 5000)
+- SQLITE_SYNCHRONOUS: OFF, NORMAL, FULL, EXTRA (default NORMAL)
+- SQLITE_MMAP_SIZE_MB: memory map del file, 0 = disattivata (default 128)
+- SQLITE_CACHE_SIZE_MB: cache delle pagine per connessione (default 32)
+- SQLITE_TEMP_STORE: DEFAULT, FILE, MEMORY (default MEMORY)
+- SQLITE_FOREIGN_KEYS: controllo delle chiavi esterne (default True)
+"""
+import os
+from sqlalchemy import event
+
+VALORI_AMMESSI = {
+    'journal_mode': {'WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+
+
+def _scelta(nome_env, pragma, predefinito):
+    valore = os.environ.get(nome_env, predefinito).strip().upper()
+    if valore not in VALORI_AMMESSI[pragma]:
+        print(f"⚠️ {nome_env}={valore} non valido, uso {predefinito}")
+        return predefinito
+    return valore
+
+
+def _intero(nome_env, predefinito):
+    try:
+        return max(int(os.environ.get(nome_env, predefinito)), 0)
+    except ValueError:
+        print(f"⚠️ {nome_env} non è un numero intero, uso {predefinito}")
+        return predefinito
+
+
+def profilo_da_ambiente():
+    """
+    PRAGMA da applicare, in ordine, come lista di (nome, valore).
+    Lista vuota con SQLITE_TUNING=False.
+    """
+    if os.environ.get('SQLITE_TUNING', 'True').lower() != 'true':
+        return []
+    return [
+        # busy_timeout per primo: anche il cambio di journal può dover attendere un lock
+        ('busy_timeout', _intero('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        ('journal_mode', _scelta('SQLITE_JOURNAL_MODE', 'journal_mode', 'WAL')),
+        ('synchronous', _scelta('SQLITE_SYNCHRONOUS', 'synchronous', 'NORMAL')),
+        ('mmap_size', _intero('SQLITE_MMAP_SIZE_MB', 128) * 1024 * 1024),
+        # Valore negativo: dimensione in KiB invece che in pagine
+        ('cache_size', -_intero('SQLITE_CACHE_SIZE_MB', 32) * 1024),
+        ('temp_store', _scelta('SQLITE_TEMP_STORE', 'temp_store', 'MEMORY')),
+        ('foreign_keys', 'ON' if os.environ.get('SQLITE_FOREIGN_KEYS', 'True').lower() == 'true' else 'OFF'),
+    ]
+
+
+def applica_profilo(connessione, profilo):
+    """Esegue i PRAGMA su una connessione sqlite3 appena aperta (fuori da transazioni)"""
+    cursor = connessione.cursor()
+    try:
+        for nome, valore in profilo:
+            cursor.execute(f'PRAGMA {nome} = {valore}')
+    finally:
+        cursor.close()
+
+
+def leggi_pragma(connessione, nomi=None):
+    """Valori effettivi dei PRAGMA sulla connessione (per verifiche e benchmark)"""
+    nomi = nomi or [nome for nome, _ in profilo_da_ambiente()] or \
+        ['busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store', 'foreign_keys']
+    cursor = connessione.cursor()
+    try:
+        return {nome: cursor.execute(f'PRAGMA {nome}').fetchone()[0] for nome in nomi}
+    finally:
+        cursor.close()
+
+
+def init_profilo_sqlite(app, db):
+    """
+    Registra l'applicazione del profilo a ogni connessione dell'engine e lo
+    salva in app.extensions['profilo_sqlite']. Va chiamata prima che l'app
+    apra connessioni. Restituisce il profilo (vuoto se disattivato).
+    """
+    profilo = profilo_da_ambiente()
+    app.extensions['profilo_sqlite'] = profilo
+    if not profilo:
+        return profilo
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'connect')
+    def _connessione_aperta(connessione_dbapi, record):
+        applica_profilo(connessione_dbapi, profilo)
+
+    return profilo
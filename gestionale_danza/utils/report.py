@@ -0,0 +1,134 @@
+# utils/report.py
+from datetime import datetime
+from sqlalchemy.orm import undefer
+from models import db, Corso, Insegnante, Pagamento, RiepilogoMensile
+from utils.periodi import intervallo_giorno, filtro_intervallo
+
+
+class ReportCorso:
+    """Riga del report per corso (attributi compatibili con i template)"""
+
+    def __init__(self, corso, insegnante, incasso_corso, numero_pagamenti, filtro_pagamenti, compenso_insegnante=None):
+        self.corso = corso
+        self.insegnante = insegnante
+        self.incasso_corso = incasso_corso
+        self.numero_pagamenti = numero_pagamenti
+        self.percentuale_insegnante = insegnante.percentuale_guadagno  # Manteniamo per compatibilità con report insegnanti
+        if compenso_insegnante is None:
+            compenso_insegnante = incasso_corso * (self.percentuale_insegnante / 100)
+        self.compenso_insegnante = compenso_insegnante
+        self.utile_corso = incasso_corso - self.compenso_insegnante
+        self._filtro_pagamenti = filtro_pagamenti
+        self._pagamenti = None
+
+    @property
+    def pagamenti(self):
+        """Lista dei pagamenti del corso, caricata solo alla prima richiesta"""
+        if self._pagamenti is None:
+            self._pagamenti = Pagamento.query.filter(
+                Pagamento.corso_id == self.corso.id,
+                *self._filtro_pagamenti
+            ).order_by(Pagamento.id).all()
+        return self._pagamenti
+
+    @property
+    def date_ricevute(self):
+        """Date delle ricevute del corso nel periodo"""
+        return [p.data_pagamento.strftime('%d/%m/%Y') for p in self.pagamenti if p.data_pagamento]
+
+
+class ReportInsegnante:
+    """Riga del report per insegnante (aggregata dai report dei corsi)"""
+
+    def __init__(self, insegnante, corsi_insegnante):
+        self.insegnante = insegnante
+        self.compenso_totale = sum(r.compenso_insegnante for r in corsi_insegnante)
+        self.incasso_totale = sum(r.incasso_corso for r in corsi_insegnante)
+        self.percentuale_media = sum(r.percentuale_insegnante for r in corsi_insegnante) / len(corsi_insegnante)
+        self.corsi_nomi = [r.corso.nome for r in corsi_insegnante]
+
+
+def filtro_pagamenti_report(mese_filtro, anno_filtro, data_specifica=None, tipo_report='mensile'):
+    """
+    Restituisce i criteri SQL che selezionano i pagamenti incassati del periodo,
+    oppure None se la data del report giornaliero non è valida.
+    """
+    if tipo_report == 'giornaliero' and data_specifica:
+        try:
+            data_target = datetime.strptime(data_specifica, '%Y-%m-%d').date()
+        except (ValueError, TypeError):
+            return None
+        return [Pagamento.pagato == True, *filtro_intervallo(Pagamento.data_pagamento, intervallo_giorno(data_target))]
+
+    return [Pagamento.mese == mese_filtro, Pagamento.anno == anno_filtro, Pagamento.pagato == True]
+
+
+def genera_report_data(mese_filtro, anno_filtro, data_specifica=None, tipo_report='mensile'):
+    """
+    Genera i dati per i report (usata sia per HTML che per Excel/PDF/email).
+    Il report mensile legge incassi, numero di pagamenti e compensi per corso da
+    riepilogo_mensile (una riga per corso, indipendente dal numero di pagamenti);
+    quello giornaliero li calcola con un'unica query raggruppata sui pagamenti.
+    Le liste dei singoli pagamenti vengono caricate solo se servono.
+    """
+    filtro = filtro_pagamenti_report(mese_filtro, anno_filtro, data_specifica, tipo_report)
+
+    report_corsi = []
+    if filtro is not None and tipo_report == 'giornaliero' and data_specifica:
+        righe = db.session.query(
+            Corso,
+            Insegnante,
+            db.func.sum(Pagamento.importo),
+            db.func.count(Pagamento.id)
+        ).join(Pagamento, Pagamento.corso_id == Corso.id) \
+         .join(Insegnante, Corso.insegnante_id == Insegnante.id) \
+         .options(undefer(Corso.conteggio_iscritti)) \
+         .filter(*filtro) \
+         .group_by(Corso.id, Insegnante.id) \
+         .order_by(Corso.id) \
+         .all()
+        report_corsi = [
+            ReportCorso(corso, insegnante, incasso or 0, numero, filtro)
+            for corso, insegnante, incasso, numero in righe
+        ]
+    elif filtro is not None:
+        righe = db.session.query(
+            Corso,
+            Insegnante,
+            RiepilogoMensile.incassato,
+            RiepilogoMensile.numero_pagati,
+            RiepilogoMensile.compenso_insegnante
+        ).join(RiepilogoMensile, RiepilogoMensile.corso_id == Corso.id) \
+         .join(Insegnante, Corso.insegnante_id == Insegnante.id) \
+         .options(undefer(Corso.conteggio_iscritti)) \
+         .filter(RiepilogoMensile.anno == anno_filtro,
+                 RiepilogoMensile.mese == mese_filtro,
+                 RiepilogoMensile.numero_pagati > 0) \
+         .order_by(Corso.id) \
+         .all()
+        report_corsi = [
+            ReportCorso(corso, insegnante, incasso, numero, filtro, compenso)
+            for corso, insegnante, incasso, numero, compenso in righe
+        ]
+
+    # Report per insegnanti, raggruppando i corsi già calcolati
+    corsi_per_insegnante = {}
+    for report in report_corsi:
+        corsi_per_insegnante.setdefault(report.insegnante.id, []).append(report)
+
+    report_insegnanti = [
+        ReportInsegnante(corsi_insegnante[0].insegnante, corsi_insegnante)
+        for _, corsi_insegnante in sorted(corsi_per_insegnante.items())
+    ]
+
+    # Riepilogo generale
+    incasso_totale = sum(r.incasso_corso for r in report_corsi)
+    compensi_totali = sum(r.compenso_insegnante for r in report_corsi)
+    riepilogo = {
+        'incasso_totale': incasso_totale,
+        'compensi_totali': compensi_totali,
+        'utile_netto': incasso_totale - compensi_totali,
+        'numero_pagamenti': sum(r.numero_pagamenti for r in report_corsi)
+    }
+
+    return report_corsi, report_insegnanti, riepilogo
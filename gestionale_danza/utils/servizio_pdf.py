@@ -0,0 +1,325 @@
+# utils/servizio_pdf.py
+"""
+Servizio di rendering PDF delle ricevute con un pool di processi persistente.
+I worker importano all'avvio WeasyPrint (se installato) e ReportLab, preparano
+font e stili e li riusano per tutte le ricevute: la richiesta HTTP prepara solo
+il lavoro (HTML già renderizzato e dati semplici) e riceve i byte del PDF.
+
+Configurazione da ambiente:
+- PDF_WORKERS: numero di processi (0 = rendering nel processo chiamante,
+  default min(4, CPU); 0 anche nell'eseguibile PyInstaller)
+- PDF_TIMEOUT: secondi massimi per una ricevuta (default 60)
+
+Questo modulo non importa l'app né i modelli: viene caricato dai worker.
+Come per ogni uso di multiprocessing, gli script che avviano l'app devono
+proteggere il proprio avvio con `if __name__ == '__main__'`: i worker
+importano il modulo principale una volta alla partenza.
+"""
+import io
+import os
+import sys
+import atexit
+import itertools
+import threading
+import importlib.util
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as TimeoutFuturo
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def weasyprint_disponibile():
+    """Verifica (una volta) se WeasyPrint è installato, senza importarlo"""
+    return importlib.util.find_spec('weasyprint') is not None
+
+
+def numero_worker():
+    valore = os.environ.get('PDF_WORKERS')
+    if valore is None:
+        return 0 if getattr(sys, 'frozen', False) else min(4, os.cpu_count() or 1)
+    try:
+        return max(0, int(valore))
+    except ValueError:
+        return 0
+
+
+def timeout_ricevuta():
+    try:
+        return float(os.environ.get('PDF_TIMEOUT', 60))
+    except ValueError:
+        return 60.0
+
+
+# === RENDERING (eseguito nei worker o nel processo chiamante) ===
+
+@lru_cache(maxsize=1)
+def _weasyprint():
+    """Modulo WeasyPrint e configurazione font, creati una volta per processo"""
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+    return weasyprint, FontConfiguration()
+
+
+@lru_cache(maxsize=32)
+def _risorsa_locale(url):
+    """Contenuto delle risorse file:// (es. logo), letto una volta per processo"""
+    weasyprint, _ = _weasyprint()
+    risorsa = weasyprint.default_url_fetcher(url)
+    if 'file_obj' in risorsa:
+        risorsa['string'] = risorsa.pop('file_obj').read()
+    return risorsa
+
+
+def _url_fetcher(url):
+    weasyprint, _ = _weasyprint()
+    if url.startswith('file://'):
+        return dict(_risorsa_locale(url))
+    return weasyprint.default_url_fetcher(url)
+
+
+def _pdf_weasyprint(html):
+    weasyprint, font_config = _weasyprint()
+    buffer = io.BytesIO()
+    weasyprint.HTML(string=html, url_fetcher=_url_fetcher).write_pdf(buffer, font_config=font_config)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=1)
+def _stili_reportlab():
+    """Foglio stili e stili personalizzati della ricevuta, costruiti una volta per processo"""
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=TA_CENTER,
+        textColor=colors.darkblue
+    )
+    table_style = TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ])
+    return styles['Normal'], title_style, table_style
+
+
+def _pdf_reportlab(dati):
+    """Ricevuta ReportLab dai dati semplici del lavoro"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+    from reportlab.lib.units import inch
+
+    normal_style, title_style, table_style = _stili_reportlab()
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    story = []
+
+    # Titolo
+    story.append(Paragraph(f"RICEVUTA PAGAMENTO N° {dati['ricevuta_numero']}", title_style))
+    story.append(Spacer(1, 20))
+
+    # Informazioni azienda
+    azienda = dati.get('azienda')
+    if azienda:
+        company_info = f"<b>{azienda['denominazione_sociale']}</b><br/>"
+        if azienda.get('indirizzo_completo'):
+            company_info += f"{azienda['indirizzo_completo']}<br/>"
+        if azienda.get('telefono'):
+            company_info += f"Tel: {azienda['telefono']}<br/>"
+        if azienda.get('email'):
+            company_info += f"Email: {azienda['email']}"
+
+        story.append(Paragraph(company_info, normal_style))
+        story.append(Spacer(1, 20))
+
+    # Dettagli pagamento
+    data_table = [
+        ['Cliente:', dati['cliente']],
+        ['Corso:', dati['corso']],
+        ['Periodo:', dati['periodo']],
+        ['Importo:', dati['importo']],
+        ['Data Pagamento:', dati['data_pagamento']],
+        ['Metodo:', dati['metodo_pagamento']]
+    ]
+    table = Table(data_table, colWidths=[2*inch, 4*inch])
+    table.setStyle(table_style)
+
+    story.append(table)
+    story.append(Spacer(1, 30))
+
+    # Footer
+    story.append(Paragraph(f"Data emissione: {dati['data_emissione']}", normal_style))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def renderizza_lavoro(lavoro):
+    """
+    Rendering di una ricevuta: WeasyPrint dall'HTML se presente, ReportLab come fallback.
+    Restituisce (pdf, errore): in caso di errore pdf è None.
+    """
+    errore_weasyprint = "WeasyPrint non è installato"
+    if lavoro.get('html') is not None:
+        try:
+            return _pdf_weasyprint(lavoro['html']), None
+        except Exception as e:
+            errore_weasyprint = f"Errore WeasyPrint: {str(e)}"
+
+    try:
+        return _pdf_reportlab(lavoro['dati']), None
+    except Exception as e:
+        return None, f"Impossibile generare PDF: WeasyPrint={errore_weasyprint}, ReportLab=Errore ReportLab: {str(e)}"
+
+
+def _riscalda():
+    """Importa i motori e prepara font e stili con una ricevuta di prova"""
+    if weasyprint_disponibile():
+        try:
+            _weasyprint()
+        except Exception:
+            pass
+    renderizza_lavoro({'html': None, 'dati': {
+        'ricevuta_numero': '00000', 'azienda': None, 'cliente': '-', 'corso': '-', 'periodo': '-',
+        'importo': '-', 'data_pagamento': '-', 'metodo_pagamento': '-', 'data_emissione': '-'
+    }})
+
+
+# === POOL DI PROCESSI ===
+
+def _contesto_multiprocessing():
+    # forkserver: i worker nascono da un processo pulito che ha caricato solo questo modulo
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        contesto = multiprocessing.get_context('forkserver')
+        contesto.set_forkserver_preload([__name__])
+        return contesto
+    return multiprocessing.get_context('spawn')
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=numero_worker(),
+                mp_context=_contesto_multiprocessing(),
+                initializer=_riscalda
+            )
+        return _pool
+
+
+def _scarta_pool(pool):
+    """Elimina un pool guasto: il successivo verrà ricreato"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _ricicla_pool(pool):
+    """
+    Pool con un worker bloccato oltre il timeout: un lavoro in esecuzione non
+    si può annullare, quindi i processi vengono terminati (liberando i posti
+    del pool) e il pool successivo verrà ricreato.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    termina = getattr(pool, 'terminate_workers', None)  # Python 3.14+
+    if termina is not None:
+        termina()
+        return
+    for processo in list((getattr(pool, '_processes', None) or {}).values()):
+        if processo.is_alive():
+            processo.terminate()
+    pool.shutdown(wait=True, cancel_futures=True)
+
+
+@atexit.register
+def chiudi_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def renderizza(lavori, finestra=None):
+    """
+    Rendering di un lotto di ricevute. Accetta un iterabile (anche un generatore) di lavori
+    e restituisce, nello stesso ordine, le coppie (pdf, errore).
+    Tiene in volo al massimo `finestra` lavori, quindi la memoria resta limitata anche
+    per lotti molto grandi; senza worker configurati il rendering avviene qui.
+    """
+    workers = numero_worker()
+    if workers == 0:
+        for lavoro in lavori:
+            yield renderizza_lavoro(lavoro)
+        return
+
+    lavori = iter(lavori)
+    primo = next(lavori, None)
+    if primo is None:
+        return
+    lavori = itertools.chain([primo], lavori)
+
+    finestra = finestra or workers * 2
+    timeout = timeout_ricevuta()
+    pool = _get_pool()
+    in_volo = deque()
+
+    def sottometti(lavoro):
+        try:
+            return pool.submit(renderizza_lavoro, lavoro)
+        except (BrokenProcessPool, RuntimeError):
+            return None
+
+    def invia(lavoro):
+        in_volo.append((lavoro, sottometti(lavoro)))
+
+    for lavoro in lavori:
+        invia(lavoro)
+        if len(in_volo) >= finestra:
+            break
+
+    while in_volo:
+        lavoro, futuro = in_volo.popleft()
+        try:
+            if futuro is None:
+                raise BrokenProcessPool('pool non disponibile')
+            yield futuro.result(timeout=timeout)
+        except BrokenProcessPool:
+            # Worker terminato in modo anomalo: si ricrea il pool e la ricevuta si fa qui
+            _scarta_pool(pool)
+            pool = _get_pool()
+            yield renderizza_lavoro(lavoro)
+        except TimeoutFuturo:
+            # concurrent.futures.TimeoutError: fino a Python 3.10 non è il TimeoutError builtin
+            if not futuro.cancel():
+                # Già in esecuzione: si ricicla il pool e i lavori ancora in
+                # volo (non conclusi) vengono sottomessi al nuovo
+                _ricicla_pool(pool)
+                pool = _get_pool()
+                for indice, (altro, altro_futuro) in enumerate(in_volo):
+                    if altro_futuro is None or not altro_futuro.done() or altro_futuro.cancelled() \
+                            or altro_futuro.exception() is not None:
+                        in_volo[indice] = (altro, sottometti(altro))
+            yield None, f"Impossibile generare PDF: tempo massimo di {timeout:g} secondi superato"
+
+        prossimo = next(lavori, None)
+        if prossimo is not None:
+            invia(prossimo)
@@ -1,8 +1,11 @@
 # utils/stampa_pdf.py
 import os
 import sys
+from collections import deque
 from datetime import datetime
-from flask import render_template
+from flask import render_template, current_app
+from utils.servizio_pdf import renderizza, weasyprint_disponibile
+from utils.cache_ricevute import chiave_ricevuta
 
 def format_currency_it(value):
     """Formatta un numero come valuta italiana: €1.000,00"""
@@ -17,154 +20,162 @@ def format_currency_it(value):
     except (ValueError, TypeError):
         return "€0,00"
 
+def numero_ricevuta_formattato(pagamento):
+    return f"{pagamento.numero_ricevuta:05d}" if pagamento.numero_ricevuta else f"ID{pagamento.id:05d}"
+
+def nome_file_ricevuta(pagamento):
+    return f"RICEVUTA-{numero_ricevuta_formattato(pagamento)}.pdf"
+
+def prepara_lavoro_ricevuta(pagamento, settings=None):
+    """
+    Prepara il lavoro di rendering di una ricevuta per il servizio PDF: HTML già
+    renderizzato (solo se WeasyPrint è disponibile) e dati semplici per ReportLab.
+    Va chiamata con il contesto dell'app; il lavoro non contiene oggetti ORM.
+    """
+    # Numerazione progressiva delle ricevute
+    ricevuta_numero = numero_ricevuta_formattato(pagamento)
+    filename = nome_file_ricevuta(pagamento)
+    
+    if settings is None:
+        # Importa Settings qui per evitare circular imports
+        from models.settings import Settings
+        
+        # Ottieni le impostazioni aziendali
+        settings = Settings.get_settings_cached()
+    
+    data_emissione = datetime.now()
+    
+    html = None
+    if weasyprint_disponibile():
+        # Dati per il template
+        context = {
+            'pagamento': pagamento,
+            'ricevuta_numero': ricevuta_numero,
+            'data_emissione': data_emissione,
+            'moment': datetime.now,
+            'settings': settings
+        }
+        
+        # Path assoluto del logo per WeasyPrint
+        if settings and settings.logo_filename:
+            logo_absolute_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'uploads', settings.logo_filename)
+            context['logo_absolute_path'] = f"file://{os.path.abspath(logo_absolute_path)}"
+        
+        html = render_template('ricevuta.html', **context)
+    
+    azienda = None
+    if settings:
+        azienda = {
+            'denominazione_sociale': settings.denominazione_sociale,
+            'indirizzo_completo': settings.indirizzo_completo,
+            'telefono': settings.telefono,
+            'email': settings.email
+        }
+    
+    return {
+        'filename': filename,
+        'html': html,
+        'dati': {
+            'ricevuta_numero': ricevuta_numero,
+            'azienda': azienda,
+            'cliente': pagamento.cliente.nome_completo,
+            'corso': pagamento.corso.nome,
+            'periodo': pagamento.periodo,
+            'importo': format_currency_it(pagamento.importo),
+            'data_pagamento': pagamento.data_pagamento.strftime('%d/%m/%Y') if pagamento.data_pagamento else 'N/D',
+            'metodo_pagamento': pagamento.metodo_pagamento or 'Contanti',
+            'data_emissione': data_emissione.strftime('%d/%m/%Y')
+        }
+    }
+
+def _cache_ricevute():
+    return current_app.extensions.get('cache_ricevute')
+
+def etag_ricevuta(pagamento, settings=None):
+    """
+    Chiave di contenuto della ricevuta, usata come ETag e come chiave della cache.
+    Solo le ricevute di pagamenti incassati hanno un contenuto stabile: per le
+    altre restituisce None.
+    """
+    if not pagamento.pagato:
+        return None
+    if settings is None:
+        from models.settings import Settings
+        settings = Settings.get_settings_cached()
+    motore = 'weasyprint' if weasyprint_disponibile() else 'reportlab'
+    return chiave_ricevuta(pagamento, settings, motore)
+
+def invalida_ricevuta(pagamento_id):
+    """Rimuove dalla cache le ricevute di un pagamento modificato o eliminato"""
+    cache = _cache_ricevute()
+    if cache is not None:
+        cache.invalida(pagamento_id)
+
 def genera_ricevuta_pdf(pagamento, pdf_folder=None):
     """
     Genera una ricevuta PDF per il pagamento specificato
     Restituisce (pdf_content, filename) per streaming diretto
+    Le ricevute dei pagamenti incassati vengono servite dalla cache se presenti.
     """
+    from models.settings import Settings
+    settings = Settings.get_settings_cached()
+    cache = _cache_ricevute()
+    chiave = etag_ricevuta(pagamento, settings) if cache is not None else None
     
-    # Numerazione progressiva delle ricevute
-    ricevuta_numero = f"{pagamento.numero_ricevuta:05d}" if pagamento.numero_ricevuta else f"ID{pagamento.id:05d}"
-    filename = f"RICEVUTA-{ricevuta_numero}.pdf"
+    if chiave:
+        pdf_content = cache.leggi(pagamento.id, chiave)
+        if pdf_content is not None:
+            return pdf_content, nome_file_ricevuta(pagamento)
     
-    # Importa Settings qui per evitare circular imports
+    lavoro = prepara_lavoro_ricevuta(pagamento, settings)
+    pdf_content, errore = next(renderizza([lavoro]))
+    if errore:
+        raise Exception(errore)
+    if chiave:
+        cache.salva(pagamento.id, chiave, pdf_content)
+    return pdf_content, lavoro['filename']
+
+def genera_ricevute_pdf(pagamenti):
+    """
+    Genera le ricevute di più pagamenti in parallelo con il servizio PDF.
+    Restituisce un generatore di (pagamento, pdf_content, filename, errore) nello
+    stesso ordine dei pagamenti; le ricevute non generate hanno pdf_content None.
+    I lavori vengono preparati man mano, quindi `pagamenti` può essere un generatore.
+    """
     from models.settings import Settings
+    settings = Settings.get_settings_cached()
+    cache = _cache_ricevute()
+    # Pagamenti in ordine: (pagamento, filename, chiave, da_renderizzare)
+    in_coda = deque()
     
-    # Ottieni le impostazioni aziendali
-    settings = Settings.get_settings()
+    def lavori():
+        for pagamento in pagamenti:
+            chiave = etag_ricevuta(pagamento, settings) if cache is not None else None
+            if chiave and cache.contiene(pagamento.id, chiave):
+                # Già in cache: il contenuto viene riletto al momento della consegna
+                in_coda.append((pagamento, nome_file_ricevuta(pagamento), chiave, False))
+                continue
+            lavoro = prepara_lavoro_ricevuta(pagamento, settings)
+            in_coda.append((pagamento, lavoro['filename'], chiave, True))
+            yield lavoro
     
-    # Dati per il template
-    context = {
-        'pagamento': pagamento,
-        'ricevuta_numero': ricevuta_numero,
-        'data_emissione': datetime.now(),
-        'moment': datetime.now,
-        'settings': settings
-    }
+    def consegna_dalla_cache():
+        while in_coda and not in_coda[0][3]:
+            pagamento, filename, chiave, _ = in_coda.popleft()
+            pdf_content = cache.leggi(pagamento.id, chiave)
+            errore = None
+            if pdf_content is None:
+                # Rimossa nel frattempo dalla pulizia LRU
+                pdf_content, errore = next(renderizza([prepara_lavoro_ricevuta(pagamento, settings)]))
+            yield pagamento, pdf_content, filename, errore
     
-    try:
-        # Prova prima con WeasyPrint (preferito)
-        return genera_pdf_weasyprint_memory(context, filename)
-    except Exception as e:
-        try:
-            # Fallback su ReportLab
-            return genera_pdf_reportlab_memory(pagamento, ricevuta_numero, filename)
-        except Exception as e2:
-            raise Exception(f"Impossibile generare PDF: WeasyPrint={e}, ReportLab={e2}")
-
-def genera_pdf_weasyprint_memory(context, filename):
-    """Genera PDF usando WeasyPrint in memoria"""
-    import io
-    try:
-        import weasyprint
-        from flask import render_template
-        import os
-        
-        # Aggiungi il path assoluto del logo al context per WeasyPrint
-        if context.get('settings') and context['settings'].logo_filename:
-            logo_absolute_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'uploads', context['settings'].logo_filename)
-            context['logo_absolute_path'] = f"file://{os.path.abspath(logo_absolute_path)}"
-        
-        # Render del template HTML
-        html_content = render_template('ricevuta.html', **context)
-        
-        # Conversione in PDF in memoria
-        pdf_doc = weasyprint.HTML(string=html_content)
-        pdf_buffer = io.BytesIO()
-        pdf_doc.write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
-        
-        return pdf_buffer.getvalue(), filename
-        
-    except ImportError:
-        raise Exception("WeasyPrint non è installato")
-    except Exception as e:
-        raise Exception(f"Errore WeasyPrint: {str(e)}")
-
-def genera_pdf_reportlab_memory(pagamento, ricevuta_numero, filename):
-    """Genera PDF usando ReportLab in memoria"""
-    import io
-    try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-        from reportlab.lib import colors
-        from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-        from models.settings import Settings
-        
-        # Buffer in memoria
-        buffer = io.BytesIO()
-        
-        # Ottieni le impostazioni aziendali
-        settings = Settings.get_settings()
-        
-        # Crea il documento PDF
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Titolo
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            textColor=colors.darkblue
-        )
-        
-        story.append(Paragraph(f"RICEVUTA PAGAMENTO N° {ricevuta_numero}", title_style))
-        story.append(Spacer(1, 20))
-        
-        # Informazioni azienda
-        if settings:
-            company_info = f"<b>{settings.denominazione_sociale}</b><br/>"
-            if settings.indirizzo_completo:
-                company_info += f"{settings.indirizzo_completo}<br/>"
-            if settings.telefono:
-                company_info += f"Tel: {settings.telefono}<br/>"
-            if settings.email:
-                company_info += f"Email: {settings.email}"
-            
-            story.append(Paragraph(company_info, styles['Normal']))
-            story.append(Spacer(1, 20))
-        
-        # Dettagli pagamento
-        data_table = [
-            ['Cliente:', pagamento.cliente.nome_completo],
-            ['Corso:', pagamento.corso.nome],
-            ['Periodo:', pagamento.periodo],
-            ['Importo:', format_currency_it(pagamento.importo)],
-            ['Data Pagamento:', pagamento.data_pagamento.strftime('%d/%m/%Y') if pagamento.data_pagamento else 'N/D'],
-            ['Metodo:', pagamento.metodo_pagamento or 'Contanti']
-        ]
-        
-        table = Table(data_table, colWidths=[2*inch, 4*inch])
-        table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        
-        story.append(table)
-        story.append(Spacer(1, 30))
-        
-        # Footer
-        footer_text = f"Data emissione: {datetime.now().strftime('%d/%m/%Y')}"
-        story.append(Paragraph(footer_text, styles['Normal']))
-        
-        # Genera PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        return buffer.getvalue(), filename
-        
-    except ImportError:
-        raise Exception("ReportLab non è installato")
-    except Exception as e:
-        raise Exception(f"Errore ReportLab: {str(e)}")
+    for pdf_content, errore in renderizza(lavori()):
+        yield from consegna_dalla_cache()
+        pagamento, filename, chiave, _ = in_coda.popleft()
+        if chiave and pdf_content is not None:
+            cache.salva(pagamento.id, chiave, pdf_content)
+        yield pagamento, pdf_content, filename, errore
+    yield from consegna_dalla_cache()
 
 def genera_pdf_weasyprint(context, pdf_path):
     """Genera PDF usando WeasyPrint"""
@@ -206,7 +217,7 @@ def genera_pdf_reportlab(pagamento, pdf_path, ricevuta_numero):
         from models.settings import Settings
         
         # Ottieni le impostazioni aziendali
-        settings = Settings.get_settings()
+        settings = Settings.get_settings_cached()
         
         # Crea una classe per gestire il footer
         class FooterCanvas(Canvas):
@@ -489,7 +500,7 @@ def genera_compensi_pdf(report_insegnanti, riepilogo, mese, anno, pdf_folder):
     
     # Importa Settings per dati azienda
     from models.settings import Settings
-    settings = Settings.get_settings()
+    settings = Settings.get_settings_cached()
     
     try:
         from reportlab.lib.pagesizes import A4
@@ -659,7 +670,7 @@ def genera_compensi_insegnante_pdf(insegnante, report_insegnante, corsi_insegnan
     
     # Importa Settings per dati azienda
     from models.settings import Settings
-    settings = Settings.get_settings()
+    settings = Settings.get_settings_cached()
     
     try:
         from reportlab.lib.pagesizes import A4
@@ -829,7 +840,7 @@ def genera_compensi_insegnante_pdf(insegnante, report_insegnante, corsi_insegnan
                     corso_report.corso.giorno,
                     corso_report.corso.orario.strftime('%H:%M'),
                     str(corso_report.corso.numero_iscritti),
-                    str(len(corso_report.pagamenti)),
+                    str(corso_report.numero_pagamenti),
                     format_currency_it(corso_report.incasso_corso),
                     f"{corso_report.percentuale_insegnante:.0f}%",
                     format_currency_it(corso_report.compenso_insegnante)
@@ -0,0 +1,236 @@
+# utils/tentativi_accesso.py
+"""
+Archivio dei tentativi di accesso falliti per la protezione brute force.
+Una chiave (l'IP del client) è bloccata se ha accumulato max_tentativi
+fallimenti nell'ultima finestra di `durata` secondi (finestra scorrevole).
+Per deciderlo bastano gli ultimi max_tentativi istanti, quindi ogni chiave
+occupa spazio costante, e il numero di chiavi è limitato: oltre max_chiavi
+viene scartata quella usata meno di recente (LRU).
+
+Due archivi con la stessa interfaccia:
+- ArchivioTentativiMemoria: nel processo, adatto a un solo worker;
+- ArchivioTentativiSQLite: tabella tentativi_accesso nel database dell'app,
+  condivisa da tutti i worker (il blocco non si aggira cambiando processo).
+
+Configurazione da ambiente:
+- LOGIN_ATTEMPTS_BACKEND: sqlite (default) o memory
+- LOGIN_ATTEMPTS_MAX_KEYS: numero massimo di IP tracciati (default 10000)
+- MAX_LOGIN_ATTEMPTS, LOGIN_LOCKOUT_DURATION: soglia e finestra (in app.py)
+"""
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime
+from sqlalchemy import select, insert, delete, func
+
+# Lunghezza massima della chiave salvata (X-Forwarded-For può essere lungo)
+LUNGHEZZA_CHIAVE = 64
+
+
+class ArchivioTentativi(ABC):
+    """Interfaccia comune; gli istanti sono secondi epoch (time.time())"""
+
+    def __init__(self, max_tentativi, durata, max_chiavi):
+        self.max_tentativi = max(int(max_tentativi), 1)
+        self.durata = durata
+        self.max_chiavi = max(int(max_chiavi), 1)
+
+    @staticmethod
+    def _chiave(chiave):
+        return (chiave or '')[:LUNGHEZZA_CHIAVE]
+
+    def _blocco(self, istanti, ora):
+        """Fine del blocco (secondi epoch) dati gli istanti recenti, o None se non bloccata"""
+        recenti = [istante for istante in istanti if ora - istante < self.durata]
+        if len(recenti) < self.max_tentativi:
+            return None
+        # Il blocco cade quando scade il più vecchio degli ultimi max_tentativi
+        return sorted(recenti)[-self.max_tentativi] + self.durata
+
+    def _descrivi(self, chiave, istanti, ora):
+        fine = self._blocco(istanti, ora)
+        if fine is None:
+            return None
+        rimanenti = max(0, int(fine - ora))
+        return {
+            'ip': chiave,
+            'attempts': len([istante for istante in istanti if ora - istante < self.durata]),
+            'last_attempt': datetime.fromtimestamp(max(istanti)),
+            'remaining_minutes': rimanenti // 60,
+            'remaining_seconds': rimanenti % 60
+        }
+
+    @abstractmethod
+    def registra_fallimento(self, chiave):
+        """Registra un tentativo fallito della chiave"""
+
+    @abstractmethod
+    def bloccato(self, chiave):
+        """True se la chiave ha raggiunto max_tentativi nella finestra"""
+
+    @abstractmethod
+    def azzera(self, chiave):
+        """Dimentica i tentativi della chiave; True se ne aveva"""
+
+    @abstractmethod
+    def azzera_tutti(self):
+        """Dimentica tutti i tentativi; restituisce il numero di chiavi con tentativi non scaduti"""
+
+    @abstractmethod
+    def bloccati(self):
+        """Chiavi bloccate ora, per la pagina di amministrazione"""
+
+
+class ArchivioTentativiMemoria(ArchivioTentativi):
+    """Chiavi in ordine LRU, per ognuna gli ultimi max_tentativi istanti"""
+
+    def __init__(self, max_tentativi, durata, max_chiavi):
+        super().__init__(max_tentativi, durata, max_chiavi)
+        self._tentativi = OrderedDict()
+        self._lock = threading.Lock()
+
+    def registra_fallimento(self, chiave):
+        chiave = self._chiave(chiave)
+        with self._lock:
+            istanti = self._tentativi.get(chiave)
+            if istanti is None:
+                istanti = self._tentativi[chiave] = deque(maxlen=self.max_tentativi)
+            else:
+                self._tentativi.move_to_end(chiave)
+            istanti.append(time.time())
+            while len(self._tentativi) > self.max_chiavi:
+                self._tentativi.popitem(last=False)
+
+    def bloccato(self, chiave):
+        chiave = self._chiave(chiave)
+        ora = time.time()
+        with self._lock:
+            istanti = self._tentativi.get(chiave)
+            if not istanti:
+                return False
+            if ora - istanti[-1] >= self.durata:
+                # Tutti scaduti
+                del self._tentativi[chiave]
+                return False
+            return self._blocco(istanti, ora) is not None
+
+    def azzera(self, chiave):
+        with self._lock:
+            return self._tentativi.pop(self._chiave(chiave), None) is not None
+
+    def azzera_tutti(self):
+        ora = time.time()
+        with self._lock:
+            quante = sum(1 for istanti in self._tentativi.values() if istanti and ora - istanti[-1] < self.durata)
+            self._tentativi.clear()
+            return quante
+
+    def bloccati(self):
+        ora = time.time()
+        with self._lock:
+            for chiave in [chiave for chiave, istanti in self._tentativi.items()
+                           if not istanti or ora - istanti[-1] >= self.durata]:
+                del self._tentativi[chiave]
+            voci = [(chiave, list(istanti)) for chiave, istanti in self._tentativi.items()]
+        return [descrizione for chiave, istanti in voci
+                if (descrizione := self._descrivi(chiave, istanti, ora)) is not None]
+
+
+class ArchivioTentativiSQLite(ArchivioTentativi):
+    """
+    Tentativi nella tabella tentativi_accesso. Ogni operazione usa una propria
+    transazione sull'engine, indipendente dalla sessione della richiesta.
+    """
+
+    def __init__(self, max_tentativi, durata, max_chiavi, engine):
+        super().__init__(max_tentativi, durata, max_chiavi)
+        from models import TentativoAccesso
+        self.engine = engine
+        self.tabella = TentativoAccesso.__table__
+
+    def registra_fallimento(self, chiave):
+        chiave = self._chiave(chiave)
+        t = self.tabella
+        ora = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(insert(t).values(chiave=chiave, istante=ora))
+            # Della chiave servono solo gli ultimi max_tentativi
+            ultimi = select(t.c.id).where(t.c.chiave == chiave) \
+                .order_by(t.c.istante.desc(), t.c.id.desc()).limit(self.max_tentativi)
+            conn.execute(delete(t).where(t.c.chiave == chiave, t.c.id.not_in(ultimi)))
+            # Tentativi scaduti di tutte le chiavi
+            conn.execute(delete(t).where(t.c.istante <= ora - self.durata))
+            # Limite sulle chiavi: via quelle con l'ultimo tentativo più vecchio
+            chiavi = conn.execute(select(func.count(t.c.chiave.distinct()))).scalar()
+            if chiavi > self.max_chiavi:
+                vecchie = select(t.c.chiave).group_by(t.c.chiave) \
+                    .order_by(func.max(t.c.istante)).limit(chiavi - self.max_chiavi)
+                conn.execute(delete(t).where(t.c.chiave.in_(vecchie)))
+
+    def _istanti(self, conn, chiave, ora):
+        t = self.tabella
+        return conn.execute(
+            select(t.c.istante).where(t.c.chiave == chiave, t.c.istante > ora - self.durata)
+        ).scalars().all()
+
+    def bloccato(self, chiave):
+        ora = time.time()
+        with self.engine.connect() as conn:
+            istanti = self._istanti(conn, self._chiave(chiave), ora)
+        return self._blocco(istanti, ora) is not None
+
+    def azzera(self, chiave):
+        t = self.tabella
+        with self.engine.begin() as conn:
+            return conn.execute(delete(t).where(t.c.chiave == self._chiave(chiave))).rowcount > 0
+
+    def azzera_tutti(self):
+        t = self.tabella
+        ora = time.time()
+        with self.engine.begin() as conn:
+            # Le righe scadute non ancora rimosse non contano
+            quante = conn.execute(
+                select(func.count(t.c.chiave.distinct())).where(t.c.istante > ora - self.durata)
+            ).scalar()
+            conn.execute(delete(t))
+        return quante
+
+    def bloccati(self):
+        t = self.tabella
+        ora = time.time()
+        with self.engine.connect() as conn:
+            righe = conn.execute(
+                select(t.c.chiave, t.c.istante).where(t.c.istante > ora - self.durata)
+                .order_by(t.c.chiave)
+            ).all()
+        per_chiave = OrderedDict()
+        for chiave, istante in righe:
+            per_chiave.setdefault(chiave, []).append(istante)
+        return [descrizione for chiave, istanti in per_chiave.items()
+                if (descrizione := self._descrivi(chiave, istanti, ora)) is not None]
+
+
+def init_tentativi_accesso(app, db, max_tentativi, durata):
+    """
+    Crea l'archivio scelto con LOGIN_ATTEMPTS_BACKEND e lo registra in
+    app.extensions['tentativi_accesso'].
+    """
+    backend = os.environ.get('LOGIN_ATTEMPTS_BACKEND', 'sqlite').strip().lower()
+    try:
+        max_chiavi = int(os.environ.get('LOGIN_ATTEMPTS_MAX_KEYS', 10000))
+    except ValueError:
+        max_chiavi = 10000
+
+    if backend == 'memory':
+        archivio = ArchivioTentativiMemoria(max_tentativi, durata, max_chiavi)
+    else:
+        if backend != 'sqlite':
+            print(f"⚠️ LOGIN_ATTEMPTS_BACKEND={backend} non valido, uso sqlite")
+        with app.app_context():
+            engine = db.engine
+        archivio = ArchivioTentativiSQLite(max_tentativi, durata, max_chiavi, engine)
+
+    app.extensions['tentativi_accesso'] = archivio
+    return archivio
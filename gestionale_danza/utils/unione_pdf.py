@@ -0,0 +1,189 @@
+# utils/unione_pdf.py
+"""
+Unione incrementale di PDF in un unico documento.
+Ogni PDF aggiunto viene letto con pypdf e le sue pagine (con tutti gli oggetti
+collegati: font, immagini, contenuti) vengono scritte subito nell'output con
+numeri di oggetto nuovi. In memoria restano solo gli offset degli oggetti e i
+numeri delle pagine, quindi l'occupazione non dipende dalla dimensione dei PDF
+già uniti. L'albero delle pagine, il catalogo e la tabella xref vengono
+scritti alla chiusura.
+
+Richiede pypdf (pip install pypdf).
+"""
+import io
+
+# Oggetti riservati: catalogo e radice dell'albero delle pagine
+NUMERO_CATALOGO = 1
+NUMERO_PAGINE = 2
+# Attributi che una pagina può ereditare dai nodi /Pages antenati
+ATTRIBUTI_EREDITABILI = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+def pypdf_disponibile():
+    try:
+        import pypdf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class UnionePDF:
+    """
+    Uso:
+        unione = UnionePDF()
+        yield unione.intestazione()
+        for pdf in documenti:
+            yield unione.aggiungi(pdf)
+        yield unione.chiudi()
+    Ogni metodo restituisce i byte da accodare all'output.
+    """
+
+    def __init__(self):
+        from pypdf import PdfReader
+        from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+        self._PdfReader = PdfReader
+        self._ArrayObject = ArrayObject
+        self._DictionaryObject = DictionaryObject
+        self._IndirectObject = IndirectObject
+        self._NameObject = NameObject
+        self._NumberObject = NumberObject
+        self._StreamObject = StreamObject
+
+        self._posizione = 0
+        self._offset = [None, None, None]  # indice = numero oggetto (0 non usato)
+        self._pagine = []
+        self._buffer = io.BytesIO()
+
+    # === SCRITTURA ===
+
+    def _scrivi(self, dati):
+        self._buffer.write(dati)
+        self._posizione += len(dati)
+
+    def _svuota_buffer(self):
+        dati = self._buffer.getvalue()
+        self._buffer = io.BytesIO()
+        return dati
+
+    def _nuovo_numero(self):
+        self._offset.append(None)
+        return len(self._offset) - 1
+
+    def _rif(self, numero):
+        return self._IndirectObject(numero, 0, None)
+
+    def _scrivi_oggetto(self, numero, oggetto, contenuto_stream=None):
+        self._offset[numero] = self._posizione
+        serializzato = io.BytesIO()
+        serializzato.write(f'{numero} 0 obj\n'.encode('ascii'))
+        if contenuto_stream is not None:
+            oggetto[self._NameObject('/Length')] = self._NumberObject(len(contenuto_stream))
+            oggetto.write_to_stream(serializzato)
+            serializzato.write(b'\nstream\n')
+            serializzato.write(contenuto_stream)
+            serializzato.write(b'\nendstream')
+        else:
+            oggetto.write_to_stream(serializzato)
+        serializzato.write(b'\nendobj\n')
+        self._scrivi(serializzato.getvalue())
+
+    # === COPIA DEGLI OGGETTI ===
+
+    def _rinumera(self, valore, mappa, coda):
+        """Copia di un valore con i riferimenti indiretti rinumerati; accoda gli oggetti da copiare"""
+        if isinstance(valore, self._IndirectObject):
+            chiave = (valore.idnum, valore.generation)
+            if chiave not in mappa:
+                mappa[chiave] = self._nuovo_numero()
+                coda.append(valore)
+            return self._rif(mappa[chiave])
+        if isinstance(valore, self._DictionaryObject):
+            copia = self._DictionaryObject()
+            for chiave, elemento in dict.items(valore):
+                if chiave != '/Length' or not isinstance(valore, self._StreamObject):
+                    copia[chiave] = self._rinumera(elemento, mappa, coda)
+            return copia
+        if isinstance(valore, self._ArrayObject):
+            return self._ArrayObject(self._rinumera(elemento, mappa, coda) for elemento in valore)
+        return valore
+
+    def _ereditato(self, pagina, chiave):
+        """Valore (riferimenti compresi) dell'attributo nel primo nodo /Pages antenato che lo definisce"""
+        nodo = pagina.get('/Parent')
+        visitati = set()
+        while nodo is not None and id(nodo) not in visitati:
+            visitati.add(id(nodo))
+            if chiave in nodo:
+                return dict.__getitem__(nodo, chiave)
+            nodo = nodo.get('/Parent')
+        return None
+
+    def _copia_collegati(self, mappa, coda):
+        while coda:
+            riferimento = coda.pop()
+            oggetto = riferimento.get_object()
+            numero = mappa[(riferimento.idnum, riferimento.generation)]
+            copia = self._rinumera(oggetto, mappa, coda)
+            if isinstance(oggetto, self._StreamObject):
+                # Dati del flusso così come sono nel file (già compressi)
+                self._scrivi_oggetto(numero, copia, contenuto_stream=oggetto._data)
+            else:
+                self._scrivi_oggetto(numero, copia)
+
+    # === API ===
+
+    def intestazione(self):
+        self._scrivi(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        return self._svuota_buffer()
+
+    def aggiungi(self, contenuto):
+        """Accoda tutte le pagine di un PDF (bytes)"""
+        lettore = self._PdfReader(io.BytesIO(contenuto))
+        mappa = {}
+        for pagina in lettore.pages:
+            riferimento = pagina.indirect_reference
+            numero = self._nuovo_numero()
+            mappa[(riferimento.idnum, riferimento.generation)] = numero
+            self._pagine.append(numero)
+
+            coda = []
+            copia = self._DictionaryObject()
+            for chiave, elemento in dict.items(pagina):
+                if chiave != '/Parent':
+                    copia[chiave] = self._rinumera(elemento, mappa, coda)
+            # L'albero delle pagine viene sostituito: gli attributi ereditati vanno sulla pagina
+            for chiave in ATTRIBUTI_EREDITABILI:
+                if chiave not in copia:
+                    valore = self._ereditato(pagina, chiave)
+                    if valore is not None:
+                        copia[self._NameObject(chiave)] = self._rinumera(valore, mappa, coda)
+            copia[self._NameObject('/Parent')] = self._rif(NUMERO_PAGINE)
+            self._scrivi_oggetto(numero, copia)
+            self._copia_collegati(mappa, coda)
+        return self._svuota_buffer()
+
+    def chiudi(self):
+        """Albero delle pagine, catalogo, xref e trailer"""
+        pagine = self._DictionaryObject({
+            self._NameObject('/Type'): self._NameObject('/Pages'),
+            self._NameObject('/Kids'): self._ArrayObject(self._rif(numero) for numero in self._pagine),
+            self._NameObject('/Count'): self._NumberObject(len(self._pagine)),
+        })
+        self._scrivi_oggetto(NUMERO_PAGINE, pagine)
+        catalogo = self._DictionaryObject({
+            self._NameObject('/Type'): self._NameObject('/Catalog'),
+            self._NameObject('/Pages'): self._rif(NUMERO_PAGINE),
+        })
+        self._scrivi_oggetto(NUMERO_CATALOGO, catalogo)
+
+        inizio_xref = self._posizione
+        righe = [f'xref\n0 {len(self._offset)}\n', '0000000000 65535 f \n']
+        righe.extend(f'{offset:010d} 00000 n \n' for offset in self._offset[1:])
+        righe.append(f'trailer\n<< /Size {len(self._offset)} /Root {NUMERO_CATALOGO} 0 R >>\n')
+        righe.append(f'startxref\n{inizio_xref}\n%%EOF\n')
+        self._scrivi(''.join(righe).encode('ascii'))
+        return self._svuota_buffer()
+
+    @property
+    def numero_pagine(self):
+        return len(self._pagine)